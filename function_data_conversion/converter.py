@@ -1,45 +1,110 @@
-import concurrent.futures
+import asyncio
+from dataclasses import replace
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, TypeVar
 
 import requests
 
-from data_classes import Army_names, ArmyEntry
+from data_classes import ArmyEntry
+from line_classifier import (Classified_line, Line_types, classify_lines,
+                             iter_classified_lines)
 from multi_error import Multi_Error
 from new_recruit_parser import new_recruit_parser
-from ninth_builder import format_army_block
+from ninth_builder import format_army_block, ninth_builder_host
+from upstream_pool import Upstream_pool, get_upstream_pool
 from utility_functions import (Write_army_lists_to_json_file,
-                               clean_lines)
+                               iter_clean_lines)
 
+K = TypeVar("K", bound=Hashable)
 
-def Convert_lines_to_army_list(event_name: str, event_date: Optional[datetime], lines: List[str], session: Optional[requests.Session]=None) -> List[ArmyEntry]:
-    errors: List[Exception] = []
 
-    army_list: List[ArmyEntry] = []
+def Convert_lines_to_army_list(event_name: str, event_date: Optional[datetime], lines: Iterable[str], session: Optional[requests.Session]=None) -> List[ArmyEntry]:
+    """Lines can be a generator, each army block is sent off for formatting as soon as it has been read
+    """
+    return asyncio.run(
+        Convert_lines_to_army_list_async(event_name=event_name, event_date=event_date, lines=lines, session=session)
+    )
+
+
+async def Convert_lines_to_army_list_async(event_name: str, event_date: Optional[datetime], lines: Iterable[str], session: Optional[requests.Session]=None) -> List[ArmyEntry]:
+    """Formatting runs on the shared 9th Builder pool, so concurrent conversions share its keep-alive
+    connections and its concurrency cap instead of each spinning up their own threads and sessions
+    """
+    pool = get_upstream_pool(ninth_builder_host)
+    return await _convert_lines(event_name, event_date, lines, datetime.now(timezone.utc), pool, session or pool.session)
+
+
+def Convert_lists_to_army_lists(
+    event_name: str, event_date: Optional[datetime], lists: Dict[K, Iterable[str]], session: Optional[requests.Session]=None
+) -> Tuple[Dict[K, List[ArmyEntry]], Dict[K, Multi_Error]]:
+    """Convert_lines_to_army_list for many lists at once, e.g. every player of an event keyed by their id
+
+    Every block of every list is in flight on the shared 9th Builder pool together, rather than one list at a time
+
+    Returns:
+        the armies of each list that converted and the errors of each list that didn't
+    """
+    return asyncio.run(Convert_lists_to_army_lists_async(event_name=event_name, event_date=event_date, lists=lists, session=session))
 
-    cleaned_lines = clean_lines(lines)
 
-    armyblocks = split_lines_into_blocks(cleaned_lines)
-    event_size = len(armyblocks)
+async def Convert_lists_to_army_lists_async(
+    event_name: str, event_date: Optional[datetime], lists: Dict[K, Iterable[str]], session: Optional[requests.Session]=None
+) -> Tuple[Dict[K, List[ArmyEntry]], Dict[K, Multi_Error]]:
+    pool = get_upstream_pool(ninth_builder_host)
     ingest_date = datetime.now(timezone.utc)
+    keys = list(lists)
+    results = await asyncio.gather(
+        *[_convert_lines(event_name, event_date, lists[key], ingest_date, pool, session or pool.session) for key in keys],
+        return_exceptions=True,
+    )
+
+    army_lists: Dict[K, List[ArmyEntry]] = {}
+    errors: Dict[K, Multi_Error] = {}
+    for key, result in zip(keys, results):
+        if isinstance(result, Multi_Error):
+            errors[key] = result
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            army_lists[key] = result
+    return army_lists, errors
+
+
+async def _convert_lines(
+    event_name: str,
+    event_date: Optional[datetime],
+    lines: Iterable[str],
+    ingest_date: datetime,
+    pool: Upstream_pool,
+    session: requests.Session,
+) -> List[ArmyEntry]:
+    errors: List[Exception] = []
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        for block in armyblocks:
-            futures.append(
-                executor.submit(
-                    proccess_block, block, event_size, event_name, ingest_date, event_date, session
-                )
+    army_list: List[ArmyEntry] = []
+
+    armyblocks = iter_army_blocks(iter_classified_lines(iter_clean_lines(lines)))
+
+    futures = []
+    for block in armyblocks:
+        futures.append(
+            pool.run(
+                proccess_block, block, None, event_name, ingest_date, event_date, session
             )
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                army_list.append(future.result())
-            except ValueError as e:
-                errors.append(e)
+        )
+    # the event size is only known once the whole document has been read
+    event_size = len(futures)
+    for result in await asyncio.gather(*futures, return_exceptions=True):
+        if isinstance(result, ValueError):
+            errors.append(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            result.event_size = event_size
+            army_list.append(result)
 
     if len(army_list) == 0:
-        errors.append(ValueError(f"No Army lists were found in\n{lines}"))
+        errors.append(ValueError(f"No Army lists were found in\n{lines if isinstance(lines, list) else event_name}"))
 
     if b:=[x for x in army_list if not x.army]:
         errors.append(ValueError(f"armylist: {b}\n armylist.army was None"))
@@ -56,70 +121,116 @@ def split_lines_into_blocks(lines: List[str]) -> List[List[str]]:
     Args:
         lines (List[str]): lines of a file
     """
-    active_block: List[str] = []
-    armyblocks = []
-    previousLine = ""
-    for i, line in enumerate(lines):
+    return [
+        [line.text for line in block]
+        for block in split_classified_lines_into_blocks(classify_lines(lines))
+    ]
+
+
+def split_classified_lines_into_blocks(
+    lines: List[Classified_line],
+) -> List[List[Classified_line]]:
+    """break classified file lines into army blocks, the first line of each block is tagged as the player name
+
+    Args:
+        lines (List[Classified_line]): output of classify_lines()
+    """
+    return list(iter_army_blocks(lines))
+
+
+def iter_army_blocks(lines: Iterable[Classified_line]) -> Iterator[List[Classified_line]]:
+    """Generator version of split_classified_lines_into_blocks(), a block is yielded as soon as its total points line is seen
+
+    Args:
+        lines (Iterable[Classified_line]): classified lines of a file
+    """
+    active_block: List[Classified_line] = []
+    found_block = False
+    # only needed if no army block is ever found, in which case the whole file is treated as one block
+    unblocked_lines: List[Classified_line] = []
+    previousLine = Classified_line(text="", line_type=Line_types.NOISE)
+    for line in lines:
         # look for list starting
-        found_army_name = Army_names.get(line.upper())
-        if found_army_name:
+        if line.army_name:
+            found_block = True
+            unblocked_lines = []
             if active_block:  # found a new list but haven't ended the old list yet.
                 # remove the last line from the old block as its the player name of the new active_block
                 previousLine = active_block.pop()
                 # end the old block
-                armyblocks.append(active_block)
+                yield active_block
 
             # start new block including previous lines
             # using previous line as the player name usual precedes the army name
-            active_block = [previousLine]
+            active_block = [replace(previousLine, line_type=Line_types.PLAYER_NAME)]
+        elif not found_block:
+            unblocked_lines.append(line)
 
         # storing lines from an active block
         if active_block:
             active_block.append(line)
 
             # look for list ending
-            total_points = new_recruit_parser.detect_total_points(line)
-            if total_points:
-                armyblocks.append(active_block)
+            if line.total_points:
+                yield active_block
                 active_block = []
-            elif i == len(lines) - 1:
-                armyblocks.append(active_block)
 
         previousLine = line
 
-    if armyblocks == []:
-        armyblocks.append(lines)
-    return armyblocks
+    # the file ended before the last list had a total
+    if active_block:
+        yield active_block
+
+    # an empty file has no block at all, rather than one with no player name to read
+    if not found_block and unblocked_lines:
+        yield unblocked_lines
+
+
+def read_block_headers(lines: Iterable[str]) -> List[ArmyEntry]:
+    """Player name and army of each block straight from the file, without formatting or parsing the units
+
+    Cheap enough to check names against TK before any list is sent off to be formatted
+    """
+    headers = []
+    for armyblock in iter_army_blocks(iter_classified_lines(iter_clean_lines(lines))):
+        headers.append(
+            ArmyEntry(
+                player_name=armyblock[0].text.strip(" -–"),
+                army=next((x.army_name for x in armyblock if x.army_name), None),
+                list_as_str="\n".join([x.text for x in armyblock[1:]]),
+            )
+        )
+    return headers
 
 
 def parse_army_block(
-    armyblock: List[str],
+    armyblock: List[Classified_line],
     tournament_name: str,
-    event_size: int,
+    event_size: Optional[int],
     ingest_date: datetime,
 ) -> ArmyEntry:
     
-    army = new_recruit_parser().parse_block(lines=armyblock)
+    army = new_recruit_parser().parse_classified_block(lines=armyblock)
     army.ingest_date = ingest_date
     army.event_size = event_size
-    army.player_name = armyblock[0].strip(" -–")
+    army.player_name = armyblock[0].text.strip(" -–")
     army.tournament = tournament_name
-    army.list_as_str = "\n".join(armyblock[1:]) #ignore player name
+    army.list_as_str = "\n".join([x.text for x in armyblock[1:]]) #ignore player name
     army.calculate_total_points()
     return army
 
 def proccess_block(
-    armyblock: List[str],
-    event_size: int,
+    armyblock: List[Classified_line],
+    event_size: Optional[int],
     event_name: str,
     ingest_date: datetime,
     event_date: Optional[datetime],
     session: Optional[requests.Session]=None,
 ) -> ArmyEntry:
-    formated_block = format_army_block(army_block=armyblock, filename=event_name, event_date=event_date, session=session)
+    formated_block = format_army_block(army_block=[x.text for x in armyblock], filename=event_name, event_date=event_date, session=session)
     if formated_block and formated_block.formated:
-        armyblock = formated_block.formated.split("\n")
-    
+        # the formatter rewrites the block so the old classifications no longer apply
+        armyblock = classify_lines(formated_block.formated.split("\n"))
 
     # parse block into army object
     army = parse_army_block(
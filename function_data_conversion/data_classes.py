@@ -220,7 +220,9 @@ class Tk_info:
     players_per_team: Optional[int] = None
 
 
-@dataclass
+# The entries below are slotted as a Fading Flame backfill holds hundreds of thousands of them at once,
+# so they must not grow attributes outside of their declared fields.
+@dataclass(slots=True)
 class UnitEntry:
     """Keeping track of a single unit entry as part of a list"""
 
@@ -233,7 +235,7 @@ class UnitEntry:
     upgrades: Optional[list[str]] = None  # musician and banner
 
 
-@dataclass
+@dataclass(slots=True)
 class Round:
     opponent: Optional[UUID] = None  # Expect that this is an army_uuid
     result: Optional[int] = None
@@ -251,7 +253,7 @@ class Round:
     spells_selected: Optional[list[str]] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class ArmyEntry:
     """class to hold entire army list"""
 
@@ -314,9 +316,9 @@ class ArmyEntry:
         for x in self.units or []:
             if x.dead:
                 points += x.points
-                if "general" in str(x.upgrades):
+                if any("general" in upgrade for upgrade in x.upgrades or []):
                     points += 200
-                if "battle standard bearer" in str(x.upgrades):
+                if any("battle standard bearer" in upgrade for upgrade in x.upgrades or []):
                     points += 200
             elif x.half:
                 points += math.ceil(x.points / 2)
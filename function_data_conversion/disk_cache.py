@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+
+def cache_key(*parts: Optional[str]) -> str:
+    """Content address for a cache entry, None and "" are treated the same"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class Disk_cache:
+    """JSON documents on local disk keyed by a content hash, with an optional Google Cloud Storage tier
+
+    Local disk in a cloud function is /tmp which lives in memory, so the local tier is bounded by `max_entries`
+    and evicts the least recently used entries. The GCS tier is what survives between instances.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        directory: str,
+        ttl_seconds: float,
+        max_entries: int,
+        bucket_name: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.bucket_name = bucket_name
+        self._bucket = None
+        self._entry_count: Optional[int] = None
+        self._lock = Lock()
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+        }
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _blob_name(self, key: str) -> str:
+        return f"{self.name}/{key}.json"
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.time() - stored_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._get_local(key)
+        if entry is None and self.bucket_name:
+            entry = self._get_remote(key)
+            if entry is not None:
+                self._set_local(key, entry)
+                self.remote_hits += 1
+                return entry["value"]
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["value"]
+
+    def set(self, key: str, value: dict) -> None:
+        entry = {"stored_at": time.time(), "value": value}
+        self._set_local(key, entry)
+        if self.bucket_name:
+            self._set_remote(key, entry)
+
+    def _get_local(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if self._expired(entry.get("stored_at", 0)):
+            self._remove(path)
+            return None
+        # bump the modified time so eviction is least recently used rather than oldest written
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _set_local(self, key: str, entry: dict) -> None:
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            existed = path.exists()
+            # write then rename so a concurrent reader never sees half a file
+            with tempfile.NamedTemporaryFile("w", dir=path.parent, delete=False, encoding="utf-8") as tmp_file:
+                json.dump(entry, tmp_file)
+            os.replace(tmp_file.name, path)
+        except OSError as e:
+            print(f"{self.name} cache write failed: {e}")
+            return
+        if not existed:
+            self._track_new_entry()
+
+    def _track_new_entry(self) -> None:
+        with self._lock:
+            if self._entry_count is None:
+                self._entry_count = sum(1 for _ in self.directory.glob("*/*.json"))
+            else:
+                self._entry_count += 1
+            if self._entry_count > self.max_entries:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drop the least recently used tenth of the entries, doing it in chunks keeps the directory scans rare"""
+        entries = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        keep = max(self.max_entries - self.max_entries // 10, 0)
+        for _, path in entries[: max(len(entries) - keep, 0)]:
+            self._remove(path)
+        self._entry_count = min(len(entries), keep)
+
+    @staticmethod
+    def _remove(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def _get_bucket(self):
+        if self._bucket is None:
+            import google.cloud.storage
+
+            self._bucket = google.cloud.storage.Client().bucket(self.bucket_name)
+        return self._bucket
+
+    def _get_remote(self, key: str) -> Optional[dict]:
+        try:
+            blob = self._get_bucket().get_blob(self._blob_name(key))
+            if blob is None:
+                return None
+            entry = json.loads(blob.download_as_bytes())
+        except Exception as e:
+            # the remote tier is only ever an optimisation
+            print(f"{self.name} cache remote read failed: {e}")
+            return None
+        if self._expired(entry.get("stored_at", 0)):
+            return None
+        return entry
+
+    def _set_remote(self, key: str, entry: dict) -> None:
+        try:
+            self._get_bucket().blob(self._blob_name(key)).upload_from_string(
+                json.dumps(entry), content_type="application/json"
+            )
+        except Exception as e:
+            print(f"{self.name} cache remote write failed: {e}")
@@ -0,0 +1,105 @@
+import re
+import string
+from dataclasses import dataclass
+from enum import Enum, auto, unique
+from typing import Iterable, Iterator, List, Optional
+
+from data_classes import Army_names
+
+
+@unique
+class Line_types(Enum):
+    PLAYER_NAME = auto()
+    ARMY_NAME = auto()
+    UNIT_LINE = auto()
+    TOTAL_POINTS = auto()
+    NOISE = auto()
+
+
+# "630 - Death Cult Hierarch" -> "<number> - <unit name>, upgrades"
+unit_line_regex = re.compile(r"^(\d{2,4}?)(?: ?[\W ] ?)(.+)")
+
+total_points_words = ("total", "army", "cost", "pts", "points")
+punctuation_table = str.maketrans(dict.fromkeys(string.punctuation))
+
+
+@dataclass
+class Classified_line:
+    """A single line of a list file, with everything we need to know about it worked out once
+
+    All three detections are stored rather than just the `line_type` because the splitter and the parser
+    check them in different orders, e.g. "4499 pts" is both a unit line and a total points line.
+    """
+
+    text: str
+    line_type: Line_types
+    army_name: Optional[str] = None
+    total_points: Optional[int] = None
+    is_unit_line: bool = False
+
+
+def detect_army_name(line: str) -> Optional[str]:
+    return Army_names.get(line.strip().upper())
+
+
+def detect_total_points(line: str) -> Optional[int]:
+    # Examples
+    # Total Army Cost: 4499 pts
+    # 4498pts
+    cleaned_line = line.lower()
+    for word in total_points_words:
+        cleaned_line = cleaned_line.replace(word, "")
+    cleaned_line = cleaned_line.translate(punctuation_table).strip()
+
+    # simple case where its just the number
+    try:
+        points = int(cleaned_line)
+    except ValueError:
+        return None
+    if 2000 <= points <= 4500:
+        return points
+    return None
+
+
+def is_unit_line(line: str) -> bool:
+    return unit_line_regex.search(line.lower().strip(".")) is not None
+
+
+def classify_line(line: str) -> Classified_line:
+    army_name = detect_army_name(line)
+    total_points = detect_total_points(line)
+    unit_line = is_unit_line(line)
+
+    if army_name:
+        line_type = Line_types.ARMY_NAME
+    elif total_points:
+        line_type = Line_types.TOTAL_POINTS
+    elif unit_line:
+        line_type = Line_types.UNIT_LINE
+    else:
+        line_type = Line_types.NOISE
+
+    return Classified_line(
+        text=line,
+        line_type=line_type,
+        army_name=army_name,
+        total_points=total_points,
+        is_unit_line=unit_line,
+    )
+
+
+def classify_lines(lines: Iterable[str]) -> List[Classified_line]:
+    """Tag every line once so that block splitting and block parsing can share the work
+
+    Args:
+        lines (Iterable[str]): cleaned lines of a file
+
+    Returns:
+        List[Classified_line]: one entry per line, in the same order
+    """
+    return list(iter_classified_lines(lines))
+
+
+def iter_classified_lines(lines: Iterable[str]) -> Iterator[Classified_line]:
+    for line in lines:
+        yield classify_line(line)
@@ -20,9 +20,13 @@ from converter import Write_army_lists_to_json_file
 from fading_flame import armies_from_fading_flame
 from game_report import armies_from_report
 from multi_error import Multi_Error
-from new_recruit_tournaments import armies_from_NR_tournament
-from tourney_keeper import armies_from_docx
-from utility_functions import Docx_to_line_list
+from new_recruit_tournaments import armies_from_NR_tournament, nr_library_cache
+from ninth_builder import format_cache
+from resilience import latency_stats, start_invocation_deadline
+from single_flight import single_flight_stats
+from string_pool import unit_strings
+from tourney_keeper import armies_from_docx, tk_catalogue
+from utility_functions import iter_docx_lines, upload_option
 from warhall import armies_from_warhall
 
 # Configure logger
@@ -62,6 +66,8 @@ def function_data_conversion(request: Request) -> tuple[dict, int]:
 
     data = request.json["data"]
     logger.info(f"{request.json=}")
+    format_cache.reset_stats()
+    start_invocation_deadline()
 
     list_of_armies = []
     parsing_errors = []
@@ -93,9 +99,14 @@ def function_data_conversion(request: Request) -> tuple[dict, int]:
                 )
 
                 event_name = Path(download_file_path).stem
-                lines = Docx_to_line_list(download_file_path)
+                lines = iter_docx_lines(download_file_path)
 
-                list_of_armies, tk_loaded, possible_matches = armies_from_docx(event_name, lines)
+                list_of_armies, tk_loaded, possible_matches = armies_from_docx(
+                    event_name,
+                    lines,
+                    refresh_tk=bool(upload_option(data, "refresh_tk")),
+                    match_first=upload_option(data, "match_first"),
+                )
             except Multi_Error as e:
                 logger.error(f"Multi_ErrorWD: {[str(x) for x in e.errors]}")
                 parsing_errors.extend([str(x) for x in e.errors])
@@ -191,8 +202,9 @@ def function_data_conversion(request: Request) -> tuple[dict, int]:
                     print(
                         f"Downloaded {file_name} from newrecruit_tournaments to {download_file_path}"
                     )
-                with open(download_file_path, "r") as json_file:
-                    data = json.load(json_file)
+                # decoded by armies_from_NR_tournament, straight from the bytes if NR_DECODER allows
+                with open(download_file_path, "rb") as json_file:
+                    data = json_file.read()
                     print(f"Loaded data")
 
                 remove(download_file_path)
@@ -227,6 +239,7 @@ def function_data_conversion(request: Request) -> tuple[dict, int]:
         for x in list_of_armies
         if x.validation_errors
     ]
+    logger.info(f"Unit string pool: {unit_strings.stats()}")
 
     #----------------------------------------------------------------------------------------------
     # Upload json version
@@ -263,7 +276,12 @@ def function_data_conversion(request: Request) -> tuple[dict, int]:
             possible_tk_names=possible_matches,
             validation_count=validation_count,
             validation_errors=validation_errors,
-            parsing_errors=parsing_errors
+            parsing_errors=parsing_errors,
+            format_cache=format_cache.stats(),
+            tk_catalogue=tk_catalogue.staleness(),
+            nr_library=nr_library_cache.staleness(),
+            upstream_latency=latency_stats(),
+            coalesced_calls=single_flight_stats(),
         )
     return return_dict, 200
 
@@ -0,0 +1,73 @@
+from typing import Dict, List, Optional, Sequence
+
+from fuzzywuzzy import fuzz
+from fuzzywuzzy.utils import full_process
+
+try:
+    from rapidfuzz import process
+    from rapidfuzz.distance import Indel
+except ImportError:  # pragma: no cover, rapidfuzz comes in with python-Levenshtein
+    process = None
+
+
+def normalise_name(name: Optional[str]) -> Optional[str]:
+    """What fuzz.token_sort_ratio compares: ascii only, letters and numbers, lower case, tokens sorted"""
+    if name is None:
+        return None
+    return " ".join(sorted(full_process(name, force_ascii=True).split())).strip()
+
+
+def _as_ratio(similarity: float) -> int:
+    # fuzzywuzzy rounds 100 * Levenshtein.ratio the same way
+    return int(round(100 * similarity))
+
+
+def token_sort_ratio_matrix(queries: Sequence[Optional[str]], choices: Sequence[Optional[str]]) -> List[List[int]]:
+    """fuzz.token_sort_ratio of every query against every choice, scored in one batch
+
+    Each distinct name is normalised once and each distinct pair scored once, so the result is the same as calling
+    token_sort_ratio in a nested loop. None scores 0 against everything just like fuzzywuzzy.
+    """
+    return normalised_ratio_matrix([normalise_name(x) for x in queries], [normalise_name(x) for x in choices])
+
+
+def normalised_ratio_matrix(
+    normalised_queries: Sequence[Optional[str]], normalised_choices: Sequence[Optional[str]]
+) -> List[List[int]]:
+    """token_sort_ratio_matrix for names that have already been through normalise_name"""
+    unique_queries = list(dict.fromkeys(x for x in normalised_queries if x is not None))
+    unique_choices = list(dict.fromkeys(x for x in normalised_choices if x is not None))
+
+    if process is None:
+        scores = [[fuzz.ratio(q, c) for c in unique_choices] for q in unique_queries]
+    elif unique_queries and unique_choices:
+        scores = [[_as_ratio(x) for x in row] for row in _similarity_rows(unique_queries, unique_choices)]
+    else:
+        scores = [[] for _ in unique_queries]
+
+    query_rows: Dict[str, List[int]] = dict(zip(unique_queries, scores))
+    choice_columns = {name: index for index, name in enumerate(unique_choices)}
+    no_match = [0] * len(normalised_choices)
+    matrix = []
+    for query in normalised_queries:
+        if query is None:
+            matrix.append(no_match[:])
+            continue
+        row = query_rows[query]
+        matrix.append([0 if choice is None else row[choice_columns[choice]] for choice in normalised_choices])
+    return matrix
+
+
+def _similarity_rows(queries: List[str], choices: List[str]) -> List[List[float]]:
+    try:
+        return process.cdist(queries, choices, scorer=Indel.normalized_similarity, workers=-1).tolist()
+    except ImportError:
+        # cdist hands back a numpy array, without numpy score a row per call instead
+        return [
+            [score for _, score, _ in sorted(process.extract(query, choices, scorer=Indel.normalized_similarity, limit=None), key=lambda x: x[2])]
+            for query in queries
+        ]
+
+
+def token_sort_ratios(query: Optional[str], choices: Sequence[Optional[str]]) -> List[int]:
+    return token_sort_ratio_matrix([query], choices)[0]
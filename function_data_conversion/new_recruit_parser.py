@@ -1,14 +1,58 @@
 import re
-import string
-from typing import List, Union
+from os import environ
+from typing import List, Optional, Union
+from urllib.parse import urlparse
 
 import requests
 
-from data_classes import Army_names, ArmyEntry, UnitEntry
+from data_classes import ArmyEntry, UnitEntry
+from disk_cache import Disk_cache, cache_key
+from line_classifier import (Classified_line, classify_lines,
+                             detect_army_name, detect_total_points,
+                             is_unit_line)
+from resilience import (Circuit_open_error, Deadline, Deadline_exceeded_error,
+                        get_circuit_breaker, send_with_retry)
+from string_pool import unit_strings
+from upstream_pool import get_upstream_pool
+
+new_recruit_api_url = environ.get("NEW_RECRUIT_API_URL", "https://api.newrecruit.eu")
+new_recruit_api_host = urlparse(new_recruit_api_url).netloc
+
+# Identical lists are resubmitted constantly across events and casual games.
+# Bump NR_GAME_DATA_VERSION when New Recruit's game data changes so old answers are not reused.
+nr_game_data_version = environ.get("NR_GAME_DATA_VERSION", "")
+validation_cache = Disk_cache(
+    name="new-recruit-listcheck",
+    directory=environ.get("VALIDATION_CACHE_DIR", "/tmp/validation-cache"),
+    ttl_seconds=float(environ.get("VALIDATION_CACHE_TTL_SECONDS", 90 * 24 * 60 * 60)),
+    max_entries=int(environ.get("VALIDATION_CACHE_MAX_ENTRIES", 5000)),
+    bucket_name=environ.get("VALIDATION_CACHE_BUCKET"),
+)
+
+# Grammar of a unit line: "<points> - <quantity>x <name>, <upgrade>, <upgrade> (<nested upgrade>)"
+# Sometimes there are unit entries on the same line so the lookahead stops '(.+?)' from eating the next entry
+multi_unit_regex = re.compile(r"(\d{2,4}?)(?: ?[\W ] ?)(.+?)(?=\d{2,4}|$)")
+# break ("15 knights" | "41x spearmen" | chariot) into quantity and the rest
+quantity_regex = re.compile(r"(\d{1,2}|)(?:x | |)(.+)")
+# "Crossbow (4+)|Crossbow 4+"
+dice_roll_regex = re.compile(r" ?(\(\d\+\)|\d\+)")
+# "[20pts]|20 pts"
+points_cost_regex = re.compile(r" ?(\[\d+ ?pts\]|\d+ ?pts)")
+battle_standard_regex = re.compile(r"bsb|battlestandard", flags=re.IGNORECASE)
+full_command_regex = re.compile(r"fcg|gmc|full command|full command group", flags=re.IGNORECASE)
 
-http = requests.Session()
 
 class new_recruit_parser:
+    def __init__(self, legacy_unit_parser: Optional[bool] = None) -> None:
+        """
+        Args:
+            legacy_unit_parser (Optional[bool]): use the original regex-per-step unit parser, used for output-equivalence checks.
+                Defaults to the LEGACY_UNIT_PARSER environment variable.
+        """
+        if legacy_unit_parser is None:
+            legacy_unit_parser = environ.get("LEGACY_UNIT_PARSER", "").lower() == "true"
+        self.legacy_unit_parser = legacy_unit_parser
+
     @staticmethod
     def Is_int(n) -> bool:
         try:
@@ -18,159 +62,219 @@ class new_recruit_parser:
         else:
             return float(n).is_integer()
 
-    def validate(self, lines: List[str]) -> list[str]:
-        # This takes 52% of exec time
-        """
+    def validate(self, lines: List[str], deadline: Optional[Deadline] = None) -> list[str]:
+        # This takes 52% of exec time, so results are cached on the list text and game data version
+        """New Recruit listcheck messages for an army block
+
+        Conversions don't call this, they take the validation 9th Builder returns with the formatted block. It is
+        here for prewarm_validation_cache.py and anything else that wants New Recruit's opinion on a list.
+
+        Args:
+            deadline (Optional[Deadline]): defaults to the running invocation's
         """
         if len(lines) < 6:  # minimum is name, army, and 4 units
             raise ValueError(
                 f"Army Block has to few lines for validation.\nRequires at minimum name, army, and 4 units.\n\nWhole army list = {lines}"
             )
 
-        url = "https://api.newrecruit.eu/api/listcheck"
-
-        # flatten lines into single string
-        flattened_list = ""
-
-        # api can not handle list name on the same line as the army so must be removed
-        army_name = self.detect_army_name(lines[1])
-        if army_name:
-            flattened_list += f"{army_name}\n"
-
-        for line in lines[2:]:
-            flattened_list += f"{line}\n"
+        flattened_list = self.flatten_list(lines)
+        key = cache_key(flattened_list, nr_game_data_version)
+        cached_result = validation_cache.get(key)
+        if cached_result is not None:
+            return cached_result["messages"]
 
+        url = f"{new_recruit_api_url}/api/listcheck"
         request_data = {"list": flattened_list}
 
         try:
-            response = http.post(url, data=request_data, timeout=20)
+            response = send_with_retry(
+                lambda timeout: get_upstream_pool(new_recruit_api_host).session.post(url, data=request_data, timeout=timeout),
+                breaker=get_circuit_breaker(new_recruit_api_host),
+                timeout=20,
+                deadline=deadline,
+            )
         except requests.exceptions.Timeout:  # Parent timeout class as there are a few ways to timeout
             return ["Validation Timeout"]
+        except requests.exceptions.ConnectionError:
+            return ["Validation Failed, New Recruit could not be reached"]
+        except Circuit_open_error:
+            return ["Validation skipped, New Recruit is currently failing"]
+        except Deadline_exceeded_error:
+            return ["Validation skipped, out of time"]
 
         if response.status_code == 200:
             r = response.json()
             if type(r) == dict:
-                return [r.get("error")]
+                messages = [r.get("error")]
             elif type(r) == list:
-                return [x.get("msg") for x in response.json()]
+                messages = [x.get("msg") for x in r]
             else:
                 return ["Unknown Validation error"]
+            # only answers from the list checker are worth keeping, failures should be retried next time
+            validation_cache.set(key, {"messages": messages})
+            return messages
         elif response.status_code == 502:
             return ["Validation Failed, New Recruit is under maintenance"]
         else:
             return [f"Validation Failed with code:{response.status_code}"]
 
-    def detect_army_name(self, line: str) -> Union[str, None]:
-        army_name = Army_names.get(line.strip().upper())
+    def flatten_list(self, lines: List[str]) -> str:
+        """flatten lines into single string, without the player name"""
+        flattened_list = ""
+
+        # api can not handle list name on the same line as the army so must be removed
+        army_name = self.detect_army_name(lines[1])
         if army_name:
-            return army_name
-        return None
+            flattened_list += f"{army_name}\n"
+
+        for line in lines[2:]:
+            flattened_list += f"{line}\n"
+        return flattened_list
+
+    def detect_army_name(self, line: str) -> Union[str, None]:
+        return detect_army_name(line)
 
     @staticmethod
     def detect_total_points(line:str) -> Union[int, None]:
-        # Examples
-        # Total Army Cost: 4499 pts
-        # 4498pts
-        cleaned_line = (
-            line.lower()
-            .replace("total", "")
-            .replace("army", "")
-            .replace("cost", "")
-            .replace("pts", "")
-            .replace("points", "")
-        )
-        table = str.maketrans(
-            dict.fromkeys(string.punctuation)
-        )  # OR {key: None for key in string.punctuation}
-        cleaned_line = cleaned_line.translate(table)
-        cleaned_line = cleaned_line.strip()
-        # simple case where its just the number
-        if new_recruit_parser.Is_int(cleaned_line) and 2000 <= int(cleaned_line) <= 4500:
-            return int(cleaned_line)
-        return None
+        return detect_total_points(line)
 
     def parse_block(self, lines: List[str]) -> ArmyEntry:
+        return self.parse_classified_block(classify_lines(lines))
+
+    def parse_classified_block(self, lines: List[Classified_line]) -> ArmyEntry:
         new_army = ArmyEntry()
         for i, line in enumerate(lines):
 
             if (
                 i == len(lines) - 1
             ):  # last line is either the points total or last unit entry
-                total_points = self.detect_total_points(line)
-                if total_points:
-                    new_army.reported_total_army_points = total_points
-                else:
+                if line.total_points:
+                    new_army.reported_total_army_points = line.total_points
+                elif line.is_unit_line:
                     # line is 1 or more unit entries
-                    new_units = self.parse_unit_line(line)
-                    if new_units:
-                        for unit in new_units:
-                            new_army.add_unit(unit)
+                    for unit in self.parse_unit_entries(line.text):
+                        new_army.add_unit(unit)
                 continue
 
             # line is 1 or more unit entries
-            new_units = self.parse_unit_line(line)
+            new_units = self.parse_unit_entries(line.text) if line.is_unit_line else []
             if new_units:
                 for unit in new_units:
                     new_army.add_unit(unit)
                 continue
 
-            # line is the army name since this is only going to happen once in a army list we do this check last to avoid checking every line
-            army_name = self.detect_army_name(line)
-            if army_name:
-                new_army.army = army_name
+            # line is the army name since this is only going to happen once in a army list
+            if line.army_name:
+                new_army.army = line.army_name
 
         return new_army
 
     def parse_unit_line(self, line: str) -> List[UnitEntry]:
-        output = []
-
         # regex explanation don't match "Benji#9781 - Captain" so we need to start with a negative lookbehind due to python being basic, and needing fixed look behinds we need to do each variation separately
         # Then match number "630 - Death Cult Hierarch" -> "<number> - <unit name>, upgrades"
         # Sometimes there are unit entries on the same line so we then do a positive lookahead to make sure if there is another unit entry its not captured by the '(.+?)'
-        split_line_points_entry = r"^(\d{2,4}?)(?: ?[\W ] ?)(.+)"
-        pointsSearch = re.search(
-            split_line_points_entry, line.lower().strip(".")
-        )  # ensure its all lowercase to prevent casing issues
-        if pointsSearch:
-            # potentially multiple units were on the same line and need to be handle separately
-            multi_unit = r"(\d{2,4}?)(?: ?[\W ] ?)(.+?)(?=\d{2,4}|$)"
-            multi_pointsSearch = re.findall(multi_unit, line.lower())
-            for unit in multi_pointsSearch:
-                unit_points = int(unit[0]) if self.Is_int(unit[0]) else -1
-
-                if unit_points == -1:
-                    raise ValueError(
-                        f"unit points: {unit[0]} must be an integer, in line: {line}"
-                    )
+        if not is_unit_line(line):
+            return []
+        return self.parse_unit_entries(line)
 
-                # break group 2 ("15 knights" | "41x spearmen" | chariot) into unit name and quantity
-                splitOutQuantityRegex = r"(\d{1,2}|)(?:x | |)(.+)"
-                quantitySearch = re.search(splitOutQuantityRegex, unit[1])
-                if quantitySearch:
-                    # if there was no quantity number then the regex match for group 1 is '' so we need to hardcode that as 1
-                    quantity = (
-                        int(quantitySearch.group(1)) if quantitySearch.group(1) else 1
-                    )
-                    cleaned_upgrades = self.clear_superfluous_data(
-                        quantitySearch.group(2)
-                    )
-                    non_nested_upgrades = self.break_nested_upgrades(cleaned_upgrades)
-                    splitLine = [x.strip() for x in non_nested_upgrades.split(", ")]
-                    unit_name = splitLine[0]
-                    if len(splitLine) > 1:
-                        unit_upgrades = splitLine[1:]
-                    else:
-                        unit_upgrades = []
-
-                    unit_upgrades = self.expand_short_hand(unit_upgrades)
-                    output.append(
-                        UnitEntry(
-                            points=unit_points,
-                            quantity=quantity,
-                            name=unit_name,
-                            upgrades=unit_upgrades,
-                        )
+    def parse_unit_entries(self, line: str) -> List[UnitEntry]:
+        """Parse a line that has already been classified as a unit line
+
+        Args:
+            line (str): "630 - Death Cult Hierarch, General"
+
+        Returns:
+            List[UnitEntry]: 1 or more units found on the line
+        """
+        if self.legacy_unit_parser:
+            return self.parse_unit_entries_legacy(line)
+        return self.tokenize_unit_line(line)
+
+    def tokenize_unit_line(self, line: str) -> List[UnitEntry]:
+        """Single scan over the line with the precompiled unit grammar, gives the same output as parse_unit_entries_legacy()"""
+        output = []
+        for unit in multi_unit_regex.finditer(line.lower()):
+            unit_points = int(unit.group(1))
+
+            # the body is never empty so this always matches, if there was no quantity group 1 is ''
+            quantity_match = quantity_regex.match(unit.group(2))
+            quantity = int(quantity_match.group(1)) if quantity_match.group(1) else 1
+
+            body = quantity_match.group(2)
+            # only pay for the substitutions when they could possibly match
+            if "+" in body:
+                body = dice_roll_regex.sub("", body)
+            if "pts" in body:
+                body = points_cost_regex.sub("", body)
+            if "&#39;" in body:
+                body = body.replace("&#39;", "'")
+            # resolve nested upgrades "a (b, c)" -> "a, b, c"
+            body = body.replace(" (", ", ").replace(")", "")
+
+            unit_name, *raw_upgrades = body.split(", ")
+            unit_upgrades = []
+            extra_upgrades = []
+            for upgrade in raw_upgrades:
+                upgrade = upgrade.strip()
+                if battle_standard_regex.fullmatch(upgrade):
+                    upgrade = "battle standard bearer"
+                elif full_command_regex.fullmatch(upgrade):
+                    upgrade = "standard bearer"
+                    extra_upgrades.extend(("musician", "champion"))
+                unit_upgrades.append(unit_strings.intern(upgrade))
+            unit_upgrades.extend(extra_upgrades)
+
+            output.append(
+                UnitEntry(
+                    points=unit_points,
+                    quantity=quantity,
+                    name=unit_strings.intern(unit_name.strip()),
+                    upgrades=unit_upgrades,
+                )
+            )
+        return output
+
+    def parse_unit_entries_legacy(self, line: str) -> List[UnitEntry]:
+        output = []
+        # potentially multiple units were on the same line and need to be handle separately
+        multi_unit = r"(\d{2,4}?)(?: ?[\W ] ?)(.+?)(?=\d{2,4}|$)"
+        multi_pointsSearch = re.findall(multi_unit, line.lower())
+        for unit in multi_pointsSearch:
+            unit_points = int(unit[0]) if self.Is_int(unit[0]) else -1
+
+            if unit_points == -1:
+                raise ValueError(
+                    f"unit points: {unit[0]} must be an integer, in line: {line}"
+                )
+
+            # break group 2 ("15 knights" | "41x spearmen" | chariot) into unit name and quantity
+            splitOutQuantityRegex = r"(\d{1,2}|)(?:x | |)(.+)"
+            quantitySearch = re.search(splitOutQuantityRegex, unit[1])
+            if quantitySearch:
+                # if there was no quantity number then the regex match for group 1 is '' so we need to hardcode that as 1
+                quantity = (
+                    int(quantitySearch.group(1)) if quantitySearch.group(1) else 1
+                )
+                cleaned_upgrades = self.clear_superfluous_data(
+                    quantitySearch.group(2)
+                )
+                non_nested_upgrades = self.break_nested_upgrades(cleaned_upgrades)
+                splitLine = [x.strip() for x in non_nested_upgrades.split(", ")]
+                unit_name = splitLine[0]
+                if len(splitLine) > 1:
+                    unit_upgrades = splitLine[1:]
+                else:
+                    unit_upgrades = []
+
+                unit_upgrades = self.expand_short_hand(unit_upgrades)
+                output.append(
+                    UnitEntry(
+                        points=unit_points,
+                        quantity=quantity,
+                        name=unit_name,
+                        upgrades=unit_upgrades,
                     )
+                )
 
         return output
 
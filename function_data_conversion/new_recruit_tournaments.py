@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 import datetime
-from functools import cache
+from dataclasses import dataclass, field
 from typing import Optional, Union
 import pathlib
 
@@ -10,11 +10,15 @@ from os import environ
 import requests
 from pydantic import BaseModel, Field
 
-from converter import Convert_lines_to_army_list
+from converter import Convert_lists_to_army_lists
 from data_classes import ArmyEntry, Data_sources, Event_types, Round
+from disk_cache import Disk_cache
 from multi_error import Multi_Error
+import nr_decoding
+from nr_library_cache import Nr_library_cache
+from standings import Team_result, rank_individuals, rank_teams
 
-http = requests.Session()
+new_recruit_url = environ.get("NEW_RECRUIT_URL", "https://www.newrecruit.eu")
 
 # -----------------------
 # Specific Tournament Data
@@ -197,97 +201,170 @@ def get_cred_config() -> dict[str, str]:
         print("Error : NR_CREDENTIALS_SECRET can not be loaded.")
         return {}
 
-@cache
-def get_NR_library(id_game_system: int) -> nr_library_entry:
+@dataclass
+class Setup_lookup:
+    """Id to name of every map, deployment and objective in a game system's library, seasons included"""
 
-    creds = get_cred_config()
+    maps: dict[int, str] = field(default_factory=dict)
+    deployments: dict[int, str] = field(default_factory=dict)
+    objectives: dict[int, str] = field(default_factory=dict)
 
-    data = []
-    try:
-        url = f"https://www.newrecruit.eu/api/rpc?m=get_library"
-        response = requests.get(
-            url,
-            headers={
-                "Accept": "application/json",
-                "User-Agent": "ninthage-data-analytics/1.1.0",
-                "NR-Login": creds["NR_LOGIN"],
-                "NR-Password": creds["NR_PASSWORD"],
-            },
-            proxies={
-                "http": environ.get("PROXY"),
-                "https": environ.get("PROXY")
-            },
-        )
-        data = response.json()
-    except Exception as e:
-        print(f"Load library from local file")
-        # Use file-relative path, not cwd
-        download_file_path = pathlib.Path(__file__).parent / "data" / "library.json"
-        with open(download_file_path, "r", encoding="utf-8") as jsonFile:
-            data = json.loads(jsonFile.read())
+    def name_of(self, kind: str, id: int) -> str:
+        names = {"map": self.maps, "deployment": self.deployments, "objective": self.objectives}[kind]
+        if id not in names:
+            raise IndexError(f"No {kind} with id {id} in the New Recruit library")
+        return names[id]
 
-    library = nr_library(__root__=data)
 
-    for entry in library.__root__:
-        if entry.id == id_game_system:
-            return entry
+def compile_setup_lookup(library_data: nr_library_entry) -> Setup_lookup:
+    lookup = Setup_lookup()
+    # later entries win, seasons override the base categories
+    if library_data.settings.setup_categories:
+        lookup.maps.update((x.id, x.name) for x in library_data.settings.setup_categories.map.items)
+        lookup.deployments.update((x.id, x.name) for x in library_data.settings.setup_categories.deployment.items)
+        # the base objectives have always been read from the deployment category
+        lookup.objectives.update((x.id, x.name) for x in library_data.settings.setup_categories.deployment.items)
 
-    raise ValueError(f"No library entry found for id_game_system: {id_game_system}")
+    for season in library_data.settings.seasons or []:
+        if season.game_setup.map:
+            lookup.maps.update((x.id, x.name) for x in season.game_setup.map.items)
+        if season.game_setup.deployment:
+            lookup.deployments.update((x.id, x.name) for x in season.game_setup.deployment.items)
+        if season.game_setup.objective:
+            lookup.objectives.update((x.id, x.name) for x in season.game_setup.objective.items)
 
-def clamp(n, minn, maxn):
-    return max(min(maxn, n), minn)
+    lookup.maps = {id: name.replace("map", "").strip() for id, name in lookup.maps.items()}
+    return lookup
 
-def calculate_team_placing(data: dict[str, ArmyEntry], teams: list[team], rounds: int) -> None:
-    """
-    logic here is to loop over each team and calculate how the team performed given there are soft points and also points caps per round
-    """
-    for team in teams:
-        if team.extra_points is not None:
-            team_total_tournament_points = sum([x.amount for x in team.extra_points]) #add in soft points
-        else:
-            team_total_tournament_points = 0
-        team_total_secondary_points = 0
 
-        for round in range(rounds):
-            round_total_tournament_points = 0
-            round_total_secondary_points = 0
+def fetch_NR_library(headers: dict[str, str]) -> requests.Response:
+    creds = get_cred_config()
+    return requests.get(
+        f"{new_recruit_url}/api/rpc?m=get_library",
+        headers={
+            "Accept": "application/json",
+            "User-Agent": "ninthage-data-analytics/1.1.0",
+            "NR-Login": creds.get("NR_LOGIN"),
+            "NR-Password": creds.get("NR_PASSWORD"),
+            **headers,
+        },
+        proxies={
+            "http": environ.get("PROXY"),
+            "https": environ.get("PROXY")
+        },
+        timeout=float(environ.get("NR_LIBRARY_TIMEOUT_SECONDS", 30)),
+    )
+
+
+def compact_NR_library_entry(entry: dict) -> dict:
+    """Only the fields nr_library_entry reads, the rest of an entry (books, rules, wiki) is most of its size"""
+    return json.loads(nr_library_entry.parse_obj(entry).json(exclude_none=True))
+
+
+nr_library_cache = Nr_library_cache(
+    fetch=fetch_NR_library,
+    compact=compact_NR_library_entry,
+    store=Disk_cache(
+        name="nr_library",
+        directory=environ.get("NR_LIBRARY_DIR", "/tmp/nr-library"),
+        ttl_seconds=float(environ.get("NR_LIBRARY_MAX_AGE_SECONDS", 30 * 24 * 60 * 60)),
+        max_entries=20,
+        bucket_name=environ.get("NR_LIBRARY_BUCKET"),
+    ),
+    ttl_seconds=float(environ.get("NR_LIBRARY_TTL_SECONDS", 6 * 60 * 60)),
+    retry_seconds=float(environ.get("NR_LIBRARY_RETRY_SECONDS", 60)),
+    # Use file-relative path, not cwd
+    bundled_path=pathlib.Path(__file__).parent / "data" / "library.json",
+)
+
+# game system id: (library version, parsed entry, setup lookup)
+_compiled_libraries: dict[int, tuple[str, nr_library_entry, Setup_lookup]] = {}
+
+
+def get_NR_library_and_setup(id_game_system: int) -> tuple[nr_library_entry, Setup_lookup]:
+    """The library entry and its setup lookup, parsed and compiled once per library version"""
+    extract = nr_library_cache.get(id_game_system)
+    compiled = _compiled_libraries.get(id_game_system)
+    if compiled is None or compiled[0] != extract.version:
+        library_data = nr_library_entry.parse_obj(extract.entry)
+        compiled = (extract.version, library_data, compile_setup_lookup(library_data))
+        _compiled_libraries[id_game_system] = compiled
+    return compiled[1], compiled[2]
+
+
+def get_NR_library(id_game_system: int) -> nr_library_entry:
+    return get_NR_library_and_setup(id_game_system)[0]
+
 
-            for player in team.players:
-                if player in data and data[player.name].round_performance and round <= len(data[player.name].round_performance)-1:
-                    round_total_tournament_points += data[player.name].round_performance[round].result
-                    round_total_tournament_points = clamp(round_total_tournament_points, data[player.name].team_point_cap_min, data[player.name].team_point_cap_max)
-                    round_total_secondary_points += data[player.name].round_performance[round].secondary_points
+def get_NR_setup_lookup(id_game_system: int) -> Setup_lookup:
+    return get_NR_library_and_setup(id_game_system)[1]
 
-            team_total_tournament_points += round_total_tournament_points
-            team_total_secondary_points += round_total_secondary_points
 
-        for player in team.players:
-            if player in data:
-                data[player.name].team_total_tournament_points = team_total_tournament_points
-                data[player.name].team_total_secondary_points = team_total_secondary_points
+def get_setup_id(val):
+    """Setup values can be an int or list[int]"""
+    if isinstance(val, list) and len(val) > 0:
+        return val[0]
+    return val
+
+
+def calculate_team_placing(
+    data: dict[str, ArmyEntry],
+    teams: list[team],
+    team_members: dict[int, list[str]],
+    rounds: int,
+    cap_min: Optional[int] = None,
+    cap_max: Optional[int] = None,
+) -> None:
+    """
+    each team's round totals are clamped to the event's point caps and soft points added before the teams are ranked
 
+    Args:
+        team_members (dict[int, list[str]]): participant ids of each team by its index in `teams`
+    """
     if not (data and data.items()):
         raise Multi_Error(
                 [ValueError(f"No games found for event ")]
             )
 
-    sorted_data = sorted(data.items(), key=lambda x: (x[1].team_total_tournament_points, x[1].team_total_secondary_points), reverse=True)
-    sorted_armies = list(list(zip(*sorted_data))[1])
-    for army in sorted_armies:
-        army.team_placing = sorted_armies.index(army) + 1
+    rank_teams(
+        [
+            Team_result(
+                name=team.name,
+                members=[data[x] for x in team_members.get(index, []) if x in data],
+                soft_points=sum(x.amount for x in team.extra_points or []),
+            )
+            for index, team in enumerate(teams)
+        ],
+        rounds=rounds,
+        cap_min=cap_min,
+        cap_max=cap_max,
+    )
 
 
 def calculate_individual_placing(data: dict[str, ArmyEntry]) -> list[ArmyEntry]:
-    if not data:
-        return []
-    sorted_data = sorted(data.items(), key=lambda x: (x[1].calculated_total_tournament_points, x[1].calculated_total_tournament_secondary_points), reverse=True)
-    sorted_armies:list[ArmyEntry] = list(list(zip(*sorted_data))[1])
-    for army in sorted_armies:
-        army.list_placing = sorted_armies.index(army) + 1
-    return sorted_armies
+    return rank_individuals(data.values())
+
+def decode_NR_event(raw: bytes) -> single_event:
+    """A stored event straight from the file's bytes, with the decoder NR_DECODER picks
+
+    "pydantic" (the default) validates every game through the models, "msgspec" decodes into typed structs and builds
+    the same models without validating them again, which is several times faster on events with thousands of games.
+    """
+    if environ.get("NR_DECODER", "pydantic") == "msgspec":
+        if nr_decoding.available():
+            event_data = nr_decoding.decode_event(raw)
+            if event_data is not None:
+                return event_data
+        else:
+            print("NR_DECODER is msgspec but msgspec is not installed, validating with pydantic")
+    return single_event(**json.loads(raw))
+
 
-def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[str]]:
-    event_data = single_event(**stored_data)
+def armies_from_NR_tournament(stored_data: Union[dict, bytes]) -> tuple[list[ArmyEntry], list[str]]:
+    if isinstance(stored_data, bytes):
+        event_data = decode_NR_event(stored_data)
+    else:
+        event_data = single_event(**stored_data)
 
     errors: list[str] = []
 
@@ -305,35 +382,44 @@ def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[
     armies: list[ArmyEntry] = []
 
     army_dict:dict[str, ArmyEntry] = dict.fromkeys(player_list.keys(), None)
+    # participant ids of each team by its index in event_data.teams
+    team_members: dict[int, list[str]] = {}
 
     event_date = datetime.datetime.strptime(
             event_data.games[0].date, "%Y-%m-%dT%H:%M:%S.%fZ"
         )
 
     print(f"player_list({len(player_list)}): {player_list}")
+    # every player's list goes through one conversion so all of their blocks are formatted together
+    lists_to_convert: dict[str, list[str]] = {}
     for player in player_list.values():
         # Handle if no army list was provided
         if player.exported_list:
-            try:
-                if player.alias is not None:
-                    set_up_lines = [player.alias] + player.exported_list.split("\n")
-                elif player.name is not None:
-                    set_up_lines = [player.name] + player.exported_list.split("\n")
-                else:
-                    set_up_lines = player.exported_list.split("\n")
+            if player.alias is not None:
+                set_up_lines = [player.alias] + player.exported_list.split("\n")
+            elif player.name is not None:
+                set_up_lines = [player.name] + player.exported_list.split("\n")
+            else:
+                set_up_lines = player.exported_list.split("\n")
 
-                print(f"event_name: {event_data.name}, event_date: {event_date}, set_up_lines: {set_up_lines}")
+            print(f"event_name: {event_data.name}, event_date: {event_date}, set_up_lines: {set_up_lines}")
+            lists_to_convert[player.id_participant] = set_up_lines
 
-                armies = Convert_lines_to_army_list(
-                    event_name=event_data.name, event_date=event_date, lines=set_up_lines, session=http
-                )
-            except Multi_Error as e:
-                # basically skipping the error for now cause we cant change the armylist
-                # TODO: make this a validation error
-                err_msg = f"Error converting army list for {player.id_participant}: {e}"
-                print(err_msg)
-                errors.append(err_msg)
+    converted, conversion_errors = Convert_lists_to_army_lists(
+        event_name=event_data.name, event_date=event_date, lists=lists_to_convert
+    )
 
+    for player in player_list.values():
+        if player.id_participant in conversion_errors:
+            # basically skipping the error for now cause we cant change the armylist
+            # TODO: make this a validation error
+            err_msg = f"Error converting army list for {player.id_participant}: {conversion_errors[player.id_participant]}"
+            print(err_msg)
+            errors.append(err_msg)
+            continue
+
+        if player.id_participant in converted:
+            armies = converted[player.id_participant]
             if len(armies) == 1:
                 army = armies[0]
             else:
@@ -362,10 +448,11 @@ def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[
             army.team_point_cap_min = event_data.team_point_min
             print(f"army.team_point_cap_min: {army.team_point_cap_min}")
             # find which team the participant belongs to and save if the captain
-            for team in event_data.teams if event_data.teams else []:
+            for team_index, team in enumerate(event_data.teams if event_data.teams else []):
                 for person in team.players:
                     if person.name == player.name:
                         army.team_id = team.id
+                        team_members.setdefault(team_index, []).append(player.id_participant)
                         if team.id_captain and team.id_captain == player.id_participant:
                             army.team_captain = True
                         break
@@ -394,24 +481,12 @@ def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[
     army_dict = {k: v for k, v in army_dict.items() if v is not None}
 
     # append round performance
+    # one lookup per game system for the whole event, even if the library is revalidated part way through
+    setup_lookups: dict[int, Setup_lookup] = {}
     for tournament_game in event_data.games:
-        library_data = get_NR_library(tournament_game.id_game_system)
-        maps = []
-        deployments = []
-        objectives = []
-
-        if library_data.settings.setup_categories:
-            maps.extend(library_data.settings.setup_categories.map.items)
-            deployments.extend(library_data.settings.setup_categories.deployment.items)
-            objectives.extend(library_data.settings.setup_categories.deployment.items)
-
-        for season in library_data.settings.seasons:
-            if season.game_setup.map:
-                maps.extend(season.game_setup.map.items)
-            if season.game_setup.deployment:
-                deployments.extend(season.game_setup.deployment.items)
-            if season.game_setup.objective:
-                objectives.extend(season.game_setup.objective.items)
+        if tournament_game.id_game_system not in setup_lookups:
+            setup_lookups[tournament_game.id_game_system] = get_NR_setup_lookup(tournament_game.id_game_system)
+        setup_lookup = setup_lookups[tournament_game.id_game_system]
 
         for i, player in enumerate(tournament_game.players):
             if player.id_participant not in army_dict:
@@ -450,40 +525,17 @@ def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[
 
             # Save setup data
             if tournament_game.setup:
-                # Helper to normalize setup values which can be int or list[int]
-                def get_setup_id(val):
-                    if isinstance(val, list) and len(val) > 0:
-                        return val[0]
-                    return val
-
                 map_id = get_setup_id(tournament_game.setup.map)
                 if map_id is not None:
-                    new_round.map_selected = (
-                        [
-                            x.name
-                            for x in maps
-                            if x.id == map_id
-                        ]
-                        .pop()
-                        .replace("map", "")
-                        .strip()
-                    )
+                    new_round.map_selected = setup_lookup.name_of("map", map_id)
                 
                 deployment_id = get_setup_id(tournament_game.setup.deployment)
                 if deployment_id is not None:
-                    new_round.deployment_selected = [
-                        x.name
-                        for x in deployments
-                        if x.id == deployment_id
-                    ].pop()
+                    new_round.deployment_selected = setup_lookup.name_of("deployment", deployment_id)
                 
                 objective_id = get_setup_id(tournament_game.setup.objective)
                 if objective_id is not None:
-                    new_round.objective_selected = [
-                        x.name
-                        for x in objectives
-                        if x.id == objective_id
-                    ].pop()
+                    new_round.objective_selected = setup_lookup.name_of("objective", objective_id)
 
             # Append round
             try:
@@ -502,10 +554,15 @@ def armies_from_NR_tournament(stored_data: dict) -> tuple[list[ArmyEntry], list[
         # list of all armyEntries from duplicate list that have round performance data
         assert event_data.teams is not None
         assert event_data.rounds is not None
-        # Verify if existing logic allows string matching for 'player in data' (keys are IDs)
-        # Assuming existing logic is what it is, but we passed army_dict which now only has valid entries.
         try:
-             calculate_team_placing(data=army_dict, teams=event_data.teams, rounds=event_data.rounds)
+             calculate_team_placing(
+                 data=army_dict,
+                 teams=event_data.teams,
+                 team_members=team_members,
+                 rounds=event_data.rounds,
+                 cap_min=event_data.team_point_min,
+                 cap_max=event_data.team_point_cap,
+             )
         except Exception as e:
              errors.append(f"Team placing calculation failed: {str(e)}")
 
@@ -1,9 +1,19 @@
 from datetime import datetime
+from os import environ
 from typing import Optional
+from urllib.parse import urlparse
 
 import requests
 from pydantic import BaseModel
 
+from disk_cache import Disk_cache, cache_key
+from resilience import get_circuit_breaker, send_with_retry
+from upstream_pool import get_upstream_pool
+
+# point at the local stand-in (scripts/standin_server.py) to run without the real 9th Builder
+ninth_builder_url = environ.get("NINTH_BUILDER_URL", "https://www.9thbuilder.com")
+ninth_builder_host = urlparse(ninth_builder_url).netloc
+
 
 class army_version(BaseModel):
     id: Optional[int]
@@ -79,20 +89,41 @@ class formatted_army_block(BaseModel):
     validation: validation
 
 
+# Same list text formatted again (re-uploads, monthly Fading Flame pulls, historical reloads) is served from here
+format_cache = Disk_cache(
+    name="9th-builder-format",
+    directory=environ.get("FORMAT_CACHE_DIR", "/tmp/format-cache"),
+    ttl_seconds=float(environ.get("FORMAT_CACHE_TTL_SECONDS", 30 * 24 * 60 * 60)),
+    max_entries=int(environ.get("FORMAT_CACHE_MAX_ENTRIES", 2000)),
+    bucket_name=environ.get("FORMAT_CACHE_BUCKET"),
+)
+
+
+def format_cache_key(army_block: list[str], filename: str, event_date: Optional[datetime]) -> str:
+    # whitespace differences don't change how the list is formatted
+    normalised_block = "\n".join(" ".join(line.split()) for line in army_block if line.strip())
+    return cache_key(normalised_block, filename, event_date.isoformat() if event_date else None)
+
+
 def format_army_block(army_block: list[str], filename: str, event_date: Optional[datetime], session: Optional[requests.Session]) -> Optional[formatted_army_block]:
+    key = format_cache_key(army_block, filename, event_date)
+    cached_response = format_cache.get(key)
+    if cached_response is not None:
+        return formatted_army_block(**cached_response)
+
     data_string = "\n".join(army_block)
 
     if session:
         http = session
     else:
-        http = requests.Session()
+        http = get_upstream_pool(ninth_builder_host).session
 
-    url = f"https://www.9thbuilder.com/en/api/v1/builder/imports/format"
+    url = f"{ninth_builder_url}/en/api/v1/builder/imports/format"
     payload = {"data": data_string, "filename": filename}
     if event_date:
         payload["date"] = str(event_date.timestamp())
-    try:
-        response = http.post(
+    def send(timeout: float) -> requests.Response:
+        return http.post(
             url,
             json=payload,
             headers={
@@ -100,20 +131,29 @@ def format_army_block(army_block: list[str], filename: str, event_date: Optional
                 "Content-Type": "application/json",
                 "User-Agent": "ninthage-data-analytics/1.1.0",
             },
-            timeout=30,
+            timeout=timeout,
         )
-    except requests.exceptions.ReadTimeout as err:
+
+    try:
+        response = send_with_retry(send, breaker=get_circuit_breaker(ninth_builder_host), timeout=30)
+    except requests.exceptions.Timeout as err:
         print(f"\n----------------------------\nformatting timeout\n{payload=}")
         raise(ValueError(f"Formatter timeout\n{payload=}"))
+    except requests.exceptions.ConnectionError as err:
+        print(f"\n----------------------------\nformatting connection error\n{payload=}")
+        raise(ValueError(f"Formatter unreachable: {err}\n{payload=}"))
 
     if response.status_code != 200:
         print(f"\n----------------------------\nformatting non 200\n{payload=}")
         raise(ValueError(f"Formatter non-200\n{payload=}"))
 
-    formatted_response = formatted_army_block(**response.json())
+    response_data = response.json()
+    formatted_response = formatted_army_block(**response_data)
 
     if not formatted_response:
         print(f"unzipping failed\n{payload=}")
+    else:
+        format_cache.set(key, response_data)
 
     return formatted_response
 
@@ -0,0 +1,166 @@
+"""Decode stored New Recruit events straight from bytes with msgspec structs instead of validating with pydantic
+
+The structs mirror the pydantic models in new_recruit_tournaments, and the result is built from those models with
+construct() so everything downstream gets the same objects either way. A payload the structs reject is left for
+pydantic to validate so the two paths never disagree on what is accepted.
+"""
+from typing import Optional, Union
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover, the pydantic path is used instead
+    msgspec = None
+
+
+if msgspec is not None:
+
+    class _Elo(msgspec.Struct):
+        friendly: Optional[float] = None
+        tourny: Optional[float] = None
+
+    class _Player(msgspec.Struct):
+        id_participant: str
+        alias: Optional[str] = None
+        id_list: Optional[str] = None
+        id_member: Optional[str] = None
+        id_book: Optional[int] = None
+        exported_list: Optional[str] = None
+        name: Optional[str] = None
+        elo: Optional[_Elo] = None
+
+    class _Setup(msgspec.Struct):
+        map: Union[int, list[int], None] = None
+        deployment: Union[int, list[int], None] = None
+        objective: Union[int, list[int], None] = None
+
+    class _Score(msgspec.Struct):
+        VP: Optional[int] = None
+        Diff: Optional[int] = None
+        Obj: Optional[int] = None
+        Turns: Optional[int] = None
+        BP: Optional[int] = None
+        BPObj: Optional[int] = None
+
+    class _Tournament_game(msgspec.Struct):
+        id: str = msgspec.field(name="_id")
+        submitter_id: str
+        type: int
+        date: str
+        id_tourny: str
+        id_game_system: int
+        players: list[_Player]
+        id_match: Optional[str] = None
+        setup: Optional[_Setup] = None
+        # pydantic tries list[score] first and every score field is optional, so a list of objects is always scores
+        score: Optional[list[_Score]] = None
+        confirmation_id: Optional[str] = None
+        first_turn: Optional[int] = None
+
+    class _Extra_points(msgspec.Struct):
+        reason: str
+        amount: int
+        stage: Optional[int] = None
+        pairings: Optional[bool] = None
+
+    class _Player_name(msgspec.Struct):
+        name: str
+        lists: list[str]
+
+    class _Team(msgspec.Struct):
+        name: str
+        players: list[_Player_name]
+        id: Optional[str] = None
+        id_captain: Optional[str] = None
+        extra_points: Optional[list[_Extra_points]] = None
+
+    class _Single_event(msgspec.Struct):
+        name: str
+        games: list[_Tournament_game]
+        rounds: int
+        type: int
+        country_name: Optional[str] = None
+        country_flag: Optional[str] = None
+        participants_per_team: Optional[int] = None
+        team_point_cap: Optional[int] = None
+        team_point_min: Optional[int] = None
+        teams: Optional[list[_Team]] = None
+
+    _event_decoder = msgspec.json.Decoder(_Single_event)
+
+
+def available() -> bool:
+    return msgspec is not None
+
+
+def decode_event(raw: bytes):
+    """The stored event as a new_recruit_tournaments.single_event, None if the structs can't take it
+
+    Raises:
+        msgspec.DecodeError: the bytes are not json at all
+    """
+    # imported here as new_recruit_tournaments picks the decoder from this module
+    import new_recruit_tournaments as nr
+
+    try:
+        event = _event_decoder.decode(raw)
+    except msgspec.ValidationError as e:
+        print(f"msgspec could not decode the New Recruit event, validating with pydantic instead: {e}")
+        return None
+
+    def _player(x: "_Player") -> "nr.player":
+        return nr.player.construct(
+            alias=x.alias,
+            id_list=x.id_list,
+            id_member=x.id_member,
+            id_book=x.id_book,
+            id_participant=x.id_participant,
+            exported_list=x.exported_list,
+            name=x.name,
+            elo=None if x.elo is None else nr.elo.construct(friendly=x.elo.friendly, tourny=x.elo.tourny),
+        )
+
+    def _score(x: "_Score") -> "nr.score":
+        return nr.score.construct(VP=x.VP, Diff=x.Diff, Obj=x.Obj, Turns=x.Turns, BP=x.BP, BPObj=x.BPObj)
+
+    def _game(x: "_Tournament_game") -> "nr.tournament_game":
+        return nr.tournament_game.construct(
+            id=x.id,
+            submitter_id=x.submitter_id,
+            type=x.type,
+            date=x.date,
+            id_tourny=x.id_tourny,
+            id_match=x.id_match,
+            setup=None if x.setup is None else nr.setup.construct(map=x.setup.map, deployment=x.setup.deployment, objective=x.setup.objective),
+            id_game_system=x.id_game_system,
+            players=[_player(p) for p in x.players],
+            score=None if x.score is None else [_score(s) for s in x.score],
+            confirmation_id=x.confirmation_id,
+            first_turn=x.first_turn,
+        )
+
+    def _team(x: "_Team") -> "nr.team":
+        return nr.team.construct(
+            id=x.id,
+            name=x.name,
+            id_captain=x.id_captain,
+            players=[nr.player_name.construct(name=p.name, lists=p.lists) for p in x.players],
+            extra_points=None
+            if x.extra_points is None
+            else [
+                nr.extra_points.construct(reason=e.reason, amount=e.amount, stage=e.stage, pairings=e.pairings)
+                for e in x.extra_points
+            ],
+        )
+
+    return nr.single_event.construct(
+        name=event.name,
+        games=[_game(x) for x in event.games],
+        country_name=event.country_name,
+        country_flag=event.country_flag,
+        participants_per_team=event.participants_per_team,
+        team_point_cap=event.team_point_cap,
+        team_point_min=event.team_point_min,
+        teams=None if event.teams is None else [_team(x) for x in event.teams],
+        rounds=event.rounds,
+        type=event.type,
+    )
@@ -0,0 +1,203 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import requests
+
+from disk_cache import Disk_cache, cache_key
+from single_flight import get_single_flight
+
+
+@dataclass
+class Library_extract:
+    """The part of one game system's New Recruit library a conversion needs, and where it came from"""
+
+    id_game_system: int
+    entry: dict
+    # content hash of `entry`, anything compiled from the entry can be keyed by it
+    version: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # when New Recruit last confirmed this is current, None for the bundled copy
+    checked_at: Optional[float] = None
+    source: str = "none"
+
+    def to_stored(self) -> dict:
+        return {
+            "entry": self.entry,
+            "version": self.version,
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "checked_at": self.checked_at,
+        }
+
+    @classmethod
+    def from_stored(cls, id_game_system: int, stored: dict) -> "Library_extract":
+        return cls(id_game_system=id_game_system, source="cache", **stored)
+
+
+class Nr_library_cache:
+    """Per game system extracts of the New Recruit library kept on disk (optionally GCS) and revalidated with NR
+
+    The library is one download covering every game system. Only the compacted entry of the game system asked for is
+    kept, so a cold instance reads a few kB from the store instead of downloading and parsing the lot. Once an extract
+    is older than `ttl_seconds` it is revalidated with the ETag / Last-Modified New Recruit sent, so an unchanged
+    library costs a 304 rather than the full payload.
+
+    If New Recruit can't be reached an older extract is still served, and only with nothing stored at all does it fall
+    back to the library bundled with the function. Either way `staleness()` says so rather than hiding it.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[Dict[str, str]], requests.Response],
+        compact: Callable[[dict], dict],
+        store: Disk_cache,
+        ttl_seconds: float,
+        retry_seconds: float,
+        bundled_path: Path,
+    ) -> None:
+        """
+        Args:
+            fetch (Callable[[Dict[str, str]], requests.Response]): GETs the library with the extra (conditional) headers
+                it is given, raises if New Recruit can't be reached
+            compact (Callable[[dict], dict]): reduces a raw library entry to what is kept
+            store (Disk_cache): where extracts are persisted between instances
+            retry_seconds (float): how long to keep serving a stale or bundled extract before asking New Recruit again
+        """
+        self.fetch = fetch
+        self.compact = compact
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.bundled_path = bundled_path
+
+        self._extracts: Dict[int, Library_extract] = {}
+        self._attempted_at: Dict[int, float] = {}
+        self._last_error: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, id_game_system: int) -> Library_extract:
+        extract = self._extracts.get(id_game_system)
+        if extract is not None and not self._due(extract):
+            return extract
+        return get_single_flight("nr_library").do(id_game_system, self._load, id_game_system)
+
+    def staleness(self) -> Dict[int, dict]:
+        return {id_game_system: self._describe(extract) for id_game_system, extract in self._extracts.items()}
+
+    def _describe(self, extract: Library_extract) -> dict:
+        age = self._age_seconds(extract)
+        return {
+            "version": extract.version[:12],
+            "library_version": extract.entry.get("version"),
+            "checked_at": None if extract.checked_at is None else datetime.fromtimestamp(extract.checked_at, timezone.utc).isoformat(),
+            "age_seconds": None if age is None else round(age),
+            "stale": age is None or age > self.ttl_seconds,
+            "source": extract.source,
+            "last_error": self._last_error.get(extract.id_game_system),
+        }
+
+    @staticmethod
+    def _age_seconds(extract: Library_extract) -> Optional[float]:
+        if extract.checked_at is None:
+            return None
+        return max(time.time() - extract.checked_at, 0.0)
+
+    def _due(self, extract: Library_extract) -> bool:
+        """Whether New Recruit should be asked about this extract again"""
+        age = self._age_seconds(extract)
+        if age is not None and age <= self.ttl_seconds:
+            return False
+        # don't retry a New Recruit that has just failed on every request
+        attempted_at = self._attempted_at.get(extract.id_game_system)
+        return attempted_at is None or time.time() - attempted_at > self.retry_seconds
+
+    def _load(self, id_game_system: int) -> Library_extract:
+        extract = self._extracts.get(id_game_system)
+        if extract is None:
+            stored = self.store.get(self._key(id_game_system))
+            if stored:
+                extract = Library_extract.from_stored(id_game_system, stored)
+                self._set(extract)
+                if not self._due(extract):
+                    return extract
+
+        self._attempted_at[id_game_system] = time.time()
+        try:
+            revalidated = self._revalidate(id_game_system, extract)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._last_error[id_game_system] = f"{type(e).__name__}: {e}"
+            if extract is not None:
+                print(f"New Recruit library could not be revalidated, serving {self._describe(extract)}")
+                return extract
+            extract = self._bundled(id_game_system)
+            print(f"New Recruit library could not be fetched, serving the bundled copy: {self._describe(extract)}")
+            self._set(extract)
+            return extract
+
+        self._last_error.pop(id_game_system, None)
+        self._set(revalidated)
+        self.store.set(self._key(id_game_system), revalidated.to_stored())
+        return revalidated
+
+    def _revalidate(self, id_game_system: int, extract: Optional[Library_extract]) -> Library_extract:
+        headers = {}
+        # the bundled copy has no validators, and a copy from the store always has the entry to fall back to
+        if extract is not None and extract.etag:
+            headers["If-None-Match"] = extract.etag
+        if extract is not None and extract.last_modified:
+            headers["If-Modified-Since"] = extract.last_modified
+
+        response = self.fetch(headers)
+        if response.status_code == 304 and extract is not None:
+            return Library_extract(
+                id_game_system=id_game_system,
+                entry=extract.entry,
+                version=extract.version,
+                etag=response.headers.get("ETag", extract.etag),
+                last_modified=response.headers.get("Last-Modified", extract.last_modified),
+                checked_at=time.time(),
+                source="new_recruit",
+            )
+        if response.status_code != 200:
+            raise ValueError(f"New Recruit get_library returned {response.status_code}")
+
+        entry = self._find_entry(response.json(), id_game_system)
+        return self._extract(
+            id_game_system,
+            entry,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            checked_at=time.time(),
+            source="new_recruit",
+        )
+
+    def _bundled(self, id_game_system: int) -> Library_extract:
+        with open(self.bundled_path, "r", encoding="utf-8") as library_file:
+            entry = self._find_entry(json.load(library_file), id_game_system)
+        return self._extract(id_game_system, entry, source="bundled_file")
+
+    def _extract(self, id_game_system: int, entry: dict, **kwargs) -> Library_extract:
+        compacted = self.compact(entry)
+        version = cache_key(json.dumps(compacted, sort_keys=True))
+        return Library_extract(id_game_system=id_game_system, entry=compacted, version=version, **kwargs)
+
+    @staticmethod
+    def _find_entry(library: list, id_game_system: int) -> dict:
+        for entry in library:
+            if entry.get("id") == id_game_system:
+                return entry
+        raise ValueError(f"No library entry found for id_game_system: {id_game_system}")
+
+    def _set(self, extract: Library_extract) -> None:
+        with self._lock:
+            self._extracts[extract.id_game_system] = extract
+
+    @staticmethod
+    def _key(id_game_system: int) -> str:
+        return cache_key("nr_library", str(id_game_system))
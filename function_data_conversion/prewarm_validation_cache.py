@@ -0,0 +1,55 @@
+"""Validate a directory of army lists so later conversions are answered from the validation cache
+
+    python prewarm_validation_cache.py <directory>
+
+Every .txt and .docx file in the directory is split into army blocks the same way an uploaded document is,
+and the blocks are validated concurrently on the New Recruit upstream pool (see UPSTREAM_MAX_CONCURRENCY).
+There is no overall time limit, a large directory takes as long as it takes.
+"""
+import argparse
+import concurrent.futures
+from pathlib import Path
+from typing import Iterator, List
+
+from converter import split_lines_into_blocks
+from new_recruit_parser import (new_recruit_api_host, new_recruit_parser,
+                                validation_cache)
+from resilience import unbounded
+from upstream_pool import get_upstream_pool
+from utility_functions import Docx_to_line_list, clean_lines
+
+
+def blocks_from_directory(directory: Path) -> Iterator[List[str]]:
+    for path in sorted(directory.iterdir()):
+        if path.suffix == ".docx" and not path.name.startswith("~$"):
+            lines = Docx_to_line_list(path)
+        elif path.suffix == ".txt":
+            lines = path.read_text(encoding="utf-8").split("\n")
+        else:
+            continue
+        yield from split_lines_into_blocks(clean_lines(lines))
+
+
+def prewarm_validation_cache(directory: Path) -> dict:
+    parser = new_recruit_parser()
+    pool = get_upstream_pool(new_recruit_api_host)
+    validation_cache.reset_stats()
+
+    futures = [pool.submit(parser.validate, block, unbounded) for block in blocks_from_directory(directory)]
+    skipped = 0
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            future.result()
+        except ValueError:
+            # too short to be a list
+            skipped += 1
+
+    return {"lists": len(futures), "skipped": skipped, **validation_cache.stats()}
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("directory", type=Path)
+    args = arg_parser.parse_args()
+
+    print(prewarm_validation_cache(args.directory))
@@ -0,0 +1,319 @@
+import concurrent.futures
+import contextvars
+import random
+import time
+from collections import deque
+from os import environ
+import threading
+from threading import Lock
+from typing import Callable, Dict, Optional, TypeVar
+
+import requests
+
+# 429 and the gateway errors are the upstream being busy or restarting, anything else won't fix itself on a retry
+transient_status_codes = {429, 500, 502, 503, 504}
+transient_exceptions = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+T = TypeVar("T")
+
+
+class Circuit_open_error(ValueError):
+    pass
+
+
+class Deadline_exceeded_error(ValueError):
+    pass
+
+
+class Deadline:
+    """Time budget for a whole invocation
+
+    The parse lists workflow gives the conversion 1800s, so remote calls are cut short before that rather than
+    letting one slow upstream burn the entire timeout and fail everything that was already converted.
+    """
+
+    def __init__(self, budget_seconds: float) -> None:
+        self.budget_seconds = budget_seconds
+        self.restart()
+
+    def restart(self) -> None:
+        self.expires_at = time.monotonic() + self.budget_seconds
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def cap_timeout(self, timeout: float) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise Deadline_exceeded_error(f"Invocation time budget of {self.budget_seconds}s used up")
+        return min(timeout, remaining)
+
+
+class Circuit_breaker:
+    """Fails fast once an upstream has failed `failure_threshold` times in a row
+
+    After `reset_timeout` seconds one trial call is let through, if it succeeds the circuit closes again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = Lock()
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at >= self.reset_timeout and not self._trial_in_flight:
+                # half open, let a single call through to see if the upstream is back
+                self._trial_in_flight = True
+                return
+        raise Circuit_open_error(f"{self.name} is failing, not calling it for up to {self.reset_timeout}s")
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._trial_in_flight or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """The trial call ended without saying anything about the upstream, let the next caller try instead"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+unbounded = Deadline(float("inf"))
+_invocation_deadline: contextvars.ContextVar[Deadline] = contextvars.ContextVar("invocation_deadline", default=unbounded)
+
+
+def start_invocation_deadline() -> Deadline:
+    """A fresh budget for the invocation running in this context, concurrent invocations each get their own"""
+    deadline = Deadline(
+        # leave time at the end for writing and uploading whatever was converted
+        float(environ.get("INVOCATION_TIMEOUT_SECONDS", 1800)) - float(environ.get("INVOCATION_TIMEOUT_MARGIN_SECONDS", 120))
+    )
+    _invocation_deadline.set(deadline)
+    return deadline
+
+
+def current_deadline() -> Deadline:
+    """The running invocation's deadline, unbounded outside of one (scripts, background refreshes)"""
+    return _invocation_deadline.get()
+
+
+def submit_in_context(executor: concurrent.futures.Executor, fn: Callable[..., T], *args, **kwargs) -> "concurrent.futures.Future[T]":
+    """executor.submit that runs `fn` under the caller's deadline, worker threads don't inherit context otherwise"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+_breakers: Dict[str, Circuit_breaker] = {}
+_breakers_lock = Lock()
+
+
+def get_circuit_breaker(host: str) -> Circuit_breaker:
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = Circuit_breaker(
+                name=host,
+                failure_threshold=int(environ.get("CIRCUIT_BREAKER_FAILURES", 5)),
+                reset_timeout=float(environ.get("CIRCUIT_BREAKER_RESET_SECONDS", 30)),
+            )
+            _breakers[host] = breaker
+        return breaker
+
+
+def backoff_delay(attempt: int, base_delay: float = 0.5, max_delay: float = 8) -> float:
+    """Full jitter exponential backoff, attempt 0 is the first retry"""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def send_with_retry(
+    send: Callable[[float], requests.Response],
+    breaker: Circuit_breaker,
+    timeout: float,
+    attempts: int = 3,
+    deadline: Optional[Deadline] = None,
+) -> requests.Response:
+    """Call `send(timeout)` retrying timeouts, connection errors and transient status codes
+
+    Args:
+        send (Callable[[float], requests.Response]): makes the request with the timeout it is given
+        breaker (Circuit_breaker): breaker for the upstream being called
+        timeout (float): per attempt timeout, shortened if the deadline is closer
+        attempts (int): total number of tries
+        deadline (Deadline): defaults to the running invocation's
+
+    Raises:
+        Circuit_open_error: the upstream has been failing and is not being called
+        Deadline_exceeded_error: the invocation has run out of time
+        requests.exceptions.RequestException: the last error if every attempt timed out or failed to connect
+
+    Returns:
+        requests.Response: the first non transient response, or the last transient one if retries ran out
+    """
+    deadline = deadline or current_deadline()
+    last_error: Optional[Exception] = None
+    last_response: Optional[requests.Response] = None
+    for attempt in range(attempts):
+        attempt_timeout = deadline.cap_timeout(timeout)
+        breaker.check()
+        try:
+            response = send(attempt_timeout)
+        except transient_exceptions as e:
+            breaker.record_failure()
+            last_error, last_response = e, None
+        except requests.exceptions.RequestException:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # not the upstream's doing, but a half open trial has to be handed back or the circuit never closes
+            breaker.release_trial()
+            raise
+        else:
+            if response.status_code not in transient_status_codes:
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            last_error, last_response = None, response
+
+        if attempt < attempts - 1:
+            delay = backoff_delay(attempt)
+            if delay >= deadline.remaining():
+                break
+            time.sleep(delay)
+
+    if last_response is not None:
+        return last_response
+    assert last_error is not None
+    raise last_error
+
+
+class Latency_tracker:
+    """Recent response times for one endpoint, used to decide when a request is slow enough to hedge"""
+
+    def __init__(self, name: str, window: int = 200, min_samples: int = 20) -> None:
+        self.name = name
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+        self._lock = Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def take_hedge(self, max_fraction: float) -> bool:
+        """Whether another hedge keeps hedges within `max_fraction` of requests, counting it if so"""
+        with self._lock:
+            if self.hedges + 1 > max_fraction * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """None until there are enough samples to say anything useful"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def stats(self) -> dict:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "samples": len(self._samples),
+            "requests": self.requests,
+            "p50": None if p50 is None else round(p50, 3),
+            "p95": None if p95 is None else round(p95, 3),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+        }
+
+
+_trackers: Dict[str, Latency_tracker] = {}
+_trackers_lock = Lock()
+
+
+def get_latency_tracker(name: str) -> Latency_tracker:
+    with _trackers_lock:
+        tracker = _trackers.get(name)
+        if tracker is None:
+            tracker = Latency_tracker(name)
+            _trackers[name] = tracker
+        return tracker
+
+
+def latency_stats() -> Dict[str, dict]:
+    return {name: tracker.stats() for name, tracker in _trackers.items()}
+
+
+def send_hedged(
+    send: Callable[[float], requests.Response],
+    tracker: Latency_tracker,
+    timeout: float,
+    executor: concurrent.futures.Executor,
+    hedge_after: float,
+    max_hedge_fraction: float = 0.05,
+    breaker: Optional[Circuit_breaker] = None,
+) -> requests.Response:
+    """Call `send(timeout)` and, if it hasn't answered by the endpoint's p95, send a duplicate and take whichever is first
+
+    `hedge_after` is used until the tracker has enough samples for a p95. The clock starts when the call does, not
+    when it is queued, so waiting for a busy pool doesn't look like a slow upstream. At most `max_hedge_fraction` of
+    requests are hedged, which also keeps a cold instance from hedging everything, and nothing is hedged while
+    `breaker` is open or half open. The slower call is left to finish on its own.
+    The caller must not be one of `executor`'s workers, or it could end up waiting on a hedge that can never start.
+    """
+
+    def timed_send(started: Optional[threading.Event] = None) -> requests.Response:
+        start = time.monotonic()
+        if started is not None:
+            started.set()
+        response = send(timeout)
+        tracker.record(time.monotonic() - start)
+        return response
+
+    tracker.count_request()
+    delay = tracker.percentile(0.95) or hedge_after
+    started = threading.Event()
+    first = submit_in_context(executor, timed_send, started)
+    futures = [first]
+    if delay < timeout and started.wait(timeout):
+        done, _ = concurrent.futures.wait(futures, timeout=delay)
+        if not done and not (breaker and breaker.is_open) and tracker.take_hedge(max_hedge_fraction):
+            futures.append(submit_in_context(executor, timed_send))
+
+    last_error: Optional[BaseException] = None
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            response = future.result()
+        except Exception as e:
+            last_error = e
+            continue
+        if future is not first:
+            tracker.hedge_wins += 1
+        return response
+    assert last_error is not None
+    raise last_error
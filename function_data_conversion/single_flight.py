@@ -0,0 +1,75 @@
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class Single_flight:
+    """Concurrent callers asking for the same key share one in-flight call instead of each making it
+
+    Nothing is kept once the call finishes, caching the result is up to the caller. An exception is raised to
+    everyone who was waiting on that call.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        return {"executions": self.executions, "coalesced": self.coalesced}
+
+
+_groups: Dict[str, Single_flight] = {}
+_groups_lock = Lock()
+
+
+def get_single_flight(name: str) -> Single_flight:
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = Single_flight(name)
+            _groups[name] = group
+        return group
+
+
+def single_flight_stats() -> Dict[str, dict]:
+    return {name: group.stats() for name, group in _groups.items()}
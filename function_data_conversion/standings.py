@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from itertools import groupby
+from os import environ
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+from uuid import UUID
+
+from data_classes import ArmyEntry, Data_sources
+
+T = TypeVar("T")
+
+# given the entries still tied, one sort key each (higher ranks first) or None if it can't separate them
+Tie_breaker = Callable[[List[T]], Optional[List[Any]]]
+
+
+def rank(entries: Iterable[T], score: Callable[[T], Any], tie_breakers: Sequence[Tie_breaker] = ()) -> List[Tuple[int, T]]:
+    """Standings as (placing, entry), best first, from one sort on `score` then the tie-breakers on tied groups only
+
+    Entries still tied after every tie-breaker share a placing and the next one skips, 1, 2, 2, 4. A score of None
+    ranks below everything. Fully tied entries keep the order they came in.
+    """
+    ordered = sorted(entries, key=lambda x: _none_last(score(x)), reverse=True)
+    standings: List[Tuple[int, T]] = []
+    for _, tied in groupby(ordered, key=lambda x: _none_last(score(x))):
+        for group in _break_ties(list(tied), tie_breakers):
+            placing = len(standings) + 1
+            standings.extend((placing, x) for x in group)
+    return standings
+
+
+def _none_last(value: Any) -> Tuple[bool, Any]:
+    return (value is not None, value)
+
+
+def _break_ties(tied: List[T], tie_breakers: Sequence[Tie_breaker]) -> List[List[T]]:
+    if len(tied) == 1 or not tie_breakers:
+        return [tied]
+    keys = tie_breakers[0](tied)
+    if keys is None:
+        return _break_ties(tied, tie_breakers[1:])
+    keyed = sorted(zip(keys, tied), key=lambda x: _none_last(x[0]), reverse=True)
+    groups = []
+    for _, group in groupby(keyed, key=lambda x: _none_last(x[0])):
+        groups.extend(_break_ties([x for _, x in group], tie_breakers[1:]))
+    return groups
+
+
+# Individual tie-breakers, each built once for the whole field
+
+
+def secondary_points(armies: Sequence[ArmyEntry]) -> Tie_breaker:
+    """Total secondary points
+
+    TK reports 0 when secondaries weren't recorded, so for a TK event they are only used if everyone has some.
+    """
+    from_tk = any(x.data_source == Data_sources.TOURNEY_KEEPER for x in armies)
+    recorded = not from_tk or all(x.calculated_total_tournament_secondary_points for x in armies)
+
+    def tie_breaker(tied: List[ArmyEntry]) -> Optional[List[Any]]:
+        return [x.calculated_total_tournament_secondary_points for x in tied] if recorded else None
+
+    return tie_breaker
+
+
+def head_to_head(armies: Sequence[ArmyEntry]) -> Tie_breaker:
+    """Battle points scored in the games the tied players played against each other"""
+
+    def tie_breaker(tied: List[ArmyEntry]) -> Optional[List[Any]]:
+        in_group = {x.army_uuid for x in tied}
+        # nobody in the group has played anybody else in it
+        if not any(r.opponent in in_group for x in tied for r in x.round_performance or []):
+            return None
+        return [sum(r.result or 0 for r in x.round_performance or [] if r.opponent in in_group) for x in tied]
+
+    return tie_breaker
+
+
+def strength_of_schedule(armies: Sequence[ArmyEntry]) -> Tie_breaker:
+    """Total tournament points of everyone a player faced"""
+    totals: Dict[UUID, int] = {x.army_uuid: x.calculated_total_tournament_points or 0 for x in armies}
+
+    def tie_breaker(tied: List[ArmyEntry]) -> Optional[List[Any]]:
+        return [sum(totals.get(r.opponent, 0) for r in x.round_performance or []) for x in tied]
+
+    return tie_breaker
+
+
+tie_breakers_by_name: Dict[str, Callable[[Sequence[ArmyEntry]], Tie_breaker]] = {
+    "secondary_points": secondary_points,
+    "head_to_head": head_to_head,
+    "strength_of_schedule": strength_of_schedule,
+}
+
+
+def individual_tie_breakers(armies: Sequence[ArmyEntry], names: Optional[Sequence[str]] = None) -> List[Tie_breaker]:
+    """Tie-breakers in the order given, by default STANDINGS_TIE_BREAKERS, a comma separated list of names"""
+    if names is None:
+        names = [x.strip() for x in environ.get("STANDINGS_TIE_BREAKERS", "secondary_points").split(",") if x.strip()]
+    unknown = [x for x in names if x not in tie_breakers_by_name]
+    if unknown:
+        raise ValueError(f"Unknown tie-breakers {unknown}, expected some of {list(tie_breakers_by_name)}")
+    return [tie_breakers_by_name[x](armies) for x in names]
+
+
+def rank_individuals(armies: Iterable[ArmyEntry], tie_breakers: Optional[Sequence[str]] = None) -> List[ArmyEntry]:
+    """Sets list_placing from the calculated tournament points, returns the armies best first"""
+    armies = list(armies)
+    standings = rank(armies, lambda x: x.calculated_total_tournament_points, individual_tie_breakers(armies, tie_breakers))
+    for placing, army in standings:
+        army.list_placing = placing
+    return [army for _, army in standings]
+
+
+# Teams
+
+
+@dataclass
+class Team_result:
+    name: str
+    members: List[ArmyEntry]
+    soft_points: int = 0
+    tournament_points: int = 0
+    secondary_points: int = 0
+    placing: Optional[int] = None
+    round_points: List[int] = field(default_factory=list)
+
+
+def clamp_round(points: int, cap_min: Optional[int], cap_max: Optional[int]) -> int:
+    """A team's round total held between the event's caps, a cap that is 0 or None is no cap"""
+    if cap_max:
+        points = min(points, cap_max)
+    if cap_min:
+        points = max(points, cap_min)
+    return points
+
+
+def score_team(result: Team_result, rounds: int, cap_min: Optional[int], cap_max: Optional[int]) -> None:
+    result.round_points = []
+    result.secondary_points = 0
+    for round_index in range(rounds):
+        played = [
+            x.round_performance[round_index]
+            for x in result.members
+            if x.round_performance and round_index < len(x.round_performance)
+        ]
+        result.round_points.append(clamp_round(sum(x.result or 0 for x in played), cap_min, cap_max))
+        result.secondary_points += sum(x.secondary_points or 0 for x in played)
+    result.tournament_points = result.soft_points + sum(result.round_points)
+
+
+def rank_teams(teams: Iterable[Team_result], rounds: int, cap_min: Optional[int], cap_max: Optional[int]) -> List[Team_result]:
+    """Scores each team once and sets its placing and totals on every member, returns the teams best first
+
+    Teams are ranked on tournament points then secondary points, and teams tied on both share a placing.
+    """
+    teams = list(teams)
+    for team in teams:
+        score_team(team, rounds, cap_min, cap_max)
+
+    standings = rank(teams, lambda x: x.tournament_points, [lambda tied: [x.secondary_points for x in tied]])
+    for placing, team in standings:
+        team.placing = placing
+        for army in team.members:
+            army.team_placing = placing
+            army.team_total_tournament_points = team.tournament_points
+            army.team_total_secondary_points = team.secondary_points
+    return [team for _, team in standings]
@@ -0,0 +1,50 @@
+from threading import Lock
+from typing import Iterable, List
+
+
+class String_pool:
+    """Canonical copy of strings that repeat a lot, e.g. unit names and "musician", "standard bearer", "champion"
+
+    Parsed lists build these strings fresh for every unit so a big batch ends up holding thousands of equal copies.
+    Handing back the pooled copy frees the duplicates and lets later comparisons short circuit on identity.
+    """
+
+    def __init__(self, max_size: int = 50_000) -> None:
+        """
+        Args:
+            max_size (int): once this many distinct strings are pooled new strings are passed through untouched,
+                so free text that never repeats can't grow the pool without bound in a warm instance.
+        """
+        self.max_size = max_size
+        self._pool: dict[str, str] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def intern(self, value: str) -> str:
+        pooled = self._pool.get(value)
+        if pooled is not None:
+            self.hits += 1
+            return pooled
+
+        with self._lock:
+            self.misses += 1
+            if len(self._pool) >= self.max_size:
+                return value
+            return self._pool.setdefault(value, value)
+
+    def intern_list(self, values: Iterable[str]) -> List[str]:
+        return [self.intern(x) for x in values]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._pool),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# shared by all parsers in the instance
+unit_strings = String_pool()
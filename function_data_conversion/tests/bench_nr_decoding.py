@@ -0,0 +1,55 @@
+"""Benchmark of decoding the stored New Recruit events in tests/fixtures/new_recruit, pydantic against msgspec
+
+    python tests/bench_nr_decoding.py [--repeat 3]
+
+Each event is built the way the integration test builds its payload, then decoded from bytes both ways. The decoded
+events are checked to be the same before anything is timed.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "scripts")))
+
+import nr_decoding
+from benchmark_conversion import fixtures, stored_data_for
+from new_recruit_tournaments import single_event
+
+
+def decode_with_pydantic(raw: bytes) -> single_event:
+    return single_event(**json.loads(raw))
+
+
+def timed(label, fn, payloads, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for raw in payloads:
+            fn(raw)
+    print(f"{label:<20} {(time.perf_counter() - start) / repeat * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if not nr_decoding.available():
+        sys.exit("msgspec is not installed")
+
+    payloads = [
+        json.dumps(stored_data_for(x)).encode("utf-8")
+        for x in sorted(fixtures.glob("tournament_*.json"))
+        if (fixtures / x.name.replace("tournament_", "games_")).exists()
+    ]
+    games = 0
+    for raw in payloads:
+        expected = decode_with_pydantic(raw)
+        assert nr_decoding.decode_event(raw).dict() == expected.dict()
+        games += len(expected.games)
+    print(f"{len(payloads)} events, {games} games, {sum(len(x) for x in payloads) / 1e6:.1f} MB")
+
+    timed("pydantic", decode_with_pydantic, payloads, args.repeat)
+    timed("msgspec", nr_decoding.decode_event, payloads, args.repeat)
@@ -0,0 +1,87 @@
+"""Micro-benchmark of building the TK player list for a synthetic 300 player, 5 round event
+
+    python tests/bench_tk_players.py [--players 300] [--rounds 5] [--latency 0.02]
+
+Times the player detail fetch stage against a fake TK that sleeps for `latency` per call, then the single pass
+codex map and player list against the per player scan of the games it replaced.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import tourney_keeper
+
+codices = ["Ogre Khans", "Vampire Covenant", "Daemon Legions", "Dwarven Holds", "Sylvan Elves", "Beast Herds"]
+
+
+def synthetic_event(players: int, rounds: int):
+    rng = random.Random(9)
+    ids = list(range(5000, 5000 + players))
+    codex = {Id: rng.choice(codices) for Id in ids}
+    games = []
+    for round_number in range(1, rounds + 1):
+        rng.shuffle(ids)
+        for player1, player2 in zip(ids[::2], ids[1::2]):
+            result = rng.randint(0, 20)
+            games.append(
+                {
+                    "Round": round_number,
+                    "Player1Id": player1,
+                    "Player2Id": player2,
+                    "Player1Result": result,
+                    "Player2Result": 20 - result,
+                    "Player1PrimaryCodex": codex[player1],
+                    "Player2PrimaryCodex": codex[player2],
+                }
+            )
+    details = {
+        Id: {"TournamentPlayerId": Id, "PlayerId": Id + 100_000, "PlayerName": f"Player Name {Id}", "Active": True}
+        for Id in ids
+    }
+    return games, details
+
+
+def codex_by_scan(games, tournament_player_id):
+    """What Get_players_names_from_games did for every player before the codex map"""
+    primary_codex = next((x.get("Player1PrimaryCodex") for x in games if x.get("Player1Id") == tournament_player_id), None)
+    if primary_codex is None:
+        primary_codex = next((x.get("Player2PrimaryCodex") for x in games if x.get("Player2Id") == tournament_player_id), None)
+    return primary_codex
+
+
+def timed(label, fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    print(f"{label:<40} {(time.perf_counter() - start) / repeat * 1000:9.2f} ms")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per fake GetPlayerArmyDetails call")
+    args = parser.parse_args()
+
+    games, details = synthetic_event(args.players, args.rounds)
+    print(f"{args.players} players, {len(games)} games")
+
+    def fake_details(Id):
+        time.sleep(args.latency)
+        return details[Id]
+
+    with patch.object(tourney_keeper, "Get_Player_Army_Details", fake_details):
+        fetched = timed("player detail stage", lambda: tourney_keeper.Get_player_details(details.keys()))
+    print(f"{'':<40} {args.players * args.latency * 1000:9.2f} ms if fetched one at a time")
+
+    player_ids = list(details)
+    by_scan = timed("codex by scanning games per player", lambda: {Id: codex_by_scan(games, Id) for Id in player_ids}, 5)
+    by_map = timed("codex map in one pass", lambda: tourney_keeper.primary_codices(games), 5)
+    assert all(by_map.get(Id) == codex for Id, codex in by_scan.items())
+    timed("player list from fetched details", lambda: tourney_keeper.Get_players_names_from_games(games, fetched), 5)
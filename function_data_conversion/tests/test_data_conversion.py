@@ -1,3 +1,4 @@
+import contextvars
 import sys
 import os
 import pytest
@@ -38,4 +39,1004 @@ def test_conversion_success():
         mock_blob.download_as_string.return_value = b'{"data": []}'
         
         function_data_conversion({"bucket": "b", "name": "f.json"}, MagicMock())
-        mock_blob.download_as_string.assert_called()
\ No newline at end of file
+        mock_blob.download_as_string.assert_called()
+
+def test_classified_blocks_tag_player_names():
+    from converter import split_classified_lines_into_blocks
+    from line_classifier import Line_types, classify_lines
+
+    lines = [
+        "Russell",
+        "Vampire Covenant",
+        "515 - Vampire Courtier, General",
+        "Total Army Cost: 4499 pts",
+        "Bob",
+        "OK",
+        "500 - Great Khan, General",
+        "480 - Shaman, Wizard Master",
+    ]
+    blocks = split_classified_lines_into_blocks(classify_lines(lines))
+
+    assert [[x.text for x in block] for block in blocks] == [lines[:4], lines[4:]]
+    assert [block[0].line_type for block in blocks] == [Line_types.PLAYER_NAME] * 2
+    assert blocks[0][3].total_points == 4499
+    assert blocks[1][1].army_name == "Ogre Khans"
+    assert blocks[1][2].line_type == Line_types.UNIT_LINE
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "515 - Vampire Courtier, General (The Dead Arise), Wizard (Wizard Master, Occultism)",
+        "740 - 10x Bruisers, Standard Bearer (Pennant of the Great Grass Sky), Musician, Champion",
+        "300 - 20 Spearmen, M, S, C, FCG, bsb, Full Command Group",
+        "250 - 5 Hunters, Crossbow (4+), Bow 4+, Shield [15 pts], Lance 20pts, Tyrant&#39;s Blade",
+        "810 tengu commander general 155 skink commander",
+    ],
+)
+def test_unit_tokenizer_matches_legacy_parser(line):
+    from new_recruit_parser import new_recruit_parser
+
+    def as_tuples(units):
+        return [(x.points, x.quantity, x.name, x.upgrades) for x in units]
+
+    assert as_tuples(new_recruit_parser(legacy_unit_parser=False).parse_unit_line(line)) == as_tuples(
+        new_recruit_parser(legacy_unit_parser=True).parse_unit_line(line)
+    )
+
+
+def test_string_pool_dedupes_and_counts():
+    from string_pool import String_pool
+
+    pool = String_pool(max_size=2)
+    first = pool.intern("".join(["musi", "cian"]))
+    second = pool.intern("".join(["music", "ian"]))
+    assert first is second
+    pool.intern("champion")
+    overflow = "".join(["standard ", "bearer"])
+    assert pool.intern(overflow) is overflow  # pool is full so it is passed through
+
+    assert pool.stats() == {"size": 2, "hits": 1, "misses": 3, "hit_rate": 0.25}
+
+
+def test_slotted_army_entries_serialise_as_before(tmp_path):
+    import dataclasses
+    import json
+    from datetime import datetime, timezone
+    from uuid import UUID
+
+    from data_classes import ArmyEntry, Data_sources, Event_types, Round, UnitEntry
+    from utility_functions import Write_army_lists_to_json_file
+
+    army = ArmyEntry(
+        player_name="Bob",
+        army="Vampire Covenant",
+        tournament="Brawler Bash 2021",
+        event_date=datetime(2021, 5, 1, tzinfo=timezone.utc),
+        event_type=Event_types.SINGLES,
+        data_source=Data_sources.NEW_RECRUIT,
+        reported_total_army_points=300,
+        validated=True,
+        round_performance=[Round(opponent=UUID(int=2), result=15, secondary_points=2, round_number=1, game_uuid=UUID(int=3))],
+        units=[UnitEntry(points=300, quantity=25, name="Spearmen", upgrades=["Musician", "Standard Bearer"], unit_uuid=UUID(int=4))],
+        army_uuid=UUID(int=1),
+    )
+    # fields are still set one at a time as a list is parsed
+    army.calculate_total_points()
+    army.list_placing = 3
+    with pytest.raises(AttributeError):
+        army.not_a_field = 1
+
+    # written by the unslotted dataclasses before they were slotted
+    expected = {
+        "army": "Vampire Covenant",
+        "army_uuid": "00000000-0000-0000-0000-000000000001",
+        "calculated_total_army_points": 300,
+        "data_source": "NEW_RECRUIT",
+        "event_date": "2021-05-01T00:00:00Z",
+        "event_type": "SINGLES",
+        "list_placing": 3,
+        "player_name": "Bob",
+        "reported_total_army_points": 300,
+        "round_performance": [
+            {
+                "game_uuid": "00000000-0000-0000-0000-000000000003",
+                "opponent": "00000000-0000-0000-0000-000000000002",
+                "result": 15,
+                "round_number": 1,
+                "secondary_points": 2,
+            }
+        ],
+        "tournament": "Brawler Bash 2021",
+        "units": [
+            {
+                "name": "Spearmen",
+                "points": 300,
+                "quantity": 25,
+                "unit_uuid": "00000000-0000-0000-0000-000000000004",
+                "upgrades": ["Musician", "Standard Bearer"],
+            }
+        ],
+        "validated": True,
+    }
+    path = tmp_path / "armies.json"
+    Write_army_lists_to_json_file(path, [army])
+    assert path.read_text() == json.dumps(expected) + "\n"
+
+    as_dict = dataclasses.asdict(army)
+    assert list(as_dict) == [x.name for x in dataclasses.fields(ArmyEntry)]
+    assert as_dict["units"][0]["upgrades"] == ["Musician", "Standard Bearer"]
+    assert as_dict["round_performance"][0]["opponent"] == UUID(int=2)
+    assert ArmyEntry(**{**as_dict, "units": None, "round_performance": None}).list_placing == 3
+
+
+def test_disk_cache_ttl_and_eviction(tmp_path):
+    import os
+
+    from disk_cache import Disk_cache, cache_key
+
+    cache = Disk_cache(name="test", directory=str(tmp_path), ttl_seconds=60, max_entries=10)
+    keys = [cache_key("block", str(i), None) for i in range(11)]
+    for i, key in enumerate(keys):
+        cache.set(key, {"i": i})
+        # spread the modified times out so eviction order is deterministic
+        os.utime(tmp_path / key[:2] / f"{key}.json", (i, i))
+
+    assert cache.get(keys[0]) is None  # least recently used, evicted once over max_entries
+    assert cache.get(keys[10]) == {"i": 10}
+    assert cache.stats() == {"hits": 1, "remote_hits": 0, "misses": 1}
+
+    cache.ttl_seconds = -1
+    assert cache.get(keys[10]) is None
+
+
+def test_async_conversion_without_formatter(monkeypatch):
+    import asyncio
+
+    import converter
+
+    monkeypatch.setattr(converter, "format_army_block", lambda **kwargs: None)
+    lines = [
+        "Russell",
+        "Vampire Covenant",
+        "515 - Vampire Courtier, General",
+        "4499",
+        "Bob",
+        "Ogre Khans",
+        "500 - Great Khan, General",
+    ]
+    armies = asyncio.run(
+        converter.Convert_lines_to_army_list_async(event_name="test", event_date=None, lines=iter(lines))
+    )
+
+    assert [(x.player_name, x.army, x.event_size) for x in armies] == [
+        ("Russell", "Vampire Covenant", 2),
+        ("Bob", "Ogre Khans", 2),
+    ]
+
+
+def test_blocks_are_sent_before_the_input_is_read(monkeypatch):
+    import threading
+
+    import converter
+    from multi_error import Multi_Error
+
+    first_block_sent = threading.Event()
+    sent = []
+
+    def process(block, event_size, event_name, ingest_date, event_date, session):
+        sent.append([x.text for x in block])
+        first_block_sent.set()
+        return converter.parse_army_block(block, event_name, event_size, ingest_date)
+
+    monkeypatch.setattr(converter, "proccess_block", process)
+
+    read_after_first_block = []
+
+    def document():
+        yield from ["Russell", "Vampire Covenant", "515 - Vampire Courtier, General", "4499"]
+        # the rest of the file is only read once the first list has gone off to be formatted
+        read_after_first_block.append(first_block_sent.wait(timeout=5))
+        yield from ["Bob", "Ogre Khans", "500 - Great Khan, General"]
+
+    armies = converter.Convert_lines_to_army_list(event_name="test", event_date=None, lines=document())
+
+    assert read_after_first_block == [True]
+    assert sent[0] == ["Russell", "Vampire Covenant", "515 - Vampire Courtier, General", "4499"]
+    # the last list never had a total, and the event size is only filled in once every block is known
+    assert [(x.player_name, x.army, x.event_size) for x in armies] == [("Russell", "Vampire Covenant", 2), ("Bob", "Ogre Khans", 2)]
+
+    # without an army name anywhere the whole file is a single block, which fails for having no army
+    sent.clear()
+    with pytest.raises(Multi_Error) as e:
+        converter.Convert_lines_to_army_list(event_name="test", event_date=None, lines=iter(["just some notes", "and more"]))
+    assert sent == [["just some notes", "and more"]]
+    assert "armylist.army was None" in str(e.value.errors[0])
+
+    sent.clear()
+    with pytest.raises(Multi_Error) as e:
+        converter.Convert_lines_to_army_list(event_name="test", event_date=None, lines=iter([]))
+    assert "No Army lists were found" in str(e.value.errors[0])
+
+
+def test_batched_conversion_keeps_lists_apart(monkeypatch):
+    import converter
+
+    monkeypatch.setattr(converter, "format_army_block", lambda **kwargs: None)
+    armies, errors = converter.Convert_lists_to_army_lists(
+        event_name="test",
+        event_date=None,
+        lists={
+            "p1": ["Russell", "Vampire Covenant", "515 - Vampire Courtier, General", "4499"],
+            "p2": ["Bob", "Not an army", "500 - Great Khan, General"],
+            "p3": ["Alice", "Ogre Khans", "500 - Great Khan, General", "4500"],
+        },
+    )
+
+    assert {key: [x.player_name for x in value] for key, value in armies.items()} == {"p1": ["Russell"], "p3": ["Alice"]}
+    assert list(errors) == ["p2"]
+    assert "armylist.army was None" in str(errors["p2"].errors[0])
+
+def test_retry_then_circuit_opens(monkeypatch):
+    import requests
+
+    import resilience
+    from resilience import Circuit_breaker, Circuit_open_error, Deadline, send_with_retry
+
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+    breaker = Circuit_breaker("test", failure_threshold=3, reset_timeout=60)
+    deadline = Deadline(60)
+    calls = []
+
+    def timing_out(timeout):
+        calls.append(timeout)
+        raise requests.exceptions.ReadTimeout()
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        send_with_retry(timing_out, breaker=breaker, timeout=30, attempts=3, deadline=deadline)
+    assert len(calls) == 3
+    assert breaker.is_open
+
+    with pytest.raises(Circuit_open_error):
+        send_with_retry(timing_out, breaker=breaker, timeout=30, deadline=deadline)
+    assert len(calls) == 3
+
+
+def test_retry_returns_first_good_response(monkeypatch):
+    from unittest.mock import MagicMock
+
+    import resilience
+    from resilience import Circuit_breaker, Deadline, send_with_retry
+
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+    responses = iter([MagicMock(status_code=503), MagicMock(status_code=200)])
+    breaker = Circuit_breaker("test", failure_threshold=3, reset_timeout=60)
+
+    response = send_with_retry(lambda timeout: next(responses), breaker=breaker, timeout=30, deadline=Deadline(60))
+
+    assert response.status_code == 200
+    assert not breaker.is_open
+
+
+def test_half_open_trial_released_on_unexpected_error(monkeypatch):
+    from unittest.mock import MagicMock
+
+    import requests
+
+    import resilience
+    from resilience import Circuit_breaker, Deadline, send_with_retry
+
+    monkeypatch.setattr(resilience.time, "sleep", lambda seconds: None)
+    breaker = Circuit_breaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.is_open
+
+    def interrupted(timeout):
+        raise KeyboardInterrupt()
+
+    def broken_stream(timeout):
+        raise requests.exceptions.ChunkedEncodingError()
+
+    for send, error in ((interrupted, KeyboardInterrupt), (broken_stream, requests.exceptions.ChunkedEncodingError)):
+        with pytest.raises(error):
+            send_with_retry(send, breaker=breaker, timeout=30, deadline=Deadline(60))
+
+    # the next trial is still let through and closes the circuit
+    response = send_with_retry(lambda timeout: MagicMock(status_code=200), breaker=breaker, timeout=30, deadline=Deadline(60))
+    assert response.status_code == 200 and not breaker.is_open
+
+
+def test_invocation_deadlines_are_per_context(monkeypatch):
+    import contextvars
+    import threading
+
+    from resilience import current_deadline, start_invocation_deadline
+    from upstream_pool import get_upstream_pool
+
+    assert current_deadline().remaining() == float("inf")
+
+    monkeypatch.setenv("INVOCATION_TIMEOUT_SECONDS", "100")
+    monkeypatch.setenv("INVOCATION_TIMEOUT_MARGIN_SECONDS", "0")
+    first = contextvars.copy_context().run(start_invocation_deadline)
+    first.expires_at -= 90  # this invocation has been running a while
+
+    seen = {}
+
+    def invocation():
+        deadline = start_invocation_deadline()
+        seen["own"] = deadline
+        seen["worker"] = get_upstream_pool("deadline.test").submit(current_deadline).result()
+
+    thread = threading.Thread(target=invocation)
+    thread.start()
+    thread.join()
+
+    # starting another invocation didn't give the first one its time back, and pool workers see the caller's deadline
+    assert first.remaining() < 11
+    assert seen["worker"] is seen["own"]
+    assert current_deadline().remaining() == float("inf")
+
+
+def test_validation_is_cached(tmp_path, monkeypatch):
+    from unittest.mock import MagicMock
+
+    import new_recruit_parser as parser_module
+    from disk_cache import Disk_cache
+
+    monkeypatch.setattr(
+        parser_module,
+        "validation_cache",
+        Disk_cache(name="test", directory=str(tmp_path), ttl_seconds=60, max_entries=10),
+    )
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=200, json=lambda: [{"msg": "too many points"}])
+    monkeypatch.setattr(parser_module, "get_upstream_pool", lambda host: MagicMock(session=session))
+
+    lines = ["Bob", "Ogre Khans", "500 - A", "480 - B", "315 - C", "740 - D"]
+    assert parser_module.new_recruit_parser().validate(lines) == ["too many points"]
+    assert parser_module.new_recruit_parser().validate(["Someone else"] + lines[1:]) == ["too many points"]
+    assert session.post.call_count == 1
+
+
+def test_prewarm_is_not_bound_by_the_invocation_deadline(tmp_path, monkeypatch):
+    from unittest.mock import MagicMock
+
+    import new_recruit_parser as parser_module
+    import prewarm_validation_cache
+    from disk_cache import Disk_cache
+    from resilience import start_invocation_deadline
+
+    monkeypatch.setattr(
+        parser_module,
+        "validation_cache",
+        Disk_cache(name="test", directory=str(tmp_path / "cache"), ttl_seconds=60, max_entries=10),
+    )
+    monkeypatch.setattr(prewarm_validation_cache, "validation_cache", parser_module.validation_cache)
+    session = MagicMock()
+    session.post.return_value = MagicMock(status_code=200, json=lambda: [])
+    monkeypatch.setattr(parser_module, "get_upstream_pool", lambda host: MagicMock(session=session))
+
+    lists = tmp_path / "lists"
+    lists.mkdir()
+    (lists / "event.txt").write_text("Bob\nOgre Khans\n500 - A\n480 - B\n315 - C\n740 - D\n4500", encoding="utf-8")
+
+    def prewarm_after_the_budget_is_spent():
+        monkeypatch.setenv("INVOCATION_TIMEOUT_SECONDS", "0")
+        start_invocation_deadline()
+        return prewarm_validation_cache.prewarm_validation_cache(lists)
+
+    stats = contextvars.copy_context().run(prewarm_after_the_budget_is_spent)
+    assert stats["lists"] == 1 and session.post.call_count == 1
+    assert parser_module.new_recruit_parser().validate(["Bob", "Ogre Khans", "500 - A", "480 - B", "315 - C", "740 - D", "4500"]) == []
+    assert session.post.call_count == 1  # answered from the cache the prewarm filled
+
+
+def test_tk_game_data_joins_by_player_id():
+    from data_classes import ArmyEntry, Data_sources, Event_types, Tk_info
+    from tourney_keeper import append_tk_game_data
+
+    armies = [ArmyEntry(player_name=name, tourney_keeper_TournamentPlayerId=i) for i, name in enumerate("abc", 1)]
+    tk_info = Tk_info(
+        event_type=Event_types.SINGLES,
+        game_list=[
+            {"Player1Id": 1, "Player2Id": 2, "Round": 1, "Player1Result": 15, "Player2Result": 5, "Player1SecondaryResult": 900, "Player2SecondaryResult": 300},
+            {"Player1Id": 3, "Player2Id": 4, "Round": 1, "Player1Result": 20, "Player2Result": 0, "Player1SecondaryResult": 1, "Player2SecondaryResult": 0},
+            {"Player1Id": 3, "Player2Id": 1, "Round": 2, "Player1Result": 8, "Player2Result": 12, "Player1SecondaryResult": 400, "Player2SecondaryResult": 500},
+            {"Player1Id": 2, "Player2Id": 3, "Round": 3, "Player1Result": 10, "Player2Result": 10, "Player1SecondaryResult": 200, "Player2SecondaryResult": 200},
+        ],
+        player_list={
+            10 + i: {"TournamentPlayerId": i, "Player_name": name, "Active": name != "dropped"}
+            for i, name in enumerate(["a", "b", "c", "dropped"], 1)
+        },
+    )
+
+    append_tk_game_data(tk_info, armies)
+
+    # the game against the dropped player without a list is skipped
+    assert [(x.player_name, x.list_placing, x.calculated_total_tournament_points) for x in armies] == [
+        ("a", 1, 27),
+        ("c", 2, 18),
+        ("b", 3, 15),
+    ]
+    a, c, b = armies
+    assert [x.opponent for x in a.round_performance] == [b.army_uuid, c.army_uuid]
+    assert a.round_performance[1].game_uuid == c.round_performance[0].game_uuid
+    assert all(x.data_source == Data_sources.TOURNEY_KEEPER for x in armies)
+
+
+def test_name_matrix_matches_token_sort_ratio():
+    from fuzzywuzzy import fuzz
+
+    from name_matching import token_sort_ratio_matrix
+    from tourney_keeper import unmatched_names
+
+    from_file = ["Bob Smith", "José Ruiz", "Ann", "Ann", None]
+    from_tk = ["smith, bob", "Jose Ruiz", "Anne", "Ann", "Someone Else"]
+    assert token_sort_ratio_matrix(from_file, from_tk) == [
+        [fuzz.token_sort_ratio(x, y) for y in from_tk] for x in from_file
+    ]
+
+    # accents are dropped rather than transliterated, and the second "Ann" is crossed off without a tk name left
+    assert unmatched_names(from_file[:4], from_tk) == (["José Ruiz"], ["Jose Ruiz", "Anne", "Someone Else"])
+
+
+def test_tournament_index_lookups():
+    from tournament_index import Tournament_index
+
+    index = Tournament_index(
+        [
+            {"Name": "Brisy Battles 3", "Id": 1},
+            {"Name": "Ögre Cup: 2023", "Id": 2},
+            {"Name": "ogre cup 2023", "Id": 3},
+            {"Name": "Brisy Battle 1", "Id": 4},
+        ]
+    )
+
+    assert index.find_exact("2023 Ogre Cup")["Id"] == 2  # first listed wins
+    assert index.find_exact("brisy battle 3") is None
+    assert [x["Id"] for x in index.containing("Brisy Battle")] == [1, 4]
+    assert index.similar("Brisy Battles 1", 80) == [("Brisy Battles 3", 93), ("Brisy Battle 1", 97)]
+
+
+def test_tk_catalogue_persists_and_tops_up(tmp_path):
+    from datetime import timedelta
+
+    from disk_cache import Disk_cache
+    from tk_catalogue import Tk_catalogue
+
+    calls = []
+    responses = [
+        [{"Id": 1, "Name": "Old GT", "Start": "2020-01-01T09:00:00"}, {"Id": 2, "Name": "Club Night"}],
+        [{"Id": 2, "Name": "Club Night (renamed)"}, {"Id": 3, "Name": "New Event"}],
+        None,
+    ]
+
+    def fetch(start, end):
+        calls.append((start, end))
+        return responses[len(calls) - 1]
+
+    def catalogue():
+        store = Disk_cache(name="tk", directory=str(tmp_path), ttl_seconds=60, max_entries=10)
+        return Tk_catalogue(fetch, store, ttl_seconds=600, history=timedelta(days=3 * 365), overlap=timedelta(days=7))
+
+    first = catalogue()
+    assert [x["Id"] for x in first.tournaments()] == [2]  # 2020 is outside the history window
+    assert first.staleness()["source"] == "tourney_keeper"
+
+    # a new instance starts from the stored copy without calling TK
+    second = catalogue()
+    assert [x["Name"] for x in second.tournaments()] == ["Club Night"]
+    assert second.staleness()["source"] == "cache" and len(calls) == 1
+
+    assert second.refresh()
+    assert calls[1][0] == calls[0][1] - timedelta(days=7)  # only since the last sync
+    assert [x["Name"] for x in second.tournaments()] == ["Club Night (renamed)", "New Event"]
+
+    assert not second.refresh()
+    assert len(second.tournaments()) == 2 and second.staleness()["last_error"]
+
+    # a full resync drops what TK no longer has
+    responses.append([{"Id": 3, "Name": "New Event"}])
+    second.full_sync_seconds = -1
+    assert second.refresh()
+    assert calls[3][0] == calls[3][1] - timedelta(days=3 * 365)
+    assert [x["Name"] for x in second.tournaments()] == ["New Event"]
+    reloaded = catalogue()
+    assert len(reloaded.tournaments()) == 1 and len(calls) == 4
+    assert reloaded.staleness()["fully_synced_at"] == second.staleness()["fully_synced_at"]
+
+
+def test_tk_catalogue_refreshes_once_until_synced(tmp_path):
+    import threading
+    from datetime import timedelta
+
+    from disk_cache import Disk_cache
+    from tk_catalogue import Tk_catalogue
+
+    calls = []
+    release = threading.Event()
+
+    def fetch(start, end):
+        calls.append(start)
+        release.wait(5)
+        return None  # TK is down
+
+    def catalogue():
+        store = Disk_cache(name="tk", directory=str(tmp_path), ttl_seconds=60, max_entries=10)
+        return Tk_catalogue(fetch, store, ttl_seconds=600, history=timedelta(days=3 * 365), overlap=timedelta(days=7))
+
+    # a cold instance waits on the first sync once, lookups after it failed don't start another
+    release.set()
+    cold = catalogue()
+    for _ in range(5):
+        assert cold.tournaments() == []
+        cold.refresh_if_older_than(60)
+    assert len(calls) == 1
+
+    # lookups while a background refresh is running don't start another, a miss waits for it
+    release.clear()
+    cold.retry_seconds = -1
+    assert cold.tournaments() == []
+    cold._refresh_thread.join(0.1)
+    for _ in range(5):
+        cold.tournaments()
+    missed = threading.Thread(target=cold.refresh_if_older_than, args=(60,))
+    missed.start()
+    missed.join(0.1)
+    assert missed.is_alive()
+    release.set()
+    missed.join(5)
+    cold._refresh_thread.join(5)
+    assert len(calls) == 2
+
+
+def test_nr_library_extract_revalidated(tmp_path):
+    import json
+
+    import requests
+
+    from disk_cache import Disk_cache
+    from nr_library_cache import Nr_library_cache
+
+    library = [{"id": 6, "name": "The Ninth Age", "books": ["big"]}, {"id": 7, "name": "Other"}]
+    bundled = tmp_path / "library.json"
+    bundled.write_text(json.dumps(library))
+    requests_made = []
+    responses = [
+        MagicMock(status_code=200, headers={"ETag": '"v1"'}, json=lambda: library),
+        MagicMock(status_code=304, headers={}),
+        requests.exceptions.ConnectionError("down"),
+    ]
+
+    def fetch(headers):
+        requests_made.append(headers)
+        response = responses[len(requests_made) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def library_cache(ttl_seconds=600):
+        store = Disk_cache(name="nr", directory=str(tmp_path / "store"), ttl_seconds=60, max_entries=10)
+        compact = lambda entry: {"id": entry["id"], "name": entry["name"]}
+        return Nr_library_cache(fetch, compact, store, ttl_seconds=ttl_seconds, retry_seconds=0, bundled_path=bundled)
+
+    first = library_cache().get(6)
+    assert first.entry == {"id": 6, "name": "The Ninth Age"} and first.source == "new_recruit"
+
+    # a cold instance reads the stored extract, and once it is due asks New Recruit whether it changed
+    assert library_cache().get(6).source == "cache" and len(requests_made) == 1
+    revalidated = library_cache(ttl_seconds=-1).get(6)
+    assert requests_made[1] == {"If-None-Match": '"v1"'}
+    assert revalidated.source == "new_recruit" and revalidated.version == first.version
+
+    # nothing stored and New Recruit down, the bundled copy is served and reported as such
+    (tmp_path / "store").rename(tmp_path / "gone")
+    cache = library_cache()
+    assert cache.get(6).entry == first.entry
+    assert cache.staleness()[6]["source"] == "bundled_file" and cache.staleness()[6]["stale"]
+
+
+def test_tk_snapshot_reused_on_reupload(tmp_path, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    import tourney_keeper
+    from disk_cache import Disk_cache
+
+    monkeypatch.setattr(
+        tourney_keeper,
+        "tk_snapshots",
+        Disk_cache(name="test", directory=str(tmp_path), ttl_seconds=60, max_entries=10),
+    )
+    games = [{"Player1Id": 1, "Player2Id": 2}]
+    detail_calls = []
+    monkeypatch.setattr(tourney_keeper, "Get_games_for_tournament", lambda Id: games)
+    monkeypatch.setattr(tourney_keeper, "Get_active_players", lambda Id: 2)
+    monkeypatch.setattr(
+        tourney_keeper,
+        "Get_Player_Army_Details",
+        lambda Id: detail_calls.append(Id) or {"TournamentPlayerId": Id, "PlayerName": f"p{Id}"},
+    )
+
+    finished = datetime.now(timezone.utc) - timedelta(days=30)
+    first = tourney_keeper.load_tk_snapshot(7, finished)
+    assert tourney_keeper.load_tk_snapshot(7, finished) == first
+    assert first[1][2] == {"TournamentPlayerId": 2, "PlayerName": "p2"}
+    assert sorted(detail_calls) == [1, 2]
+
+    # still running, games are fetched again but only the new player's details are
+    games = games + [{"Player1Id": 3, "Player2Id": 1}]
+    running = datetime.now(timezone.utc)
+    assert sorted(tourney_keeper.load_tk_snapshot(7, running)[1]) == [1, 2, 3]
+    assert sorted(detail_calls) == [1, 2, 3]
+
+    tourney_keeper.load_tk_snapshot(7, running, force_refresh=True)
+    assert len(detail_calls) == 6
+
+    # TK is down, the stored snapshot is served and kept
+    monkeypatch.setattr(tourney_keeper, "Get_games_for_tournament", lambda Id: None)
+    assert tourney_keeper.load_tk_snapshot(7, running)[0] == games
+    assert tourney_keeper.load_tk_snapshot(7, running, force_refresh=True)[0] is None
+    assert tourney_keeper.load_tk_snapshot(7, running)[0] == games
+
+
+def test_names_fixed_on_tk_are_rechecked(tmp_path, monkeypatch):
+    from datetime import datetime, timezone
+
+    import tourney_keeper
+    from disk_cache import Disk_cache
+    from utility_functions import upload_option
+
+    monkeypatch.setattr(
+        tourney_keeper,
+        "tk_snapshots",
+        Disk_cache(name="test", directory=str(tmp_path), ttl_seconds=60, max_entries=10),
+    )
+    names = {1: "Bob", 2: "Alise", 3: "Dana"}
+    detail_calls = []
+    monkeypatch.setattr(
+        tourney_keeper,
+        "Get_games_for_tournament",
+        lambda Id: [{"Player1Id": 1, "Player2Id": 2}, {"Player1Id": 3, "Player2Id": 1}],
+    )
+    monkeypatch.setattr(tourney_keeper, "Get_active_players", lambda Id: 3)
+    monkeypatch.setattr(
+        tourney_keeper,
+        "Get_Player_Army_Details",
+        lambda Id: detail_calls.append(Id) or {"TournamentPlayerId": Id, "PlayerId": Id + 100, "PlayerName": names[Id]},
+    )
+    tournament = {"Id": 7, "Start": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")}
+    tk_info, tk_names = tourney_keeper.load_tk_event_and_names(tournament, False)
+    assert sorted(detail_calls) == [1, 2, 3]
+
+    # everyone matches, nothing is asked again
+    assert tourney_keeper.recheck_unmatched_players(tk_info, tk_names, ["Bob", "Alise", "Dana"]) == (tk_info, tk_names)
+    assert len(detail_calls) == 3
+
+    # fixed on TK, only the player nobody matched is fetched again and the snapshot keeps the new name
+    names[2] = "Alice"
+    tk_info, tk_names = tourney_keeper.recheck_unmatched_players(tk_info, tk_names, ["Bob", "Alice", "Dana"])
+    assert detail_calls[3:] == [2]
+    assert tk_info.player_list[102]["Player_name"] == "Alice"
+    assert "alice" in tk_names
+    assert tourney_keeper.load_tk_snapshot(7, tk_info.event_date)[1][2]["PlayerName"] == "Alice"
+
+    # a re-upload can ask for everything again through the object's custom metadata
+    assert upload_option({"name": "x.docx", "metadata": {"refresh_tk": "True"}}, "refresh_tk") is True
+    assert upload_option({"name": "x.docx", "metadata": {"refresh_tk": "false"}}, "refresh_tk") is False
+    assert upload_option({"name": "x.docx", "refresh_tk": True}, "refresh_tk") is True
+    assert upload_option({"name": "x.docx"}, "refresh_tk") is None
+    assert upload_option({"name": "x.docx", "metadata": {"match_first": "true"}}, "match_first") is True
+
+
+def test_standin_serves_the_recordings(tmp_path, monkeypatch):
+    import importlib.util
+    import threading
+    from http.server import ThreadingHTTPServer
+
+    import requests
+
+    import tourney_keeper
+    from disk_cache import Disk_cache
+
+    script = os.path.join(os.path.dirname(__file__), "..", "..", "scripts", "standin_server.py")
+    spec = importlib.util.spec_from_file_location("standin_server", script)
+    standin = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(standin)
+
+    standin.Standin_handler.recordings = standin.Recordings(standin.new_recruit_fixtures, standin.tourney_keeper_fixtures)
+    server = ThreadingHTTPServer(("localhost", 0), standin.Standin_handler)
+    server.quiet = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_address[1]}"
+    try:
+        # TourneyKeeper, through the same client functions a conversion uses
+        monkeypatch.setattr(tourney_keeper, "tourney_keeper_url", url)
+        monkeypatch.setattr(
+            tourney_keeper,
+            "tk_snapshots",
+            Disk_cache(name="test", directory=str(tmp_path), ttl_seconds=60, max_entries=10),
+        )
+        tournament = standin.Standin_handler.recordings.tk_tournaments[0]
+        tk_info = tourney_keeper.load_tk_event(tournament, force_refresh=True)
+        assert tk_info.event_id == 99001
+        assert tk_info.player_count == 4
+        assert len(tk_info.game_list) == 4
+        assert sorted(x["Player_name"] for x in tk_info.player_list.values()) == ["Alice", "Bob", "Dana", "Russell"]
+        assert tk_info.player_list[301]["Primary_Codex"] == "Vampire Covenant"
+        assert tourney_keeper.Get_Player_Army_Details(1) is None
+
+        # New Recruit, the library answers conditional requests and reports come from the fixtures
+        library = requests.get(f"{url}/api/rpc?m=get_library")
+        assert library.status_code == 200
+        assert requests.get(f"{url}/api/rpc?m=get_library", headers={"If-None-Match": library.headers["ETag"]}).status_code == 304
+        reports = requests.post(f"{url}/api/reports", json={"id_tournament": "673b793ea60739d33d39abaa"})
+        assert reports.status_code == 200
+        assert reports.content == (standin.new_recruit_fixtures / "games_673b793ea60739d33d39abaa.json").read_bytes()
+        assert requests.post(f"{url}/api/reports", json={"id_tournament": "missing"}).status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_docx_formats_while_tk_loads(monkeypatch):
+    import time
+
+    import tourney_keeper
+    from data_classes import Tk_info
+    from tournament_index import Tournament_index
+
+    def slow(result):
+        def call(*args, **kwargs):
+            time.sleep(0.3)
+            return result
+
+        return call
+
+    event = {"Id": 1, "Name": "Brisy Battles", "Start": "2024-05-04T09:00:00"}
+    monkeypatch.setattr(tourney_keeper, "Get_tournament_by_name", lambda name: event)
+    monkeypatch.setattr(tourney_keeper, "load_tk_event", slow(Tk_info(event_id=1)))
+    monkeypatch.setattr(tourney_keeper, "Convert_lines_to_army_list", slow([]))
+    monkeypatch.setattr(tourney_keeper, "get_tournament_index", lambda: Tournament_index([event]))
+
+    start = time.perf_counter()
+    armies, tk_loaded, possible_names = tourney_keeper.armies_from_docx("Brisy Battle", [])
+    assert time.perf_counter() - start < 0.5
+    assert (armies, tk_loaded, possible_names) == ([], False, [("Brisy Battles", 96)])
+
+
+def test_match_first_reports_names_before_formatting(monkeypatch):
+    import tourney_keeper
+    from data_classes import Tk_info
+    from multi_error import Multi_Error
+
+    def no_formatting(**kwargs):
+        raise AssertionError("lists should not be formatted")
+
+    event = {"Id": 1, "Name": "Brisy Battles", "Start": "2024-05-04T09:00:00"}
+    tk_info = Tk_info(
+        event_id=1,
+        game_list=[{"Player1Id": 11, "Player2Id": 12}],
+        player_list={
+            101: {"TournamentPlayerId": 11, "Player_name": "Russell Smith", "Active": True},
+            102: {"TournamentPlayerId": 12, "Player_name": "Bob Jones", "Active": True},
+        },
+    )
+    monkeypatch.setattr(tourney_keeper, "Get_tournament_by_name", lambda name: event)
+    monkeypatch.setattr(tourney_keeper, "load_tk_event", lambda info, force_refresh: tk_info)
+    monkeypatch.setattr(tourney_keeper, "Convert_lines_to_army_list", no_formatting)
+
+    lines = [
+        "Smith Russell",
+        "Vampire Covenant",
+        "515 - Vampire Courtier, General",
+        "Total Army Cost: 4499 pts",
+        "Rob Jones",
+        "Ogre Khans",
+        "500 - Great Khan, General",
+        "4500",
+    ]
+    with pytest.raises(Multi_Error) as e:
+        tourney_keeper.armies_from_docx("Brisy Battles", iter(lines), match_first=True)
+    assert "No perfect matches for 'Rob Jones'" in str(e.value.errors[0])
+
+    monkeypatch.setattr(tourney_keeper, "get_tournament_index", lambda: tourney_keeper.Tournament_index([event]))
+    # the event is on TK but nothing has been entered for it yet
+    monkeypatch.setattr(tourney_keeper, "load_tk_event", lambda info, force_refresh: Tk_info(event_id=1))
+    assert tourney_keeper.armies_from_docx("Brisy Battles", lines, match_first=True) == ([], False, [("Brisy Battles", 100)])
+
+    monkeypatch.setattr(tourney_keeper, "Get_tournament_by_name", lambda name: None)
+    assert tourney_keeper.armies_from_docx("Brisy Battle", lines, match_first=True) == ([], False, [("Brisy Battles", 96)])
+
+
+def test_slow_request_is_hedged():
+    import concurrent.futures
+    import time
+    from unittest.mock import MagicMock
+
+    from resilience import Latency_tracker, send_hedged
+
+    tracker = Latency_tracker("test", min_samples=3)
+    for _ in range(3):
+        tracker.record(0.01)
+    delays = iter([1.0, 0.0])
+
+    def send(timeout):
+        time.sleep(next(delays))
+        return MagicMock(status_code=200)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        start = time.perf_counter()
+        assert send_hedged(send, tracker, timeout=5, executor=executor, hedge_after=2, max_hedge_fraction=1).status_code == 200
+        assert time.perf_counter() - start < 0.5
+    assert tracker.stats()["hedges"] == 1 and tracker.stats()["hedge_wins"] == 1
+
+
+def test_hedges_are_limited():
+    import concurrent.futures
+    import time
+    from unittest.mock import MagicMock
+
+    from resilience import Circuit_breaker, Latency_tracker, send_hedged
+
+    tracker = Latency_tracker("test", min_samples=3)
+    for _ in range(3):
+        tracker.record(0.05)
+
+    def slow(timeout):
+        time.sleep(0.2)
+        return MagicMock(status_code=200)
+
+    def quick(timeout):
+        return MagicMock(status_code=200)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # the first request of a cold instance is over the 5% budget
+        send_hedged(slow, tracker, timeout=5, executor=executor, hedge_after=2)
+        assert tracker.hedges == 0
+
+        # nothing is doubled up on an upstream that is failing
+        breaker = Circuit_breaker("test", failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        send_hedged(slow, tracker, timeout=5, executor=executor, hedge_after=2, max_hedge_fraction=1, breaker=breaker)
+        assert tracker.hedges == 0
+
+        # waiting for a free worker isn't the upstream being slow
+        busy = [executor.submit(time.sleep, 0.3) for _ in range(2)]
+        send_hedged(quick, tracker, timeout=5, executor=executor, hedge_after=2, max_hedge_fraction=1)
+        assert tracker.hedges == 0
+        concurrent.futures.wait(busy)
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    import threading
+    import time
+
+    from single_flight import Single_flight
+
+    flight = Single_flight("test")
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return {"key": key}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("a", fetch, "a"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["a"]
+    assert all(x is results[0] for x in results)
+    assert flight.stats() == {"executions": 1, "coalesced": 4}
+
+    with pytest.raises(ZeroDivisionError):
+        flight.do("b", lambda: 1 / 0)
+    assert flight.do("b", lambda: 2) == 2  # failures are not remembered
+
+
+def test_setup_lookup_seasons_override_base():
+    from new_recruit_tournaments import compile_setup_lookup, nr_library_entry
+
+    def category(*items):
+        return {"id": "c", "name": "c", "items": [{"id": Id, "ord": 0, "name": name} for Id, name in items]}
+
+    library = nr_library_entry.parse_obj(
+        {
+            "id": 1,
+            "name": "9th Age",
+            "settings": {
+                "setup_categories": {
+                    "map": category((1, "A map"), (2, "B map")),
+                    "deployment": category((1, "Frontline"), (2, "Encircle")),
+                    "objective": category((1, "Hold")),
+                },
+                "seasons": [{"id": 2024, "name": "2024", "game_setup": {"map": category((2, "C map"))}}],
+            },
+        }
+    )
+    lookup = compile_setup_lookup(library)
+
+    assert lookup.name_of("map", 1) == "A"
+    assert lookup.name_of("map", 2) == "C"
+    assert lookup.name_of("deployment", 2) == "Encircle"
+    with pytest.raises(IndexError):
+        lookup.name_of("objective", 9)
+
+
+def test_msgspec_decoding_matches_pydantic(monkeypatch):
+    import json
+
+    import nr_decoding
+    from new_recruit_tournaments import decode_NR_event, single_event
+
+    if not nr_decoding.available():
+        pytest.skip("msgspec is not installed")
+
+    game = {
+        "_id": "g1", "submitter_id": "s", "type": 1, "date": "2024-01-01T00:00:00.000Z", "id_tourny": "t",
+        "id_game_system": 6, "setup": {"map": [3], "deployment": 2},
+        "players": [{"id_participant": "p1", "alias": "Ann", "elo": {"tourny": 3}}, {"id_participant": "p2"}],
+        "score": [{"VP": 1500, "BP": 12, "extra": True}, {"pts": 8}],
+    }
+    stored = {"name": "GT", "games": [game], "rounds": 1, "type": 0, "teams": [{"name": "A", "players": []}]}
+    raw = json.dumps(stored).encode("utf-8")
+
+    monkeypatch.setenv("NR_DECODER", "msgspec")
+    assert decode_NR_event(raw).dict() == single_event(**stored).dict()
+
+    # pydantic coerces "8" to an int, the structs don't, so that event is left to pydantic
+    game["players"][0]["id_book"] = "8"
+    raw = json.dumps(stored).encode("utf-8")
+    assert nr_decoding.decode_event(raw) is None
+    assert decode_NR_event(raw).games[0].players[0].id_book == 8
+
+
+def test_standings_ties_and_tie_breakers():
+    from data_classes import ArmyEntry, Data_sources, Round
+    from standings import Team_result, rank, rank_individuals, rank_teams
+
+    assert [(p, x) for p, x in rank(["a", "b", "c", "d"], {"a": 5, "b": 9, "c": 5, "d": 1}.get)] == [
+        (1, "b"), (2, "a"), (2, "c"), (4, "d"),
+    ]
+
+    a, b, c = (ArmyEntry(player_name=x, calculated_total_tournament_points=20) for x in "abc")
+    a.round_performance = [Round(opponent=b.army_uuid, result=5)]
+    b.round_performance = [Round(opponent=a.army_uuid, result=15)]
+    c.round_performance = [Round(result=20)]
+    for army, secondary in zip((a, b, c), (900, 0, 900)):
+        army.calculated_total_tournament_secondary_points = secondary
+
+    # on New Recruit a 0 is a real score
+    from new_recruit_tournaments import calculate_individual_placing
+
+    nr_armies = [
+        ArmyEntry(player_name=name, data_source=Data_sources.NEW_RECRUIT, calculated_total_tournament_points=20,
+                  calculated_total_tournament_secondary_points=secondary)
+        for name, secondary in (("x", 0), ("y", 1200), ("z", 800))
+    ]
+    ranked = calculate_individual_placing({x.player_name: x for x in nr_armies})
+    assert [(x.player_name, x.list_placing) for x in ranked] == [("y", 1), ("z", 2), ("x", 3)]
+    assert [(x.player_name, x.list_placing) for x in rank_individuals([a, b, c])] == [("a", 1), ("c", 1), ("b", 3)]
+
+    # TK reports 0 for unrecorded secondaries, so b having none means nobody can be split on them
+    for army in (a, b, c):
+        army.data_source = Data_sources.TOURNEY_KEEPER
+    assert [(x.player_name, x.list_placing) for x in rank_individuals([a, b, c])] == [("a", 1), ("b", 1), ("c", 1)]
+    ranked = rank_individuals([a, b, c], tie_breakers=["head_to_head"])
+    assert [(x.player_name, x.list_placing) for x in ranked] == [("b", 1), ("a", 2), ("c", 3)]
+
+    def member(*results):
+        return ArmyEntry(round_performance=[Round(result=x, secondary_points=1) for x in results])
+
+    capped = Team_result(name="capped", members=[member(20, 20), member(20, 0)], soft_points=3)
+    other = Team_result(name="other", members=[member(10, 10), member(10, 10)])
+    assert [(x.name, x.placing, x.round_points, x.tournament_points) for x in rank_teams([capped, other], 2, 25, 35)] == [
+        ("capped", 1, [35, 25], 63),
+        ("other", 2, [25, 25], 50),
+    ]
+    assert capped.members[1].team_placing == 1 and other.members[0].team_total_secondary_points == 4
+    # a cap of 0 is no cap
+    assert rank_teams([other], 1, 0, 0)[0].round_points == [20]
@@ -0,0 +1,197 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Optional
+
+from disk_cache import Disk_cache
+from single_flight import get_single_flight
+
+CATALOGUE_KEY = "tourney_keeper_tournaments"
+
+
+class Tk_catalogue:
+    """TourneyKeeper's 9th Age tournaments kept on disk (optionally GCS) and topped up in the background
+
+    A cold instance loads the last synced copy instead of downloading years of events, and once the copy is older
+    than `ttl_seconds` only the events starting since the last sync (less `overlap` for events that were entered late)
+    are fetched and merged in. Every `full_sync_seconds` the whole history is fetched again instead and replaces the
+    copy, which picks up events entered long after they started, moved to an earlier date or deleted.
+
+    Lookups never wait on a background refresh, they get the copy there is. A refresh that is running or has just
+    failed is not started again, so until the first sync lands lookups don't each ask TK for years of events.
+
+    The tournament list is replaced, never mutated, on a refresh so anything built from it can tell it is stale by
+    identity.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[datetime, datetime], Optional[List[dict]]],
+        store: Disk_cache,
+        ttl_seconds: float,
+        history: timedelta,
+        overlap: timedelta,
+        retry_seconds: float = 60,
+        full_sync_seconds: float = 24 * 60 * 60,
+    ) -> None:
+        """
+        Args:
+            fetch (Callable[[datetime, datetime], Optional[List[dict]]]): tournaments starting between the two
+                dates, None if TK could not be reached
+            store (Disk_cache): where the catalogue is persisted between instances
+            retry_seconds (float): how long after a refresh was started before another may be, unless it succeeded
+            full_sync_seconds (float): how often a refresh fetches the whole history rather than the recent events
+        """
+        self.fetch = fetch
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.history = history
+        self.overlap = overlap
+        self.retry_seconds = retry_seconds
+        self.full_sync_seconds = full_sync_seconds
+
+        self._tournaments: List[dict] = []
+        self._synced_to: Optional[datetime] = None
+        self._synced_at: Optional[float] = None
+        self._fully_synced_at: Optional[float] = None
+        self._attempted_at: Optional[float] = None
+        self._refreshing = False
+        self._loaded = False
+        self._source = "none"
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+
+    def tournaments(self) -> List[dict]:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+        if self._due(self.ttl_seconds):
+            self.refresh_in_background()
+        return self._tournaments
+
+    def age_seconds(self) -> Optional[float]:
+        if self._synced_at is None:
+            return None
+        return max(time.time() - self._synced_at, 0.0)
+
+    def _due(self, max_age: float) -> bool:
+        """Whether the copy is older than `max_age` and TK isn't already being, or has just been, asked"""
+        age = self.age_seconds()
+        if age is not None and age <= max_age:
+            return False
+        return self._attempted_at is None or time.time() - self._attempted_at > self.retry_seconds
+
+    def staleness(self) -> dict:
+        age = self.age_seconds()
+        return {
+            "synced_at": None if self._synced_at is None else datetime.fromtimestamp(self._synced_at, timezone.utc).isoformat(),
+            "age_seconds": None if age is None else round(age),
+            "stale": age is None or age > self.ttl_seconds,
+            "fully_synced_at": None
+            if self._fully_synced_at is None
+            else datetime.fromtimestamp(self._fully_synced_at, timezone.utc).isoformat(),
+            "source": self._source,
+            "tournaments": len(self._tournaments),
+            "last_error": self._last_error,
+        }
+
+    def refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refresh_thread and self._refresh_thread.is_alive():
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, name="tk-catalogue-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def refresh_if_older_than(self, seconds: float) -> None:
+        """Synchronous top up, for when a lookup has missed and the event may have been entered since the last sync"""
+        # a refresh that is already running may do the job, so wait for it rather than skipping
+        if self._refreshing or self._due(seconds):
+            self.refresh()
+
+    def refresh(self) -> bool:
+        # a caller arriving while a refresh is running gets its result instead of running another one after it
+        return get_single_flight("tk_catalogue").do(id(self), self._refresh_locked)
+
+    def _refresh_locked(self) -> bool:
+        with self._refresh_lock:
+            self._refreshing = True
+            try:
+                return self._refresh()
+            finally:
+                self._refreshing = False
+
+    def _refresh(self) -> bool:
+        self._attempted_at = time.time()
+        now = datetime.now(timezone.utc)
+        oldest = now - self.history
+        full = (
+            self._synced_to is None
+            or self._fully_synced_at is None
+            or time.time() - self._fully_synced_at > self.full_sync_seconds
+        )
+        start = oldest if full else max(self._synced_to - self.overlap, oldest)
+
+        fetched = self.fetch(start, now)
+        if fetched is None:
+            self._last_error = f"TourneyKeeper could not be reached at {now.isoformat(timespec='seconds')}"
+            print(f"TK catalogue refresh failed, keeping {len(self._tournaments)} tournaments from {self._synced_to}")
+            return False
+
+        if full:
+            # whatever TK no longer has in the window has been deleted or moved out of it
+            tournaments = [x for x in fetched if not _starts_before(x, oldest)]
+            self._fully_synced_at = time.time()
+        else:
+            tournaments = self._merge(fetched, oldest)
+        self._set(tournaments, synced_to=now, synced_at=time.time(), source="tourney_keeper")
+        self.store.set(
+            CATALOGUE_KEY,
+            {
+                "synced_to": now.isoformat(),
+                "synced_at": self._synced_at,
+                "fully_synced_at": self._fully_synced_at,
+                "tournaments": self._tournaments,
+            },
+        )
+        return True
+
+    def _merge(self, fetched: List[dict], oldest: datetime) -> List[dict]:
+        """Replace events that were fetched again in place, add new ones at the end and drop what has aged out"""
+        fetched_by_id = {x.get("Id"): x for x in fetched}
+        merged = [fetched_by_id.pop(x.get("Id"), x) for x in self._tournaments]
+        merged.extend(x for x in fetched if x.get("Id") in fetched_by_id)
+        return [x for x in merged if not _starts_before(x, oldest)]
+
+    def _load(self) -> None:
+        stored = self.store.get(CATALOGUE_KEY)
+        if stored:
+            self._set(
+                stored["tournaments"],
+                synced_to=datetime.fromisoformat(stored["synced_to"]),
+                synced_at=stored["synced_at"],
+                source="cache",
+            )
+            # copies stored before full syncs were tracked get one on their next refresh
+            self._fully_synced_at = stored.get("fully_synced_at")
+        else:
+            # nothing to serve until the first download finishes
+            self.refresh()
+
+    def _set(self, tournaments: List[dict], synced_to: datetime, synced_at: float, source: str) -> None:
+        self._tournaments = tournaments
+        self._synced_to = synced_to
+        self._synced_at = synced_at
+        self._source = source
+        self._last_error = None
+
+
+def _starts_before(tournament: dict, when: datetime) -> bool:
+    try:
+        start = datetime.strptime(tournament.get("Start", ""), "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return False
+    return start < when
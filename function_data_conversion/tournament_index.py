@@ -0,0 +1,64 @@
+from typing import Dict, List, Optional, Set, Tuple
+from unicodedata import category
+
+from unidecode import unidecode
+
+from name_matching import normalise_name, normalised_ratio_matrix
+
+
+def strip_punctuation(name: str) -> str:
+    return unidecode("".join(ch for ch in name if not category(ch).startswith("P")))
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class Tournament_index:
+    """TK tournaments with their names normalised once, rebuilt whenever the tournament list is refreshed
+
+    exact_key      what Get_tournament_by_name treats as the same event, punctuation and accents dropped then token
+                   sorted, so a lookup is a dict hit rather than a fuzzy score against every event
+    sorted_names   names as fuzz.token_sort_ratio sees them, for scoring near matches in one batch
+    trigram index  raw name trigrams, an event can only contain a name as a substring if it has all of its trigrams
+    """
+
+    def __init__(self, tournaments: List[dict]) -> None:
+        self.tournaments = tournaments
+        self.names: List[str] = [x.get("Name", "") for x in tournaments]
+        self.sorted_names: List[Optional[str]] = [normalise_name(x) for x in self.names]
+
+        self._by_exact_key: Dict[str, int] = {}
+        self._by_trigram: Dict[str, Set[int]] = {}
+        for position, name in enumerate(self.names):
+            # first listed wins, same as the scan this replaces
+            self._by_exact_key.setdefault(self.exact_key(name), position)
+            for trigram in trigrams(name):
+                self._by_trigram.setdefault(trigram, set()).add(position)
+
+    @staticmethod
+    def exact_key(name: str) -> str:
+        return normalise_name(strip_punctuation(name)) or ""
+
+    def find_exact(self, name: str) -> Optional[dict]:
+        position = self._by_exact_key.get(self.exact_key(name))
+        return None if position is None else self.tournaments[position]
+
+    def containing(self, name: str) -> List[dict]:
+        """Tournaments whose name contains `name` exactly, in list order"""
+        if len(name) < 3:
+            positions = range(len(self.names))
+        else:
+            candidates: Optional[Set[int]] = None
+            for trigram in sorted(trigrams(name), key=lambda x: len(self._by_trigram.get(x, ()))):
+                postings = self._by_trigram.get(trigram, set())
+                candidates = postings if candidates is None else candidates & postings
+                if not candidates:
+                    return []
+            positions = sorted(candidates or ())
+        return [self.tournaments[x] for x in positions if name in self.names[x]]
+
+    def similar(self, name: str, min_ratio: int) -> List[Tuple[str, int]]:
+        """(name, token sort ratio) of every tournament scoring above `min_ratio`, in list order"""
+        ratios = normalised_ratio_matrix([normalise_name(name)], self.sorted_names)[0]
+        return [(self.names[x], ratio) for x, ratio in enumerate(ratios) if ratio > min_ratio]
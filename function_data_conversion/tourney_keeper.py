@@ -1,44 +1,87 @@
 import concurrent.futures
 import json
 import re
+from collections import Counter
 from datetime import datetime, timedelta, timezone
-from functools import cache
-from typing import Dict, List, Optional, Tuple, Union
-from unicodedata import category
-from urllib.parse import quote
+from os import environ
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import quote, urlparse
 from uuid import UUID, uuid4
 
 import requests
-from fuzzywuzzy import fuzz
-from unidecode import unidecode
 
-from converter import Convert_lines_to_army_list
+from converter import Convert_lines_to_army_list, read_block_headers
+from disk_cache import Disk_cache, cache_key
 from data_classes import (Army_names, ArmyEntry, Data_sources, Event_types,
                           Round, Tk_info)
+from multi_error import Multi_Error
+from name_matching import (normalise_name, normalised_ratio_matrix,
+                           token_sort_ratio_matrix, token_sort_ratios)
+from resilience import (get_circuit_breaker, get_latency_tracker, send_hedged,
+                        send_with_retry, submit_in_context)
+from single_flight import get_single_flight
+from standings import rank_individuals
+from tk_catalogue import Tk_catalogue
+from tournament_index import Tournament_index
+from upstream_pool import get_upstream_pool
+
+tourney_keeper_url = environ.get("TOURNEY_KEEPER_URL", "https://tourneykeeper.net")
+tourney_keeper_host = urlparse(tourney_keeper_url).netloc
+# need to blank the user agent as the default is automatically blocked
+tk_headers = {"Accept": "application/json", "User-Agent": "ninthage-data-analytics/1.1.0"}
+
+
+def tk_request(endpoint: str, method: str, url: str, timeout: float, hedge: bool = True, **kwargs) -> Optional[requests.Response]:
+    """Send a TK WebAPI request through the shared TK session with bounded retries, hedging slow calls after the endpoint's p95
+
+    Returns None rather than raising if TK could not be reached, like the helpers always have
+    """
+    pool = get_upstream_pool(tourney_keeper_host)
+    tracker = get_latency_tracker(f"tourney_keeper {endpoint}")
+
+    def send(attempt_timeout: float) -> requests.Response:
+        return pool.session.request(method, url, headers=tk_headers, timeout=attempt_timeout, **kwargs)
+
+    def send_attempt(attempt_timeout: float) -> requests.Response:
+        if not hedge:
+            return send(attempt_timeout)
+        return send_hedged(
+            send,
+            tracker,
+            attempt_timeout,
+            executor=pool.executor,
+            hedge_after=float(environ.get("TK_HEDGE_AFTER_SECONDS", 2)),
+            max_hedge_fraction=float(environ.get("TK_HEDGE_MAX_FRACTION", 0.05)),
+            breaker=get_circuit_breaker(tourney_keeper_host),
+        )
+
+    try:
+        return send_with_retry(
+            send_attempt,
+            breaker=get_circuit_breaker(tourney_keeper_host),
+            timeout=timeout,
+            attempts=int(environ.get("TK_ATTEMPTS", 3)),
+        )
+    except (requests.exceptions.RequestException, ValueError) as err:
+        print(f"TK {endpoint} failed: {err}")
+        return None
 
-http = requests.Session()
 
-@cache
-def get_recent_tournaments() -> List[dict]:
+def Get_tournaments_between(start: datetime, end: datetime) -> Optional[List[dict]]:
+    """9th Age tournaments starting between the dates, None if TK could not be reached"""
     output = []
 
-    now = datetime.now(timezone.utc)
-    year_ago = now - timedelta(days=3 * 365)
-
-    now_str = quote(now.isoformat(timespec="seconds") + "Z", safe="")
-    year_ago_str = quote(year_ago.isoformat(timespec="seconds") + "Z", safe="")
+    start_str = quote(start.isoformat(timespec="seconds") + "Z", safe="")
+    end_str = quote(end.isoformat(timespec="seconds") + "Z", safe="")
 
-    url = f"https://tourneykeeper.net/WebAPI/Tournament/GetTournaments?from={year_ago_str}&to={now_str}"
+    url = f"{tourney_keeper_url}/WebAPI/Tournament/GetTournaments?from={start_str}&to={end_str}"
 
-    try:
-        # need to blank the user agent as the default is automatically blocked
-        response = http.get(
-            url, headers={"Accept": "application/json", "User-Agent": "ninthage-data-analytics/1.1.0"}, timeout=2
-        )
-    except requests.exceptions.ReadTimeout as err:
-        return []
-    if response.status_code != 200:
-        return []
+    # years of events is a big download, a duplicate would only slow it down further
+    response = tk_request(
+        "GetTournaments", "GET", url, timeout=float(environ.get("TK_CATALOGUE_TIMEOUT_SECONDS", 20)), hedge=False
+    )
+    if response is None or response.status_code != 200:
+        return None
     message = response.json()["Message"]
     success = response.json()["Success"]
     if success:
@@ -49,25 +92,38 @@ def get_recent_tournaments() -> List[dict]:
             if tournament.get("GameSystem") == "The 9th Age":
                 output.append(tournament)
         return output
-    return []
+    return None
 
 
-def Get_active_players(tourney_id: int) -> Union[int, None]:
-    url = f"https://tourneykeeper.net/WebAPI/Tournament/GetActivePlayers"
-    # need to blank the user agent as the default is automatically blocked
-    headers = {
-        "Accept": "application/json",
-        "User-Agent": "ninthage-data-analytics/1.1.0",
-        "Content-Type": "application/json",
-    }
+tk_catalogue = Tk_catalogue(
+    fetch=Get_tournaments_between,
+    store=Disk_cache(
+        name="tk_catalogue",
+        directory=environ.get("TK_CATALOGUE_DIR", "/tmp/tk-catalogue"),
+        ttl_seconds=float(environ.get("TK_CATALOGUE_MAX_AGE_SECONDS", 30 * 24 * 60 * 60)),
+        max_entries=10,
+        bucket_name=environ.get("TK_CATALOGUE_BUCKET"),
+    ),
+    ttl_seconds=float(environ.get("TK_CATALOGUE_TTL_SECONDS", 10 * 60)),
+    history=timedelta(days=3 * 365),
+    overlap=timedelta(days=int(environ.get("TK_CATALOGUE_OVERLAP_DAYS", 7))),
+    retry_seconds=float(environ.get("TK_CATALOGUE_RETRY_SECONDS", 60)),
+    full_sync_seconds=float(environ.get("TK_CATALOGUE_FULL_SYNC_SECONDS", 24 * 60 * 60)),
+)
 
-    try:
-        response = http.post(
-            url, json={"Id": tourney_id}, headers=headers, timeout=2
-        )
-    except requests.exceptions.ReadTimeout as err:
-        return None
-    if response.status_code != 200:
+
+def get_recent_tournaments() -> List[dict]:
+    return tk_catalogue.tournaments()
+
+
+def tk_timeout() -> float:
+    return float(environ.get("TK_TIMEOUT_SECONDS", 10))
+
+
+def Get_active_players(tourney_id: int) -> Union[int, None]:
+    url = f"{tourney_keeper_url}/WebAPI/Tournament/GetActivePlayers"
+    response = tk_request("GetActivePlayers", "POST", url, timeout=tk_timeout(), json={"Id": tourney_id})
+    if response is None or response.status_code != 200:
         return None
     message = response.json()["Message"]
     success = response.json()["Success"]
@@ -78,16 +134,9 @@ def Get_active_players(tourney_id: int) -> Union[int, None]:
 
 
 def Get_games_for_tournament(tourney_id: int) -> Union[list, None]:
-    url = f"https://tourneykeeper.net/WebAPI/Game/GetGamesForTournament?tournamentId={tourney_id}"
-    try:
-        # need to blank the user agent as the default is automatically blocked
-        response = http.get(
-            url, headers={"Accept": "application/json", "User-Agent": "ninthage-data-analytics/1.1.0"}, timeout=2
-        )
-    except requests.exceptions.ReadTimeout as err:
-        print("This is timing out")
-        return None
-    if response.status_code != 200:
+    url = f"{tourney_keeper_url}/WebAPI/Game/GetGamesForTournament?tournamentId={tourney_id}"
+    response = tk_request("GetGamesForTournament", "GET", url, timeout=tk_timeout())
+    if response is None or response.status_code != 200:
         return None
     message = response.json()["Message"]
     success = response.json()["Success"]
@@ -119,22 +168,32 @@ def result_validation(game: dict) -> bool:
         return False
     return True
 
-def Get_tournament_by_name(tournament_name: str) -> Union[Dict, None]:
+_tournament_index: Optional[Tournament_index] = None
+
+
+def get_tournament_index() -> Tournament_index:
+    """Index of get_recent_tournaments, only rebuilt when that list is refreshed"""
+    global _tournament_index
     recent_tournaments = get_recent_tournaments()
-    name_no_punc:str = unidecode(''.join(ch for ch in tournament_name if not category(ch).startswith('P')))
-    close_matches = []
-    for tournament in recent_tournaments:
-        # Clear punctuation
-        tk_name_no_punc:str = unidecode(''.join(ch for ch in tournament.get("Name", "") if not category(ch).startswith('P')))
-
-        # cant be to lax here otherwise "brisy battle 1" will match to "brisy battles 3"
-        ratio = fuzz.token_sort_ratio(name_no_punc, tk_name_no_punc)
-        if ratio == 100:
-            # we have found the tournament
-            return tournament
-        elif tournament_name in tournament.get("Name"):
-            close_matches.append({'Name':tournament.get('Name'), 'Id':tournament.get('Id')})
-                
+    if _tournament_index is None or _tournament_index.tournaments is not recent_tournaments:
+        _tournament_index = Tournament_index(recent_tournaments)
+    return _tournament_index
+
+
+def Get_tournament_by_name(tournament_name: str) -> Union[Dict, None]:
+    tournament_index = get_tournament_index()
+    # cant be to lax here otherwise "brisy battle 1" will match to "brisy battles 3"
+    tournament = tournament_index.find_exact(tournament_name)
+    if not tournament:
+        # the event may have been entered on TK since the catalogue was last topped up
+        tk_catalogue.refresh_if_older_than(float(environ.get("TK_CATALOGUE_MISS_REFRESH_SECONDS", 60)))
+        tournament_index = get_tournament_index()
+        tournament = tournament_index.find_exact(tournament_name)
+    if tournament:
+        # we have found the tournament
+        return tournament
+
+    close_matches = [{'Name':x.get('Name'), 'Id':x.get('Id')} for x in tournament_index.containing(tournament_name)]
     if close_matches:
         raise ValueError(
                 f"Found very similar TK event/s named: '{close_matches}'"
@@ -143,15 +202,9 @@ def Get_tournament_by_name(tournament_name: str) -> Union[Dict, None]:
 
 
 def Get_Player_Army_Details(tournamentPlayerId: int) -> Union[Dict, None]:
-    url = f"https://tourneykeeper.net/WebAPI/TournamentPlayer/GetPlayerArmyDetails?tournamentPlayerId={tournamentPlayerId}"
-    try:
-        # need to blank the user agent as the default is automatically blocked
-        response = http.get(
-            url, headers={"Accept": "application/json", "User-Agent": "ninthage-data-analytics/1.1.0"}, timeout=5
-        )
-    except requests.exceptions.ReadTimeout as err:
-        return None
-    if response.status_code != 200:
+    url = f"{tourney_keeper_url}/WebAPI/TournamentPlayer/GetPlayerArmyDetails?tournamentPlayerId={tournamentPlayerId}"
+    response = tk_request("GetPlayerArmyDetails", "GET", url, timeout=tk_timeout())
+    if response is None or response.status_code != 200:
         return None
     success = response.json()["Success"]
     if success:
@@ -162,11 +215,15 @@ def Get_Player_Army_Details(tournamentPlayerId: int) -> Union[Dict, None]:
     return None
 
 
-def Get_players_names_from_games(games: dict) -> dict:
+dummy_players_regex = re.compile(r"(player\d+|[Ss]tandin\dg* *|[Bb]ye ?\d+)")
+
+
+def Get_players_names_from_games(games: dict, player_details: Optional[Dict[int, dict]] = None) -> dict:
     """receives a list of Tourney keeper games it then returns a mapping of player name to tourneykeeper id
 
     Args:
         games (dict): list of tourney keeper games
+        player_details (Dict[int, dict], optional): GetPlayerArmyDetails by TournamentPlayerId, fetched if not given
 
     Returns:
         Key = tk_player_id
@@ -178,77 +235,227 @@ def Get_players_names_from_games(games: dict) -> dict:
         unique_player_tkIds.add(game.get("Player1Id"))
         unique_player_tkIds.add(game.get("Player2Id"))
 
+    if player_details is None:
+        player_details = Get_player_details(unique_player_tkIds)
+
+    primary_codex_by_id = primary_codices(games)
+
     # iterate over unique player ids and map them to player names
     output = {}
+    for Id in unique_player_tkIds:
+        details = player_details[Id]
+        tournament_player_id = details.get("TournamentPlayerId")
+        player_name:str = details.get("PlayerName")
+        tk_player_id = details.get("PlayerId")
+        team_name = details.get("TeamName")
+        team_id = details.get("TeamId")
+        active = details.get("Active")
 
+        primary_codex = primary_codex_by_id.get(tournament_player_id)
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = []
-        for Id in unique_player_tkIds:
-            futures.append(
-                executor.submit(
-                    Get_Player_Army_Details, Id
-                )
-            )
+        if dummy_players_regex.fullmatch(player_name):
+            # Skip dummy players
+            print(f"Dummy player {player_name} skipped")
+            continue
+
+        output[tk_player_id] = {"TournamentPlayerId": tournament_player_id, "Player_name": player_name, "Primary_Codex": primary_codex, "TeamName": team_name, "TeamId": team_id, "Active": active}
+
+    return output
+
+
+def primary_codices(games: list) -> Dict[int, Optional[str]]:
+    """TournamentPlayerId to the codex from the first game they were player 1 in, or player 2 if that had none"""
+    as_player1: Dict[int, Optional[str]] = {}
+    as_player2: Dict[int, Optional[str]] = {}
+    for game in games:
+        as_player1.setdefault(game.get("Player1Id"), game.get("Player1PrimaryCodex"))
+        as_player2.setdefault(game.get("Player2Id"), game.get("Player2PrimaryCodex"))
+
+    output = dict(as_player2)
+    output.update((Id, codex) for Id, codex in as_player1.items() if codex is not None)
+    return output
+
+
+def Get_player_details(player_ids: Iterable[int], known: Optional[Dict[int, dict]] = None) -> Dict[int, dict]:
+    """GetPlayerArmyDetails for every player, only asking TK about the ones not already in `known`
+
+    Raises:
+        ValueError: TK had nothing for one of the players
+    """
+    output = {}
+    to_fetch = []
+    for Id in player_ids:
+        if known and Id in known:
+            output[Id] = known[Id]
+        else:
+            to_fetch.append(Id)
+
+    # as many lookups at once as the TK session has connections, the requests themselves go out on the TK pool
+    with concurrent.futures.ThreadPoolExecutor(max_workers=get_upstream_pool(tourney_keeper_host).max_concurrency) as executor:
+        futures = {submit_in_context(executor, Get_Player_Army_Details, Id): Id for Id in to_fetch}
         for future in concurrent.futures.as_completed(futures):
             details = future.result()
             if details:
-                tournament_player_id = details.get("TournamentPlayerId")
-                player_name:str = details.get("PlayerName")
-                tk_player_id = details.get("PlayerId")
-                team_name = details.get("TeamName")
-                team_id = details.get("TeamId")
-                active = details.get("Active")
-
-                primary_codex = next((x.get("Player1PrimaryCodex") for x in games if x.get("Player1Id") == tournament_player_id), None)
-                if primary_codex is None:
-                    primary_codex = next((x.get("Player2PrimaryCodex") for x in games if x.get("Player2Id") == tournament_player_id), None)
-
-                dummy_players = r"(player\d+|[Ss]tandin\dg* *|[Bb]ye ?\d+)"
-                if re.fullmatch(dummy_players, player_name):
-                    # Skip dummy players
-                    print(f"Dummy player {player_name} skipped")
-                    continue
-
-                output[tk_player_id] = {"TournamentPlayerId": tournament_player_id, "Player_name": player_name, "Primary_Codex": primary_codex, "TeamName": team_name, "TeamId": team_id, "Active": active}
+                output[futures[future]] = details
             else:
-                raise ValueError(f"Tourney Keeper yielded no data for playerID:{Id}")
+                raise ValueError(f"Tourney Keeper yielded no data for playerID:{futures[future]}")
 
     return output
 
 
+def index_armies_by_tk_id(list_of_armies: List[ArmyEntry]) -> Dict[int, ArmyEntry]:
+    """TournamentPlayerId to army, if two armies share an id the later one wins"""
+    return {
+        army.tourney_keeper_TournamentPlayerId: army
+        for army in list_of_armies
+        if army.tourney_keeper_TournamentPlayerId is not None
+    }
+
+
 def Convert2_TKid_to_uuid(
-    TKID_1: int, TKID_2: int, list_of_armies: List[ArmyEntry]
+    TKID_1: int, TKID_2: int, list_of_armies: List[ArmyEntry], armies_by_tk_id: Optional[Dict[int, ArmyEntry]] = None
 ) -> Tuple[UUID, UUID]:
-    army1_uuid = None
-    army2_uuid = None
+    if armies_by_tk_id is None:
+        armies_by_tk_id = index_armies_by_tk_id(list_of_armies)
 
-    for army in list_of_armies:
-        if TKID_1 == army.tourney_keeper_TournamentPlayerId:
-            army1_uuid = army.army_uuid
-        if TKID_2 == army.tourney_keeper_TournamentPlayerId:
-            army2_uuid = army.army_uuid
+    army1 = armies_by_tk_id.get(TKID_1)
+    army2 = armies_by_tk_id.get(TKID_2)
 
-    if not army1_uuid:
+    if not army1:
         player_data = Get_Player_Army_Details(TKID_1)
         raise ValueError(
             f"""
             TK player {player_data.get("PlayerName")}, TKID:{TKID_1}, could not be found in the word doc.
         """
         )
-    if not army2_uuid:
+    if not army2:
         player_data = Get_Player_Army_Details(TKID_2)
         raise ValueError(
             f"""
             TK player {player_data.get("PlayerName")}, TKID:{TKID_2}, could not be found in the word doc.
         """
         )
-    return (army1_uuid, army2_uuid)
+    return (army1.army_uuid, army2.army_uuid)
 
-@cache
-def load_tk_info(tournament_name: str) -> Tk_info:
+tk_snapshots = Disk_cache(
+    name="tk_snapshots",
+    directory=environ.get("TK_SNAPSHOT_DIR", "/tmp/tk-snapshots"),
+    ttl_seconds=float(environ.get("TK_SNAPSHOT_TTL_SECONDS", 7 * 24 * 60 * 60)),
+    max_entries=int(environ.get("TK_SNAPSHOT_MAX_ENTRIES", 200)),
+    bucket_name=environ.get("TK_SNAPSHOT_BUCKET"),
+)
+
+
+def is_running(event_date: datetime) -> bool:
+    """Results and players can still change on TK for a few days after an event starts"""
+    running_for = timedelta(days=float(environ.get("TK_SNAPSHOT_RUNNING_DAYS", 3)))
+    return datetime.now(timezone.utc) - event_date < running_for
+
+
+def load_tk_snapshot(event_id: int, event_date: datetime, force_refresh: bool = False) -> Tuple[list, Dict[int, dict], Optional[int]]:
+    """Games, player details and active player count for a TK event, from the snapshot store where possible
+
+    A snapshot of a finished event is used as is. For an event that is still running the games and player count are
+    fetched again, but player details are only fetched for players the snapshot doesn't have yet, so re-uploading the
+    same event doesn't fan out to every player again. A name fixed on TK since is picked up by
+    recheck_unmatched_players() when the lists don't match, and `force_refresh` fetches everything.
+
+    Concurrent loads of the same event share one set of TK calls.
+    """
+    return get_single_flight("tk_snapshot").do(
+        (event_id, force_refresh), _load_tk_snapshot, event_id, event_date, force_refresh
+    )
+
+
+def _load_tk_snapshot(event_id: int, event_date: datetime, force_refresh: bool) -> Tuple[list, Dict[int, dict], Optional[int]]:
+    key = cache_key("tourney_keeper", str(event_id))
+    snapshot = None if force_refresh else tk_snapshots.get(key)
+    known_details = {}
+    if snapshot:
+        known_details = {int(Id): details for Id, details in snapshot["player_details"]}
+        if not is_running(event_date):
+            return snapshot["games"], known_details, snapshot["player_count"]
+
+    games = Get_games_for_tournament(event_id)
+    if games is None and snapshot:
+        # TK couldn't be reached, the last good snapshot beats nothing and must not be overwritten
+        print(f"TK games for {event_id} could not be refreshed, using the stored snapshot")
+        return snapshot["games"], known_details, snapshot["player_count"]
+    player_ids = {x.get("Player1Id") for x in games or []} | {x.get("Player2Id") for x in games or []}
+    player_details = Get_player_details(player_ids, known_details)
+    player_count = Get_active_players(event_id)
+    if player_count is None and snapshot:
+        player_count = snapshot["player_count"]
+    if games is not None:
+        tk_snapshots.set(
+            key,
+            {
+                "games": games,
+                "player_details": [[Id, details] for Id, details in player_details.items()],
+                "player_count": player_count,
+            },
+        )
+    return games, player_details, player_count
+
+
+def refresh_player_details(event_id: int, player_ids: Iterable[int]) -> Optional[Dict[int, dict]]:
+    """Fetches these players' details again and stores them in the event's snapshot
+
+    Returns:
+        Dict[int, dict]: every player's details by TournamentPlayerId, None if the event has no snapshot
+    """
+    key = cache_key("tourney_keeper", str(event_id))
+    snapshot = tk_snapshots.get(key)
+    if not snapshot:
+        return None
+    details = {int(Id): x for Id, x in snapshot["player_details"]}
+    details.update(Get_player_details(player_ids))
+    snapshot["player_details"] = [[Id, x] for Id, x in details.items()]
+    tk_snapshots.set(key, snapshot)
+    return details
+
+
+def recheck_unmatched_players(
+    tk_info: Tk_info, tk_names: List[Optional[str]], file_names: List[str]
+) -> Tuple[Tk_info, List[Optional[str]]]:
+    """Picks up names fixed on TK since the snapshot was taken
+
+    When some lists don't match a TK name, the TK players no list matched have their details fetched again. That is
+    usually a handful of calls, and only on an upload that would otherwise fail.
+    """
+    if not (tk_info.event_id and tk_info.player_list):
+        return tk_info, tk_names
+    unmatched_file, unmatched_tk = unmatched_names(file_names, [x["Player_name"] for x in tk_info.player_list.values()])
+    if not (unmatched_file and unmatched_tk):
+        return tk_info, tk_names
+
+    unmatched_tk = set(unmatched_tk)
+    player_ids = [x["TournamentPlayerId"] for x in tk_info.player_list.values() if x["Player_name"] in unmatched_tk]
+    try:
+        details = refresh_player_details(tk_info.event_id, player_ids)
+    except ValueError as e:
+        print(f"TK player details could not be rechecked, keeping the stored names: {e}")
+        return tk_info, tk_names
+    if details is None:
+        return tk_info, tk_names
+    tk_info.player_list = Get_players_names_from_games(tk_info.game_list, details)
+    return tk_info, normalised_tk_names(tk_info)
+
+
+def load_tk_info(tournament_name: str, force_refresh: bool = False) -> Tk_info:
     # Pull in data from tourney keeper
-    tourney_keeper_info = Get_tournament_by_name(tournament_name)
+    return load_tk_event(Get_tournament_by_name(tournament_name), force_refresh)
+
+
+def tk_event_date(tourney_keeper_info: Optional[dict]) -> Optional[datetime]:
+    if not tourney_keeper_info:
+        return None
+    return datetime.strptime(
+        tourney_keeper_info.get("Start"), "%Y-%m-%dT%H:%M:%S"
+    ).replace(tzinfo=timezone.utc)
+
+
+def load_tk_event(tourney_keeper_info: Optional[dict], force_refresh: bool = False) -> Tk_info:
     if tourney_keeper_info:
         # set event type
         if tourney_keeper_info.get("IsTeamTournament"):
@@ -256,12 +463,11 @@ def load_tk_info(tournament_name: str) -> Tk_info:
         else:
             event_type = Event_types.SINGLES
 
-        event_date = datetime.strptime(
-            tourney_keeper_info.get("Start"), "%Y-%m-%dT%H:%M:%S"
-        ).replace(tzinfo=timezone.utc)
-        tournament_games = Get_games_for_tournament(tourney_keeper_info.get("Id"))
-        player_list = Get_players_names_from_games(tournament_games)
-        player_count = Get_active_players(tourney_keeper_info.get("Id"))
+        event_date = tk_event_date(tourney_keeper_info)
+        tournament_games, player_details, player_count = load_tk_snapshot(
+            tourney_keeper_info.get("Id"), event_date, force_refresh
+        )
+        player_list = Get_players_names_from_games(tournament_games, player_details)
         
         event_id = tourney_keeper_info.get("Id")
         players_per_team = tourney_keeper_info.get("PlayersPrTeam")
@@ -282,20 +488,29 @@ def append_tk_game_data(
     tk_info: Tk_info, list_of_armies: List[ArmyEntry]
 ) -> None:
     if tk_info.game_list and tk_info.player_list:
+        # index everything once per event rather than scanning every player and army for every game
+        players_by_tk_id: Dict[int, dict] = {}
+        for player in tk_info.player_list.values():
+            players_by_tk_id.setdefault(player.get("TournamentPlayerId"), player)
+        armies_by_tk_id = index_armies_by_tk_id(list_of_armies)
+        armies_by_uuid = {army.army_uuid: army for army in list_of_armies}
+        army_player_names = {army.player_name for army in list_of_armies}
+        armies_stamped = False
+
         # extract TK game results if available
         for game in tk_info.game_list:
-            player1 = next( (x for x in tk_info.player_list.values() if x.get("TournamentPlayerId") == game.get("Player1Id")), {})
-            player2 = next( (x for x in tk_info.player_list.values() if x.get("TournamentPlayerId") == game.get("Player2Id")), {})
+            player1 = players_by_tk_id.get(game.get("Player1Id"), {})
+            player2 = players_by_tk_id.get(game.get("Player2Id"), {})
 
             # Check that non active players have lists. If not skip this game data since only 1 player from the round will be recorded and so averages will be thrown off.
-            if not player1.get("Active") and not any(x.player_name == player1.get("Player_name") for x in list_of_armies):
+            if not player1.get("Active") and player1.get("Player_name") not in army_player_names:
                 continue
 
-            if not player2.get("Active") and not any(x.player_name == player2.get("Player_name") for x in list_of_armies):
+            if not player2.get("Active") and player2.get("Player_name") not in army_player_names:
                 continue
 
             (player1_uuid, player2_uuid) = Convert2_TKid_to_uuid(
-                game.get("Player1Id"), game.get("Player2Id"), list_of_armies
+                game.get("Player1Id"), game.get("Player2Id"), list_of_armies, armies_by_tk_id
             )
 
             round_number = int(game.get("Round"))
@@ -322,18 +537,22 @@ def append_tk_game_data(
                 game_uuid=game_uuid,
             )
 
-            for army in list_of_armies:
-                army.data_source = Data_sources.TOURNEY_KEEPER
-                army.event_date = tk_info.event_date
-                army.event_type = tk_info.event_type
-                if army.army_uuid == player1_uuid:
-                    if not army.round_performance:
-                        army.round_performance = []
-                    army.round_performance.append(player1_round)
-                elif army.army_uuid == player2_uuid:
-                    if not army.round_performance:
-                        army.round_performance = []
-                    army.round_performance.append(player2_round)
+            if not armies_stamped:
+                for army in list_of_armies:
+                    army.data_source = Data_sources.TOURNEY_KEEPER
+                    army.event_date = tk_info.event_date
+                    army.event_type = tk_info.event_type
+                armies_stamped = True
+
+            army1 = armies_by_uuid[player1_uuid]
+            army2 = armies_by_uuid[player2_uuid]
+            if not army1.round_performance:
+                army1.round_performance = []
+            army1.round_performance.append(player1_round)
+            if army2 is not army1:
+                if not army2.round_performance:
+                    army2.round_performance = []
+                army2.round_performance.append(player2_round)
 
         # Calculate who won
         for army in list_of_armies:
@@ -342,40 +561,44 @@ def append_tk_game_data(
         if any(e:=[x.player_name for x in list_of_armies if x.calculated_total_tournament_points is None]):
             raise ValueError(f"The following players do not have performance data\n {e}")
 
-        # sort armies based on performance then set the placing based on that order
-        if all([x.calculated_total_tournament_secondary_points for x in list_of_armies]):
-            list_of_armies.sort(
-                key=lambda x: (
-                    x.calculated_total_tournament_points,
-                    x.calculated_total_tournament_secondary_points,
-                ),
-                reverse=True,
-            )
-        else:
-            # sometimes secondary points are not recorded and so we can not sort on that field
-            list_of_armies.sort(
-                key=lambda x: (x.calculated_total_tournament_points,),
-                reverse=True,
-            )
-        for index, army in enumerate(list_of_armies):
-            army.list_placing = index + 1  # have to account for 0 index lists
+        # placing on performance, tied players are separated by secondary points if TK has them for everyone
+        list_of_armies[:] = rank_individuals(list_of_armies)
+
+def normalised_tk_names(tk_info: Tk_info) -> List[Optional[str]]:
+    return [normalise_name(x["Player_name"]) for x in (tk_info.player_list or {}).values()]
+
+
+def match_players_to_tk_names(tk_info: Tk_info, armies: List[ArmyEntry], tk_names: Optional[List[Optional[str]]] = None) -> None:
+    """
+    Match every player name to a TK name, scoring all the names against each other in one go
 
-def match_player_to_tk_name(tk_info: Tk_info, army: ArmyEntry) -> None:
+    tk_names are the output of normalised_tk_names() if they have already been worked out
+    """
+    if tk_info.player_list:
+        if tk_names is None:
+            tk_names = normalised_tk_names(tk_info)
+        ratio_matrix = normalised_ratio_matrix([normalise_name(army.player_name) for army in armies], tk_names)
+        for army, ratios in zip(armies, ratio_matrix):
+            match_player_to_tk_name(tk_info=tk_info, army=army, ratios=ratios)
+
+
+def match_player_to_tk_name(tk_info: Tk_info, army: ArmyEntry, ratios: Optional[List[int]] = None) -> None:
     """
     Match the player name to the TK name
+
+    ratios are the token sort ratios of the player name against each TK player in order, if already scored
     """
     if tk_info.player_list:
+        if ratios is None:
+            ratios = token_sort_ratios(army.player_name, [x["Player_name"] for x in tk_info.player_list.values()])
         # fuzzy match name from lists file and tourney keeper
         close_matches = [
             (
                 item,
                 ratio,
             )
-            for item in tk_info.player_list.items()
-            if (
-                ratio := fuzz.token_sort_ratio(item[1]["Player_name"], army.player_name)
-            )
-            > 50
+            for item, ratio in zip(tk_info.player_list.items(), ratios)
+            if ratio > 50
         ]
         if len(close_matches) > 0:
             sorted_by_fuzz_ratio = sorted(
@@ -419,6 +642,36 @@ def match_player_to_tk_name(tk_info: Tk_info, army: ArmyEntry) -> None:
                 Extra info: {extra_info}"""
             )
 
+def unmatched_names(from_file: List[str], from_tk: List[str]) -> Tuple[List[str], List[str]]:
+    """Names left on each side once every exact (token sort ratio 100) pair has been crossed off
+
+    Pairs are crossed off in file order then tk order. When a repeated file name has already been used up its
+    later matches are skipped without using up the tk name, duplicates are reported separately.
+    """
+    file_remaining = Counter(from_file)
+    tk_remaining = Counter(from_tk)
+    for x, ratios in zip(from_file, token_sort_ratio_matrix(from_file, from_tk)):
+        for y, ratio in zip(from_tk, ratios):
+            if ratio == 100 and file_remaining[x] > 0:
+                file_remaining[x] -= 1
+                if tk_remaining[y] > 0:
+                    tk_remaining[y] -= 1
+
+    def remaining(names: List[str], counts: Counter) -> List[str]:
+        # crossing a name off removes its first occurrence, so the survivors are the last `count` occurrences
+        to_skip = Counter(names)
+        to_skip.subtract(counts)
+        output = []
+        for name in names:
+            if to_skip[name] > 0:
+                to_skip[name] -= 1
+            else:
+                output.append(name)
+        return output
+
+    return remaining(from_file, file_remaining), remaining(from_tk, tk_remaining)
+
+
 def verify_tk_data(army_list: list[ArmyEntry], tk_info: Tk_info):
     if army_list:
 
@@ -466,22 +719,14 @@ def verify_tk_data(army_list: list[ArmyEntry], tk_info: Tk_info):
                 from_tk = [x["Player_name"] for x in tk_info.player_list.values()]
 
                 # difference doesn't work here because we are fuzz matching
-                unique_from_file = from_file[:]
-                unique_from_tk = from_tk[:]
-                for x in from_file:
-                    for y in from_tk:
-                        if fuzz.token_sort_ratio(x, y) == 100:
-                            try:
-                                unique_from_file.remove(x)
-                                unique_from_tk.remove(y)
-                            except ValueError:
-                                # This happens when there are 2 player names that are the same and so the value can not be removed.
-                                # This is already handled above with the message of all duplicated players so does not need handling here
-                                pass
+                unique_from_file, unique_from_tk = unmatched_names(from_file, from_tk)
 
                 # if all the "missing" tk names are not active then ignore this error
                 # additionally if the list was missing and we only have a placeholder value then also ignore the error
-                if any(missing_non_placeholder_actives:=[y.get("Player_name") for x in unique_from_tk for y in tk_info.player_list.values() if y.get("Player_name") == x and y.get("Active") and y.get("Army") != "Placeholder"]):
+                tk_players_by_name: Dict[str, List[dict]] = {}
+                for y in tk_info.player_list.values():
+                    tk_players_by_name.setdefault(y.get("Player_name"), []).append(y)
+                if any(missing_non_placeholder_actives:=[y.get("Player_name") for x in unique_from_tk for y in tk_players_by_name.get(x, []) if y.get("Active") and y.get("Army") != "Placeholder"]):
                     raise(
                         ValueError(
                             f"Lists read: {len(army_list)}\nActive players on tourneykeeper: {tk_info.player_count}\nPlayers matched: {len(matched_player_tkids)}\nPlayers in file but not TK: {unique_from_file}\nPlayers in TK but not in file: {missing_non_placeholder_actives}"
@@ -492,23 +737,77 @@ def verify_tk_data(army_list: list[ArmyEntry], tk_info: Tk_info):
             raise(ValueError(f"No tkdata was loaded into armies"))
     
 
-def armies_from_docx(event_name: str, lines: list[str]) -> Tuple[List[ArmyEntry], bool, Optional[List[Tuple[str, int]]]]:
+def load_tk_event_and_names(tourney_keeper_info: Optional[dict], force_refresh: bool) -> Tuple[Tk_info, List[Optional[str]]]:
+    tk_info = load_tk_event(tourney_keeper_info, force_refresh)
+    return tk_info, normalised_tk_names(tk_info)
+
+
+def tk_name_diagnostics(tk_info: Tk_info, tk_names: List[Optional[str]], headers: List[ArmyEntry]) -> List[Exception]:
+    """Every name matching problem for the lists in a file at once, rather than stopping at the first"""
+    errors: List[Exception] = []
+    ratio_matrix = normalised_ratio_matrix([normalise_name(x.player_name) for x in headers], tk_names)
+    for army, ratios in zip(headers, ratio_matrix):
+        try:
+            match_player_to_tk_name(tk_info=tk_info, army=army, ratios=ratios)
+        except ValueError as e:
+            errors.append(e)
+    try:
+        verify_tk_data(army_list=headers, tk_info=tk_info)
+    except ValueError as e:
+        errors.append(e)
+    return errors
+
+
+def armies_from_docx(
+    event_name: str, lines: Iterable[str], refresh_tk: bool = False, match_first: Optional[bool] = None
+) -> Tuple[List[ArmyEntry], bool, Optional[List[Tuple[str, int]]]]:
+    """
+    Args:
+        refresh_tk (bool): ignore any snapshot of the TK event
+        match_first (Optional[bool]): check the event and player names against TK from the raw lists before any
+            formatting, and stop there if they don't line up. Set per upload through the object's custom metadata,
+            defaults to the DOCX_MATCH_FIRST environment variable.
+    """
+    if match_first is None:
+        match_first = environ.get("DOCX_MATCH_FIRST", "").lower() == "true"
+
     tk_loaded:bool = False
-    tk_info = load_tk_info(event_name)
-    armies = Convert_lines_to_army_list(event_name=event_name, event_date=tk_info.event_date, lines=lines)
+    # finding the event is a catalogue lookup, its start date is all the formatting needs from TK so fetching the
+    # event's games and players runs alongside the formatting and only has to be done by the time names are matched
+    tourney_keeper_info = Get_tournament_by_name(event_name)
+    if match_first:
+        if not tourney_keeper_info:
+            return [], tk_loaded, get_tournament_index().similar(event_name, 80)
+        tk_info, tk_names = load_tk_event_and_names(tourney_keeper_info, refresh_tk)
+        if not (tk_info.game_list and tk_info.player_list):
+            # nothing on TK to join the lists to, so formatting them would only be thrown away
+            return [], tk_loaded, get_tournament_index().similar(event_name, 80)
+        lines = list(lines)
+        headers = read_block_headers(lines)
+        if not refresh_tk:
+            tk_info, tk_names = recheck_unmatched_players(tk_info, tk_names, [x.player_name for x in headers])
+        if errors := tk_name_diagnostics(tk_info, tk_names, headers):
+            raise Multi_Error(errors)
+        armies = Convert_lines_to_army_list(event_name=event_name, event_date=tk_info.event_date, lines=lines)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="tk-event") as executor:
+            tk_future = submit_in_context(executor, load_tk_event_and_names, tourney_keeper_info, refresh_tk)
+            try:
+                armies = Convert_lines_to_army_list(event_name=event_name, event_date=tk_event_date(tourney_keeper_info), lines=lines)
+            except Exception:
+                # TK failures were reported ahead of list errors when TK was loaded first, keep it that way
+                tk_future.result()
+                raise
+            tk_info, tk_names = tk_future.result()
     if tk_info and tk_info.game_list and tk_info.player_list: #game was found on tk
         tk_loaded = True
-        for army in armies:
-            match_player_to_tk_name(tk_info=tk_info, army=army)
+        if not refresh_tk and not match_first:
+            tk_info, tk_names = recheck_unmatched_players(tk_info, tk_names, [x.player_name for x in armies])
+        match_players_to_tk_names(tk_info=tk_info, armies=armies, tk_names=tk_names)
         append_tk_game_data(tk_info=tk_info, list_of_armies=armies)
         verify_tk_data(army_list=armies, tk_info=tk_info)
     else:
-        possible_tk_names: list[Tuple[str, int]] = []
-        recent_tournaments = get_recent_tournaments()
-        for tournament in recent_tournaments:
-            ratio = fuzz.token_sort_ratio(event_name, tournament.get("Name"))
-            if ratio > 80:
-                possible_tk_names.append((tournament.get("Name", ""), ratio))
+        possible_tk_names: list[Tuple[str, int]] = get_tournament_index().similar(event_name, 80)
         return [], tk_loaded, possible_tk_names
     return armies, tk_loaded, None
 
@@ -0,0 +1,71 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import re
+from functools import partial
+from os import environ
+from threading import Lock
+from typing import Callable, Dict, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from resilience import submit_in_context
+
+T = TypeVar("T")
+
+DEFAULT_MAX_CONCURRENCY = 16
+
+
+def max_concurrency_for(host: str) -> int:
+    """UPSTREAM_MAX_CONCURRENCY_<HOST> eg UPSTREAM_MAX_CONCURRENCY_WWW_9THBUILDER_COM=8, falling back to UPSTREAM_MAX_CONCURRENCY"""
+    host_variable = "UPSTREAM_MAX_CONCURRENCY_" + re.sub(r"\W", "_", host).upper()
+    return int(
+        environ.get(host_variable)
+        or environ.get("UPSTREAM_MAX_CONCURRENCY")
+        or DEFAULT_MAX_CONCURRENCY
+    )
+
+
+class Upstream_pool:
+    """One keep-alive session and one set of worker threads per upstream host
+
+    The worker count is the concurrency cap for the host, and since the pool is shared by every conversion in the
+    instance the cap holds across concurrent callers too. The session's connection pool is sized to match so
+    every worker gets to reuse a connection instead of opening a new TLS connection.
+    """
+
+    def __init__(self, host: str, max_concurrency: int) -> None:
+        self.host = host
+        self.max_concurrency = max_concurrency
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix=f"upstream-{host}"
+        )
+
+    def submit(self, fn: Callable[..., T], *args, **kwargs) -> "concurrent.futures.Future[T]":
+        return submit_in_context(self.executor, fn, *args, **kwargs)
+
+    def run(self, fn: Callable[..., T], *args, **kwargs) -> "asyncio.Future[T]":
+        """Run a blocking call on this host's workers from a coroutine, the work starts straight away"""
+        loop = asyncio.get_running_loop()
+        # run_in_executor doesn't carry the context over either, and with it the invocation's deadline
+        return loop.run_in_executor(self.executor, partial(contextvars.copy_context().run, fn, *args, **kwargs))
+
+
+_pools: Dict[str, Upstream_pool] = {}
+_pools_lock = Lock()
+
+
+def get_upstream_pool(host: str) -> Upstream_pool:
+    with _pools_lock:
+        pool = _pools.get(host)
+        if pool is None:
+            pool = Upstream_pool(host, max_concurrency_for(host))
+            _pools[host] = pool
+        return pool
@@ -1,7 +1,7 @@
 import re
 import warnings
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional
 
 import jsons
 from docx import Document
@@ -9,8 +9,12 @@ from docx.text.paragraph import Paragraph
 
 from data_classes import ArmyEntry
 
-def clean_lines(lines: List[str]) -> List[str]:
-    cleaned_lines = []
+def clean_lines(lines: Iterable[str]) -> List[str]:
+    return list(iter_clean_lines(lines))
+
+
+def iter_clean_lines(lines: Iterable[str]) -> Iterator[str]:
+    """Generator version of clean_lines() so cleaning can run while the document is still being read"""
     for line in lines:
         text = line.strip()  # remove leading and trailing whitespace
         text = text.replace("<b>", "").replace("</b>", "").replace("<br>", "\n").replace("<br/>", "\n") #remove weird html tags
@@ -21,24 +25,22 @@ def clean_lines(lines: List[str]) -> List[str]:
             if (
                 len(section) > 0
             ):  # hard coded ignore empty lines need to handle army short names aka "BH" or player names like `M`
-                cleaned_lines.append(
-                    " ".join(section.split())
-                )  # remove weird unicode spaces \xa0
-    return cleaned_lines
+                yield " ".join(section.split())  # remove weird unicode spaces \xa0
 
 
 def Docx_to_line_list(docxFile) -> List[str]:
+    return list(iter_docx_lines(docxFile))
+
+
+def iter_docx_lines(docxFile) -> Iterator[str]:
+    """Yield the text of each paragraph in the document, one paragraph at a time"""
     # remove hyperlinks as they are treated different to paragraphs especially when that is all that is on the line.
     # This is explained https://github.com/python-openxml/python-docx/issues/85#issuecomment-917134257
     Paragraph.text = property(lambda self: GetParagraphText(self))
     doc = Document(docxFile)
 
-    lines = []  # ALL the text in the file, separated by lines
-
-    par = doc.paragraphs
-    for line in par:
-        lines.append(line.text)
-    return lines
+    for paragraph in doc.paragraphs:
+        yield paragraph.text
 
 
 # For avoiding hyperlinks https://github.com/python-openxml/python-docx/issues/85#issuecomment-917134257
@@ -60,6 +62,20 @@ def GetParagraphText(paragraph):
     return text
 
 
+def upload_option(data: dict, name: str) -> Optional[bool]:
+    """A true/false option for one upload, None if it wasn't given
+
+    Organisers set these as custom metadata on the uploaded object (gsutil -h "x-goog-meta-<name>:true" cp ...), which
+    arrives as strings under "metadata" in the storage event. A request made by hand may also put them in the data.
+    """
+    value = (data.get("metadata") or {}).get(name, data.get(name))
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() == "true"
+    return bool(value)
+
+
 def Is_int(n) -> bool:
     try:
         float(n)
@@ -0,0 +1,59 @@
+"""Time New Recruit event conversions end to end against the local stand-in, no network needed
+
+    python scripts/standin_server.py --quiet --latency 0.3 &
+    python scripts/benchmark_conversion.py --standin http://localhost:8765
+
+Each tournament in tests/fixtures/new_recruit is converted the same way the integration test builds its payload.
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+from time import perf_counter
+
+repo_root = Path(__file__).parent.parent
+fixtures = repo_root / "tests" / "fixtures" / "new_recruit"
+
+
+def stored_data_for(tournament_file: Path) -> dict:
+    tournament = json.loads(tournament_file.read_text(encoding="utf-8"))
+    games = json.loads((fixtures / tournament_file.name.replace("tournament_", "games_")).read_text(encoding="utf-8"))
+    return {
+        "name": tournament.get("name"),
+        "games": games,
+        "country_name": "",
+        "country_flag": "",
+        "participants_per_team": 0,
+        "team_point_cap": 0,
+        "team_point_min": 0,
+        "type": tournament.get("type", 0),
+        "teams": tournament.get("teams", []),
+        "rounds": len(tournament.get("rounds") or []),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--standin", default="http://localhost:8765", help="base url of scripts/standin_server.py")
+    parser.add_argument("--limit", type=int, default=None, help="only convert this many events")
+    args = parser.parse_args()
+
+    # must be set before the conversion modules are imported as they read their upstreams at import time
+    for variable in ("NINTH_BUILDER_URL", "NEW_RECRUIT_API_URL", "NEW_RECRUIT_URL", "TOURNEY_KEEPER_URL"):
+        os.environ[variable] = args.standin
+    os.environ.setdefault("FORMAT_CACHE_DIR", str(Path("/tmp") / "benchmark-format-cache"))
+    sys.path.insert(0, str(repo_root / "function_data_conversion"))
+    from new_recruit_tournaments import armies_from_NR_tournament
+    from ninth_builder import format_cache
+
+    tournament_files = sorted(x for x in fixtures.glob("tournament_*.json") if (fixtures / x.name.replace("tournament_", "games_")).exists())
+    total_start = perf_counter()
+    total_armies = 0
+    for tournament_file in tournament_files[: args.limit]:
+        stored_data = stored_data_for(tournament_file)
+        start = perf_counter()
+        armies, errors = armies_from_NR_tournament(stored_data)
+        total_armies += len(armies)
+        print(f"{perf_counter() - start:7.2f}s  {len(armies):4} armies  {len(errors):3} errors  {stored_data['name']}")
+    print(f"Total {perf_counter() - total_start:.2f}s for {total_armies} armies, format cache {format_cache.stats()}")
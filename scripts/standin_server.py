@@ -0,0 +1,241 @@
+"""Local stand-in for 9th Builder, New Recruit and TourneyKeeper so conversions can be run and timed without the network
+
+    python scripts/standin_server.py --port 8765 --latency 0.3 --jitter 0.2 --error-rate 0.05
+
+then point function_data_conversion at it
+
+    NINTH_BUILDER_URL=http://localhost:8765
+    NEW_RECRUIT_API_URL=http://localhost:8765
+    NEW_RECRUIT_URL=http://localhost:8765
+    TOURNEY_KEEPER_URL=http://localhost:8765
+
+What is served
+    9th Builder imports/format   echoes the block back as already formatted with no validation errors
+    New Recruit listcheck        a clean list, no errors
+    New Recruit get_library      function_data_conversion/data/library.json, with an ETag for conditional requests
+    New Recruit tournament       tests/fixtures/new_recruit/tournament_<id>.json
+    New Recruit reports          tests/fixtures/new_recruit/games_<id>.json
+    TourneyKeeper WebAPI         recordings in tests/fixtures/tourney_keeper, made with `record-tk`
+                                 a small made up event, Stand-in Open 2024 (99001), is checked in
+
+Recording a TourneyKeeper event (this one does need the network)
+
+    python scripts/standin_server.py record-tk <tournament id>
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+repo_root = Path(__file__).parent.parent
+new_recruit_fixtures = repo_root / "tests" / "fixtures" / "new_recruit"
+tourney_keeper_fixtures = repo_root / "tests" / "fixtures" / "tourney_keeper"
+library_file = repo_root / "function_data_conversion" / "data" / "library.json"
+
+
+class Recordings:
+    """Everything the stand-in replays, loaded once at startup
+
+    TourneyKeeper recordings are laid out as
+        tournaments.json                 [tournament, ...] as returned inside GetTournaments
+        games_<tournament id>.json       [game, ...] as returned inside GetGamesForTournament
+        players_<tournament id>.json     [player army details, ...] one per GetPlayerArmyDetails call
+    """
+
+    def __init__(self, new_recruit_dir: Path, tourney_keeper_dir: Path) -> None:
+        self.new_recruit_dir = new_recruit_dir
+        self.library = library_file.read_bytes()
+        self.library_etag = '"' + hashlib.sha256(self.library).hexdigest()[:16] + '"'
+
+        self.tk_tournaments: list[dict] = []
+        self.tk_games: dict[int, list[dict]] = {}
+        self.tk_players: dict[int, dict] = {}
+        self.tk_active_players: dict[int, int] = {}
+        if (tourney_keeper_dir / "tournaments.json").exists():
+            self.tk_tournaments = json.loads((tourney_keeper_dir / "tournaments.json").read_text(encoding="utf-8"))
+        for path in tourney_keeper_dir.glob("games_*.json"):
+            self.tk_games[int(path.stem.split("_", 1)[1])] = json.loads(path.read_text(encoding="utf-8"))
+        for path in tourney_keeper_dir.glob("players_*.json"):
+            players = json.loads(path.read_text(encoding="utf-8"))
+            self.tk_active_players[int(path.stem.split("_", 1)[1])] = sum(1 for x in players if x.get("Active"))
+            for details in players:
+                self.tk_players[details["TournamentPlayerId"]] = details
+
+    def new_recruit_fixture(self, kind: str, event_id: str) -> Optional[bytes]:
+        path = self.new_recruit_dir / f"{kind}_{Path(event_id).name}.json"
+        if path.exists():
+            return path.read_bytes()
+        return None
+
+
+def tk_message(data) -> dict:
+    """TourneyKeeper wraps every payload as a json string inside a json envelope"""
+    return {"Success": True, "Message": data if isinstance(data, str) else json.dumps(data)}
+
+
+class Standin_handler(BaseHTTPRequestHandler):
+    recordings: Recordings
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+
+    def log_message(self, format: str, *args) -> None:
+        if not self.server.quiet:  # type: ignore[attr-defined]
+            super().log_message(format, *args)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _json_body(self) -> dict:
+        body = self._body()
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        return {k: v[0] for k, v in parse_qs(body.decode("utf-8")).items()}
+
+    def _send(self, status: int, data=None, raw: Optional[bytes] = None, headers: Optional[dict] = None) -> None:
+        body = raw if raw is not None else json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate_upstream(self) -> bool:
+        """Sleep like a remote call would, returns False if this request should fail"""
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if random.random() < self.error_rate:
+            self._send(503, {"error": "injected failure"})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if not self._simulate_upstream():
+            return
+
+        if url.path == "/api/rpc" and query.get("m") == "get_library":
+            etag = self.recordings.library_etag
+            if self.headers.get("If-None-Match") == etag:
+                self._send(304, raw=b"", headers={"ETag": etag})
+            else:
+                self._send(200, raw=self.recordings.library, headers={"ETag": etag})
+        elif url.path == "/WebAPI/Tournament/GetTournaments":
+            self._send(200, tk_message({"Tournaments": self.recordings.tk_tournaments}))
+        elif url.path == "/WebAPI/Game/GetGamesForTournament":
+            games = self.recordings.tk_games.get(int(query.get("tournamentId", 0)))
+            self._send(200, tk_message({"Games": games or []}))
+        elif url.path == "/WebAPI/TournamentPlayer/GetPlayerArmyDetails":
+            details = self.recordings.tk_players.get(int(query.get("tournamentPlayerId", 0)))
+            self._send(200, tk_message(details) if details else {"Success": False, "Message": ""})
+        else:
+            self._send(404, {"error": f"stand-in has nothing for GET {url.path}"})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        body = self._json_body()
+        if not self._simulate_upstream():
+            return
+
+        if url.path == "/en/api/v1/builder/imports/format":
+            self._send(
+                200,
+                {
+                    "original": body.get("data"),
+                    "formated": body.get("data"),
+                    "army": None,
+                    "units": None,
+                    "validation": {"hasError": False, "errors": []},
+                },
+            )
+        elif url.path == "/api/listcheck":
+            self._send(200, [])
+        elif url.path == "/api/tournament":
+            self._send_fixture("tournament", body.get("id", ""))
+        elif url.path == "/api/reports":
+            self._send_fixture("games", body.get("id_tournament", ""))
+        elif url.path == "/WebAPI/Tournament/GetActivePlayers":
+            self._send(200, tk_message(str(self.recordings.tk_active_players.get(int(body.get("Id", 0)), 0))))
+        else:
+            self._send(404, {"error": f"stand-in has nothing for POST {url.path}"})
+
+    def _send_fixture(self, kind: str, event_id: str) -> None:
+        fixture = self.recordings.new_recruit_fixture(kind, event_id)
+        if fixture is None:
+            self._send(404, {"error": f"no {kind} fixture for {event_id}"})
+        else:
+            self._send(200, raw=fixture)
+
+
+def record_tourney_keeper(tournament_id: int, output_dir: Path) -> None:
+    """Save everything the conversion asks TourneyKeeper about one event, in the layout Recordings reads"""
+    sys.path.insert(0, str(repo_root / "function_data_conversion"))
+    from tourney_keeper import (Get_games_for_tournament,
+                                Get_Player_Army_Details,
+                                get_recent_tournaments)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tournaments_file = output_dir / "tournaments.json"
+    tournaments = json.loads(tournaments_file.read_text(encoding="utf-8")) if tournaments_file.exists() else []
+    tournament = next((x for x in get_recent_tournaments() if x.get("Id") == tournament_id), None)
+    if tournament is None:
+        raise ValueError(f"TK tournament {tournament_id} is not in the recent tournaments")
+    tournaments = [x for x in tournaments if x.get("Id") != tournament_id] + [tournament]
+    tournaments_file.write_text(json.dumps(tournaments, indent=2), encoding="utf-8")
+
+    games = Get_games_for_tournament(tournament_id) or []
+    (output_dir / f"games_{tournament_id}.json").write_text(json.dumps(games, indent=2), encoding="utf-8")
+
+    player_ids = {x.get("Player1Id") for x in games} | {x.get("Player2Id") for x in games}
+    players = [details for x in player_ids if (details := Get_Player_Army_Details(x))]
+    (output_dir / f"players_{tournament_id}.json").write_text(json.dumps(players, indent=2), encoding="utf-8")
+    print(f"Recorded {tournament.get('Name')}: {len(games)} games, {len(players)} players")
+
+
+def serve(args: argparse.Namespace) -> None:
+    Standin_handler.recordings = Recordings(args.new_recruit_dir, args.tourney_keeper_dir)
+    Standin_handler.latency = args.latency
+    Standin_handler.jitter = args.jitter
+    Standin_handler.error_rate = args.error_rate
+
+    server = ThreadingHTTPServer((args.host, args.port), Standin_handler)
+    server.quiet = args.quiet  # type: ignore[attr-defined]
+    print(f"Stand-in listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra random seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--quiet", action="store_true", help="don't log every request")
+    parser.add_argument("--new-recruit-dir", type=Path, default=new_recruit_fixtures)
+    parser.add_argument("--tourney-keeper-dir", type=Path, default=tourney_keeper_fixtures)
+    subparsers = parser.add_subparsers(dest="command")
+    record_parser = subparsers.add_parser("record-tk", help="record a TourneyKeeper event for replay")
+    record_parser.add_argument("tournament_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "record-tk":
+        record_tourney_keeper(args.tournament_id, args.tourney_keeper_dir)
+    else:
+        serve(args)